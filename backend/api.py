@@ -1,9 +1,37 @@
-from fastapi import FastAPI, Query
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Union
+
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from search_dpdp import search
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field
+from search_dpdp import metadata_filter, search, search_many
+from inference import InferencePool, PoolSaturated, ClientDisconnected, Warmup
+import cache
+import config
+import metrics
+import snapshots
 import uvicorn
 
-app = FastAPI(title="DPDP Compliance Engine API")
+# Encoding + Chroma queries run on this pool, off the event loop
+pool = InferencePool(warm_modules=("search_dpdp",))
+warmup = Warmup(pool, "search_dpdp")
+
+@asynccontextmanager
+async def lifespan(app):
+    pool.start()
+    warmup.start()
+    if config.WARMUP == "blocking":
+        await warmup.wait()
+    yield
+    warmup.cancel()
+    pool.shutdown()
+
+# JSON rendering shows up as the "serialize" stage
+app = FastAPI(
+    title="DPDP Compliance Engine API", lifespan=lifespan, default_response_class=metrics.timed_response(JSONResponse)
+)
 
 # Enable CORS for React frontend
 app.add_middleware(
@@ -11,26 +39,147 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Debug-Timing", "X-Profile-Path", "X-Profile-Skipped", "X-Index-Version"],
 )
+app.middleware("http")(metrics.asgi_middleware)
+app.middleware("http")(snapshots.asgi_middleware)
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated(request, exc):
+    return JSONResponse({"error": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(asyncio.TimeoutError)
+async def search_timeout(request, exc):
+    return JSONResponse({"error": "Search timed out"}, status_code=504)
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected(request, exc):
+    return JSONResponse({"error": "Client disconnected"}, status_code=499)
 
 @app.get("/")
 def home():
     return {"status": "online", "engine": "DPDP RAG v1.0"}
 
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up, whether or not the model has loaded."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 once the model and chunk index are loaded, else 503."""
+    ready, details = warmup.status()
+    return JSONResponse(details, status_code=200 if ready else 503)
+
+def search_filter(chapter, section):
+    try:
+        return metadata_filter(chapter, section)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/search")
-def run_search(q: str = Query(..., min_length=3), top_k: int = 3):
+async def run_search(
+    request: Request,
+    q: str = Query(..., min_length=3),
+    top_k: int = 3,
+    lexical_weight: Optional[float] = Query(None, ge=0, le=1),
+    fusion: Optional[Literal["rrf", "weighted"]] = None,
+    chapter: Optional[str] = None,
+    section: Optional[List[str]] = Query(None),
+    rerank: bool = False,
+    rerank_budget_ms: Optional[float] = Query(None, gt=0)
+):
     """
-    Semantic search across the DPDP Act.
-    Returns the most relevant sections/clauses based on the input query.
+    Hybrid (semantic + BM25) search across the DPDP Act.
+    Returns the most relevant sections/clauses based on the input query;
+    lexical_weight=0 searches by embeddings only. chapter ("II") and
+    section (repeatable) restrict the search; rerank=true reorders the
+    candidates with the cross-encoder.
     """
+    where = search_filter(chapter, section)
     try:
-        results = search(q, top_k=top_k)
+        results = await pool.submit(pool.run(search, q, top_k, lexical_weight, fusion, where, rerank, rerank_budget_ms), request.is_disconnected)
         return {
             "query": q,
+            "version": snapshots.version(),
             "results": results
         }
+    except (PoolSaturated, asyncio.TimeoutError, ClientDisconnected):
+        raise
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+class BatchSearch(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=config.SEARCH_BATCH_MAX)
+    top_k: int = Field(3, ge=1, le=50)
+    chapter: Optional[str] = None
+    section: Optional[Union[str, List[str]]] = None
+    lexical_weight: Optional[float] = Field(None, ge=0, le=1)
+    fusion: Optional[Literal["rrf", "weighted"]] = None
+    rerank: bool = False
+    rerank_budget_ms: Optional[float] = Field(None, gt=0)
+
+@app.post("/search/batch")
+async def run_search_batch(q: BatchSearch, request: Request):
+    """
+    Search many queries in one round trip (e.g. a checklist of findings):
+    they are encoded together and sent to the vector store as one query.
+    """
+    where = search_filter(q.chapter, q.section)
+    try:
+        results = await pool.submit(
+            pool.run(search_many, q.queries, q.top_k, where, q.lexical_weight, q.fusion, q.rerank, q.rerank_budget_ms),
+            request.is_disconnected
+        )
+        return {
+            "version": snapshots.version(),
+            "results": [{"query": query, "results": r} for query, r in zip(q.queries, results)]
+        }
+    except (PoolSaturated, asyncio.TimeoutError, ClientDisconnected):
+        raise
     except Exception as e:
-        return {"error": str(e)}
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return cache.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's latency histograms and counters."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/cache/clear")
+def cache_clear(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    cache.query_embeddings.clear()
+    cache.invalidate_results()
+    return {"status": "success"}
+
+def check_admin(token):
+    if not snapshots.authorized(token):
+        raise HTTPException(status_code=403, detail="Admin token missing or invalid; /admin and /cache/clear need DPDP_ADMIN_TOKEN set")
+
+@app.get("/admin/snapshots")
+def admin_snapshots(x_admin_token: Optional[str] = Header(None)):
+    """The active index snapshot, the one CURRENT names, and every snapshot on disk."""
+    check_admin(x_admin_token)
+    return {**snapshots.status(), "snapshots": snapshots.list_snapshots()}
+
+@app.post("/admin/snapshots/{action}")
+def admin_snapshot_action(
+    action: Literal["reload", "activate", "rollback"],
+    version: Optional[str] = Body(None, embed=True),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Load, activate or roll back an index snapshot; it is swapped in once loaded (see snapshots.py)."""
+    check_admin(x_admin_token)
+    try:
+        return snapshots.admin(action, version)
+    except (LookupError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404 if isinstance(e, FileNotFoundError) else 409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
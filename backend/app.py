@@ -1,9 +1,74 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from rag import query_dpdp
+from rag import (
+    query_dpdp, split_findings, encode_findings, resolve_references, map_findings, format_results, warm_up, readiness,
+    get_section, section_outline, get_index_version
+)
+from lexical import fusion_options
+from segmenter import dedupe, expand
+from scoring import score_mappings
+from crosswalk import crosswalk
+import cache
+import config
+import metrics
+import snapshots
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() timed as the "serialize" stage."""
+
+    def dumps(self, obj, **kwargs):
+        with metrics.stage("serialize"):
+            return super().dumps(obj, **kwargs)
 
 app = Flask(__name__)
-CORS(app)
+app.json = TimedJSONProvider(app)
+CORS(app, expose_headers=["X-Debug-Timing", "X-Profile-Path", "X-Profile-Skipped", "X-Index-Version"])
+
+# Start loading the model now so the first request doesn't pay for it
+warm_up(background=config.WARMUP != "blocking")
+
+@app.before_request
+def start_timer():
+    g.timer = metrics.RequestTimer(request.method, request.path, request.headers)
+    # The whole request is served by the index snapshot active now
+    g.snapshot = snapshots.bind()
+
+@app.after_request
+def finish_timer(response):
+    timer = g.pop("timer", None)
+    if timer is not None:
+        timer.finish(request.url_rule.rule if request.url_rule else "unmatched", response.status_code, response.headers)
+    token = g.pop("snapshot", None)
+    if token is not None:
+        response.headers["X-Index-Version"] = snapshots.version()
+        snapshots.release(token)
+    return response
+
+def mapping_options(data):
+    """Read mapping options from a request body, raising ValueError when invalid."""
+    opts = {
+        "top_k": int(data.get("top_k", 1)),
+        "threshold": float(data.get("threshold", 0.3)),
+        "granularity": data.get("granularity", "section"),
+        "aggregation": data.get("aggregation", "max"),
+        "lexical_weight": data.get("lexical_weight"),
+        "fusion": data.get("fusion"),
+        "rerank": data.get("rerank", False) is True,
+        "rerank_budget_ms": data.get("rerank_budget_ms"),
+    }
+    if not 1 <= opts["top_k"] <= 50:
+        raise ValueError("top_k must be between 1 and 50")
+    if opts["granularity"] not in ("section", "clause"):
+        raise ValueError("granularity must be 'section' or 'clause'")
+    if opts["aggregation"] not in ("max", "mean"):
+        raise ValueError("aggregation must be 'max' or 'mean'")
+    if opts["rerank_budget_ms"] is not None:
+        opts["rerank_budget_ms"] = float(opts["rerank_budget_ms"])
+        if opts["rerank_budget_ms"] <= 0:
+            raise ValueError("rerank_budget_ms must be positive")
+    opts["lexical_weight"], opts["fusion"] = fusion_options(opts["lexical_weight"], opts["fusion"])
+    return opts
 
 @app.route("/analyze", methods=["POST"])
 def analyze():
@@ -14,24 +79,138 @@ def analyze():
         if not query_text:
             return jsonify({"error": "No input provided"}), 400
 
-        mappings = query_dpdp(query_text)
-        
-        results = []
-        for m in mappings:
-            results.append({
-                "finding": m["finding"],
-                "section": m["section_number"],
-                "title": m["section_title"],
-                "chapter": m["chapter"],
-                "description": m["description"]
-            })
+        try:
+            opts = mapping_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        mappings = query_dpdp(query_text, **opts)
             
         return jsonify({
             "status": "success",
-            "results": results
+            "version": get_index_version(),
+            "results": format_results(mappings, data.get("include_text", True) is not False),
+            "compliance": score_mappings(mappings)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/analyze/batch", methods=["POST"])
+def analyze_batch():
+    try:
+        data = request.json
+        inputs = data.get("inputs")
+
+        if not inputs or not isinstance(inputs, list):
+            return jsonify({"error": "No inputs provided"}), 400
+
+        try:
+            opts = mapping_options(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Flask serves requests synchronously, so batch within the request:
+        # one encode call covers every document's findings that cite no section
+        per_doc = [split_findings(text or "") for text in inputs]
+        # Repeated and near-duplicate findings within a document are mapped once
+        deduped = [dedupe(findings) for findings in per_doc]
+        references = [resolve_references(unique, opts["top_k"]) for unique, _ in deduped]
+        all_findings = [unique[j] for (unique, _), (_, pending) in zip(deduped, references) for j in pending]
+        query_embs = encode_findings(all_findings) if all_findings else None
+
+        documents = []
+        offset = 0
+        for i, (findings, (unique, occurrences), refs) in enumerate(zip(per_doc, deduped, references)):
+            mappings = []
+            if findings:
+                n_pending = len(refs[1])
+                embs = query_embs[offset:offset + n_pending] if n_pending else None
+                mappings = expand(map_findings(unique, embs, references=refs, **opts), findings, occurrences)
+                offset += n_pending
+            documents.append({
+                "index": i,
+                "results": format_results(mappings, data.get("include_text", True) is not False),
+                "compliance": score_mappings(mappings)
+            })
+
+        return jsonify({
+            "status": "success",
+            "version": get_index_version(),
+            "documents": documents
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route("/sections", methods=["GET"])
+def list_sections():
+    try:
+        return jsonify({"sections": section_outline()})
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 503
+
+@app.route("/sections/<section_id>", methods=["GET"])
+def read_section(section_id):
+    try:
+        record = get_section(section_id, request.args.get("include_text", "true").lower() != "false")
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 503
+    if record is None:
+        return jsonify({"error": f"Unknown section or clause: {section_id}"}), 404
+    return jsonify(record)
+
+@app.route("/crosswalk", methods=["GET"])
+def read_crosswalk():
+    try:
+        table = crosswalk.get()
+    except (OSError, ValueError, KeyError) as e:
+        return jsonify({"error": f"Crosswalk unavailable: {e}"}), 503
+    etag = f'"{table.version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers={"ETag": etag})
+    control = request.args.get("control")
+    body = table.export(request.args.get("framework"), control)
+    if control is not None and not body["controls"]:
+        return jsonify({"error": f"Unknown control: {control}"}), 404
+    response = jsonify(body)
+    response.headers["ETag"] = etag
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(cache.stats())
+
+@app.route("/admin/snapshots", methods=["GET"])
+def admin_snapshots():
+    if not snapshots.authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "Admin token missing or invalid; /admin needs DPDP_ADMIN_TOKEN set"}), 403
+    return jsonify({**snapshots.status(), "snapshots": snapshots.list_snapshots()})
+
+@app.route("/admin/snapshots/<action>", methods=["POST"])
+def admin_snapshot_action(action):
+    if not snapshots.authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "Admin token missing or invalid; /admin needs DPDP_ADMIN_TOKEN set"}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(snapshots.admin(action, data.get("version")))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
 if __name__ == "__main__":
     app.run(port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Cross-request micro-batching for query encoding.
+
+Concurrent requests each submit their sentences; a single background task
+coalesces them into one encode call of up to ``max_batch_size`` sentences
+(waiting at most ``max_wait_ms`` for the batch to fill) and hands each
+request back its own slice of the embedding matrix.
+"""
+import asyncio
+
+import config
+import metrics
+
+
+class MicroBatcher:
+    def __init__(self, encode_fn, max_batch_size=None, max_wait_ms=None, runner=None):
+        self.encode_fn = encode_fn
+        # Async callable ``runner(fn, *args)``; defaults to the loop's executor
+        self.runner = runner
+        self.max_batch_size = max_batch_size or config.BATCH_MAX_SIZE
+        self.max_wait = (config.BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        """Start the batching loop on the running event loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+
+    async def encode(self, sentences):
+        """Encode ``sentences`` as part of the next shared batch."""
+        if not sentences:
+            return None
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(sentences), future, metrics.current_profiler()))
+        return await future
+
+    async def _collect(self):
+        """Wait for one request, then keep filling until the batch is full or the wait expires."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _encode(self, sentences):
+        if self.runner is not None:
+            return await self.runner(self.encode_fn, sentences)
+        return await asyncio.get_running_loop().run_in_executor(None, self.encode_fn, sentences)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Requests whose client already went away don't need encoding
+            batch = [(s, f, p) for s, f, p in batch if not f.cancelled()]
+            if not batch:
+                continue
+
+            sentences = [s for item, _, _ in batch for s in item]
+            # A profiled request sees the shared encode in its report
+            profiler = next((p for _, _, p in batch if p is not None), None)
+            try:
+                with metrics.profiling(profiler):
+                    embeddings = await self._encode(sentences)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for item, future, _ in batch:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(item)])
+                offset += len(item)
@@ -0,0 +1,226 @@
+"""
+Bounded in-process caches for query embeddings and mapping results.
+
+Auditors resubmit the same canned findings, so each normalized sentence is
+encoded once and each (query, options) mapping is computed once per index
+version. Both caches are LRU with a byte budget and a TTL, count hits and
+misses for the /cache/stats endpoints, and are thread-safe so inference
+pool threads can share them.
+
+Query embeddings can additionally be kept in a SQLite file
+(DPDP_CACHE_SQLITE_PATH) so they survive restarts and are shared by every
+worker process.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+MISSING = object()
+
+
+def approx_size(value):
+    """Rough byte size of a cached value (arrays, strings and nested containers)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approx_size(v) for v in value)
+    return 32
+
+
+class LRUCache:
+    def __init__(self, name, max_bytes, ttl):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value or ``MISSING``."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return MISSING
+            value, size, expires = item
+            if expires < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = approx_size(key) + approx_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SQLiteEmbeddingStore:
+    """Persistent embedding tier shared across processes (WAL mode)."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, dim INTEGER, vec BLOB, created REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        found = {}
+        # SQLite limits bound parameters per statement
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vec FROM query_embeddings WHERE created >= ? AND key IN ({','.join('?' * len(part))})",
+                [cutoff, *part],
+            ).fetchall()
+            for key, vec in rows:
+                found[key] = np.frombuffer(vec, dtype=np.float32)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (key, dim, vec, created) VALUES (?, ?, ?, ?)",
+                [(k, v.shape[0], np.ascontiguousarray(v, dtype=np.float32).tobytes(), now) for k, v in items],
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM query_embeddings")
+
+    def stats(self):
+        count = self._connect().execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        return {"path": self.path, "entries": count, "hits": self.hits, "misses": self.misses}
+
+
+query_embeddings = LRUCache("query_embeddings", config.CACHE_EMBEDDINGS_MAX_BYTES, config.CACHE_TTL_S)
+query_results = LRUCache("query_results", config.CACHE_RESULTS_MAX_BYTES, config.CACHE_TTL_S)
+disk_embeddings = SQLiteEmbeddingStore(config.CACHE_SQLITE_PATH, config.CACHE_TTL_S) if config.CACHE_SQLITE_PATH else None
+
+
+def normalize_text(text):
+    # all-MiniLM-L6-v2 is uncased, so case and spacing don't change the embedding
+    return " ".join(text.lower().split())
+
+
+def cached_encode(model_name, texts, encode_fn):
+    """
+    Encode ``texts`` through the memory (and optional SQLite) cache.
+    ``encode_fn`` is called once, with only the distinct uncached texts.
+    """
+    keys = [f"{model_name}\x00{normalize_text(t)}" for t in texts]
+    vectors = {}
+    missing = []
+    for key, text in zip(keys, texts):
+        if key in vectors:
+            continue
+        value = query_embeddings.get(key)
+        if value is MISSING:
+            vectors[key] = None
+            missing.append((key, text))
+        else:
+            vectors[key] = value
+
+    if missing and disk_embeddings is not None:
+        found = disk_embeddings.get_many([k for k, _ in missing])
+        for key, vec in found.items():
+            vectors[key] = vec
+            query_embeddings.put(key, vec)
+        missing = [(k, t) for k, t in missing if k not in found]
+
+    if missing:
+        encoded = encode_fn([t for _, t in missing])
+        fresh = []
+        for (key, _), vec in zip(missing, encoded):
+            vec = np.array(vec, dtype=np.float32)
+            vectors[key] = vec
+            query_embeddings.put(key, vec)
+            fresh.append((key, vec))
+        if disk_embeddings is not None:
+            disk_embeddings.put_many(fresh)
+
+    if not keys:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([vectors[k] for k in keys])
+
+
+def invalidate_results():
+    """Drop cached mapping results, e.g. after the section index is rebuilt."""
+    query_results.clear()
+
+
+def stats():
+    out = {"query_embeddings": query_embeddings.stats(), "query_results": query_results.stats()}
+    if disk_embeddings is not None:
+        out["sqlite"] = disk_embeddings.stats()
+    return out
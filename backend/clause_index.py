@@ -0,0 +1,126 @@
+"""
+Clause-level hierarchical index over the DPDP Act.
+
+Every subsection, clause, subclause and special block (proviso, explanation,
+illustration) of ``sections.json`` becomes a leaf addressed by its path,
+e.g. ``8(5)`` or ``2(i)`` or ``9[proviso 1]``. Leaves are embedded with their
+ancestors' intro text as context, so "8(7)(a)" still reads as an erasure
+obligation on its own.
+
+Search is two-stage: findings are first scored against whole sections to
+keep the ``prune`` best, then reranked against the leaves of just those
+sections. Leaf scores roll up to their section with max or mean
+aggregation, and the best leaf's path is returned with the section.
+"""
+import numpy as np
+
+from ranking import top_k_columns
+
+LEVELS = ["subsections", "clauses", "subclauses", "subsubclauses"]
+SPECIAL_BLOCKS = [("provisos", "proviso"), ("explanations", "explanation"), ("illustrations", "illustration")]
+
+
+def iter_leaves(section_number, content, path=None, context=()):
+    """Yield ``(path, text, context_text)`` for every leaf under ``content``."""
+    path = path or section_number
+    if not isinstance(content, dict):
+        return
+
+    intro = content.get("intro", "")
+    has_children = False
+    for level in LEVELS:
+        children = content.get(level)
+        if isinstance(children, dict):
+            for key, child in children.items():
+                has_children = True
+                yield from iter_leaves(section_number, child, f"{path}({key})", context + ((intro,) if intro else ()))
+
+    if not has_children:
+        text = " ".join(t for t in (intro, content.get("text", "")) if t)
+        if text:
+            yield path, text, " ".join(context)
+
+    for key, label in SPECIAL_BLOCKS:
+        for n, block in enumerate(content.get(key, []), start=1):
+            yield f"{path}[{label} {n}]", block, " ".join(context + ((intro,) if intro else ()))
+
+
+class ClauseIndex:
+    """
+    Leaf embeddings grouped contiguously by section row.
+
+    ``sections`` is a list of ``(section_number, section_title, content)`` in
+    the same row order as the section-level embeddings it is searched with.
+    """
+
+    def __init__(self, sections, embed_fn):
+        self.paths = []
+        self.texts = []
+        leaf_docs = []
+        leaf_sections = []
+
+        for row, (sec_num, sec_title, content) in enumerate(sections):
+            for path, text, context in iter_leaves(sec_num, content):
+                self.paths.append(path)
+                self.texts.append(text)
+                leaf_docs.append(f"Section {sec_num}. {sec_title}. {context} {text}".replace("  ", " "))
+                leaf_sections.append(row)
+
+        self.leaf_section = np.array(leaf_sections, dtype=np.int64)
+        # embed_fn returns normalized rows (see embedding_cache.load_or_encode)
+        self.embeddings = embed_fn(leaf_docs)
+
+    @classmethod
+    def from_arrays(cls, paths, texts, leaf_section, embeddings):
+        """Rebuild from precomputed leaves, e.g. a section_store.SectionStore."""
+        index = cls.__new__(cls)
+        index.paths = paths
+        index.texts = texts
+        index.leaf_section = np.asarray(leaf_section, dtype=np.int64)
+        index.embeddings = embeddings
+        return index
+
+    def __len__(self):
+        return len(self.paths)
+
+    def search(self, query_embs, section_index, top_k=1, prune=5, aggregation="max"):
+        """
+        Two-stage search. Returns ``(section_rows, scores, leaf_rows)``, each
+        shaped ``(n_findings, k)`` and sorted best-first; ``leaf_rows`` is the
+        best-scoring leaf inside each returned section.
+
+        ``section_index`` is the section-level VectorIndex, whose rows must
+        match the row order the leaves were built with.
+        """
+        n = query_embs.shape[0]
+        # Stage 1: prune to the best sections using the section-level index
+        candidates, _ = section_index.search(query_embs, max(prune, top_k))
+
+        # Stage 2: score only the leaves belonging to some candidate section
+        leaf_rows = np.nonzero(np.isin(self.leaf_section, candidates))[0]
+        leaf_owner = self.leaf_section[leaf_rows]
+        leaf_scores = np.dot(query_embs, self.embeddings[leaf_rows].T)
+
+        # Roll leaves up to each finding's candidate sections, one column per candidate
+        n_cand = candidates.shape[1]
+        rolled = np.full((n, n_cand), -np.inf, dtype=np.float32)
+        best_leaf = np.full((n, n_cand), -1, dtype=np.int64)
+        for j in range(n_cand):
+            owned = leaf_owner[None, :] == candidates[:, j:j + 1]
+            masked = np.where(owned, leaf_scores, -np.inf)
+            has_leaves = owned.any(axis=1)
+            arg = masked.argmax(axis=1) if leaf_rows.size else np.zeros(n, dtype=np.int64)
+            if aggregation == "mean":
+                counts = np.maximum(owned.sum(axis=1), 1)
+                agg = np.where(owned, leaf_scores, 0).sum(axis=1) / counts
+            else:
+                agg = masked.max(axis=1) if leaf_rows.size else np.full(n, -np.inf)
+            rolled[:, j] = np.where(has_leaves, agg, -np.inf)
+            best_leaf[:, j] = np.where(has_leaves, leaf_rows[arg] if leaf_rows.size else -1, -1)
+
+        order, scores = top_k_columns(rolled, top_k)
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            scores,
+            np.take_along_axis(best_leaf, order, axis=1),
+        )
@@ -0,0 +1,148 @@
+"""
+Runtime settings for the DPDP backend.
+
+Every value can be overridden with a DPDP_* environment variable so the
+same code runs unchanged under uvicorn, Flask and the offline scripts.
+"""
+import os
+
+
+def _int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _float(name, default):
+    return float(os.environ.get(name, default))
+
+
+# Micro-batching of query encodes across concurrent /analyze requests
+BATCH_MAX_SIZE = _int("DPDP_BATCH_MAX_SIZE", 64)
+BATCH_MAX_WAIT_MS = _float("DPDP_BATCH_MAX_WAIT_MS", 5)
+
+# Inference worker pool: "thread" or "process" (one model copy per process)
+INFERENCE_POOL = os.environ.get("DPDP_INFERENCE_POOL", "thread")
+INFERENCE_WORKERS = _int("DPDP_INFERENCE_WORKERS", os.cpu_count() or 1)
+# Requests admitted at once before new ones are rejected with 503
+INFERENCE_MAX_PENDING = _int("DPDP_INFERENCE_MAX_PENDING", 64)
+INFERENCE_TIMEOUT_S = _float("DPDP_INFERENCE_TIMEOUT_S", 30)
+
+# Findings per encode/map step when streaming an uploaded PDF
+UPLOAD_BATCH_SIZE = _int("DPDP_UPLOAD_BATCH_SIZE", 32)
+
+# Background analysis jobs (see jobs.py): SQLite queue file, worker
+# processes started by main.py (0 = run `python jobs.py` separately) and the
+# intra-op threads each worker may use
+JOBS_DB_PATH = os.path.abspath(os.environ.get(
+    "DPDP_JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "jobs", "jobs.sqlite")
+))
+JOB_WORKERS = _int("DPDP_JOB_WORKERS", 1)
+JOB_WORKER_THREADS = _int("DPDP_JOB_WORKER_THREADS", 1)
+JOB_BATCH_SIZE = _int("DPDP_JOB_BATCH_SIZE", 64)
+JOB_MAX_ATTEMPTS = _int("DPDP_JOB_MAX_ATTEMPTS", 3)
+# Renewed after every batch; a job whose lease runs out is reclaimed
+JOB_LEASE_S = _float("DPDP_JOB_LEASE_S", 300)
+JOB_RETRY_BACKOFF_S = _float("DPDP_JOB_RETRY_BACKOFF_S", 5)
+JOB_POLL_INTERVAL_S = _float("DPDP_JOB_POLL_INTERVAL_S", 1)
+JOB_MAX_UPLOAD_BYTES = _int("DPDP_JOB_MAX_UPLOAD_BYTES", 100 * 1024 * 1024)
+
+# In-process query caches (see cache.py)
+CACHE_EMBEDDINGS_MAX_BYTES = _int("DPDP_CACHE_EMBEDDINGS_MAX_BYTES", 64 * 1024 * 1024)
+CACHE_RESULTS_MAX_BYTES = _int("DPDP_CACHE_RESULTS_MAX_BYTES", 32 * 1024 * 1024)
+CACHE_TTL_S = _float("DPDP_CACHE_TTL_S", 3600)
+# Optional SQLite file shared by all workers for query embeddings ("" = off)
+CACHE_SQLITE_PATH = os.environ.get("DPDP_CACHE_SQLITE_PATH", "")
+
+# Chroma persistent store written by index_dpdp.py; absolute, so it does not
+# depend on the working directory the server was started from
+VECTOR_DIR = os.path.abspath(
+    os.environ.get("DPDP_VECTOR_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store"))
+)
+# Queries accepted by one /search/batch request
+SEARCH_BATCH_MAX = _int("DPDP_SEARCH_BATCH_MAX", 100)
+
+# Vector index backends (see vector_index.py): numpy | hnsw | faiss | chroma
+INDEX_BACKEND = os.environ.get("DPDP_INDEX_BACKEND", "numpy")
+SEARCH_INDEX_BACKEND = os.environ.get("DPDP_SEARCH_INDEX_BACKEND", "chroma")
+HNSW_M = _int("DPDP_HNSW_M", 16)
+HNSW_EF_CONSTRUCTION = _int("DPDP_HNSW_EF_CONSTRUCTION", 200)
+HNSW_EF_SEARCH = _int("DPDP_HNSW_EF_SEARCH", 64)
+
+# Embedding encoder (see encoder.py): torch | onnx | onnx-int8
+ENCODER_BACKEND = os.environ.get("DPDP_ENCODER_BACKEND", "torch")
+ENCODER_MODEL = os.environ.get("DPDP_ENCODER_MODEL", "all-MiniLM-L6-v2")
+# Local directory holding model.onnx / model.int8.onnx / tokenizer.json (scripts/export_onnx.py)
+ENCODER_ONNX_DIR = os.environ.get(
+    "DPDP_ENCODER_ONNX_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "models", "all-MiniLM-L6-v2-onnx"))
+)
+ENCODER_BATCH_SIZE = _int("DPDP_ENCODER_BATCH_SIZE", 32)
+ENCODER_MAX_LENGTH = _int("DPDP_ENCODER_MAX_LENGTH", 256)
+
+# Model/index loading at server startup: "background" (serve /healthz at once,
+# /readyz turns 200 when loaded) or "blocking" (startup waits for the load)
+WARMUP = os.environ.get("DPDP_WARMUP", "background")
+
+# Hybrid retrieval (see lexical.py): share of BM25 in the fused ranking,
+# 0 = dense only. Both can be overridden per request.
+LEXICAL_WEIGHT = _float("DPDP_LEXICAL_WEIGHT", 0.3)
+FUSION = os.environ.get("DPDP_FUSION", "rrf")
+RRF_K = _int("DPDP_RRF_K", 60)
+# Dense neighbours fetched per query before fusing with the lexical ranking
+HYBRID_CANDIDATES = _int("DPDP_HYBRID_CANDIDATES", 20)
+# Findings citing a section ("Sec 9", "s. 8(5)") map to it directly, without embedding
+SECTION_REFERENCES = os.environ.get("DPDP_SECTION_REFERENCES", "1") != "0"
+
+# Security-control crosswalk (see crosswalk.py): findings tagged with a CWE,
+# OWASP Top 10 or ISO 27001 Annex A id map from a precompiled table, without
+# embedding. The curated source, the compiled artifact, and the semantic
+# matches kept for a control that lists no DPDP ids
+CROSSWALK = os.environ.get("DPDP_CROSSWALK", "1") != "0"
+CROSSWALK_SOURCE = os.path.abspath(os.environ.get(
+    "DPDP_CROSSWALK_SOURCE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "crosswalk", "controls.json")
+))
+CROSSWALK_PATH = os.path.abspath(os.environ.get(
+    "DPDP_CROSSWALK_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "processed", "crosswalk.json")
+))
+CROSSWALK_TOP_K = _int("DPDP_CROSSWALK_TOP_K", 2)
+CROSSWALK_THRESHOLD = _float("DPDP_CROSSWALK_THRESHOLD", 0.35)
+
+# Versioned index snapshots (see snapshots.py). SNAPSHOT pins this process to
+# one version; otherwise it follows SNAPSHOT_DIR/CURRENT, polled every
+# SNAPSHOT_POLL_S seconds (0 = never)
+SNAPSHOT_DIR = os.path.abspath(os.environ.get(
+    "DPDP_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "snapshots")
+))
+SNAPSHOT = os.environ.get("DPDP_SNAPSHOT", "")
+SNAPSHOT_POLL_S = _float("DPDP_SNAPSHOT_POLL_S", 5)
+# Required in X-Admin-Token by the /admin endpoints and /cache/clear, which refuse every request while it is unset
+ADMIN_TOKEN = os.environ.get("DPDP_ADMIN_TOKEN", "")
+
+# Cross-encoder reranking (see rerank.py), enabled per request with rerank=true.
+# The model is loaded from a local directory only
+RERANK_MODEL_DIR = os.environ.get(
+    "DPDP_RERANK_MODEL_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "models", "ms-marco-MiniLM-L-6-v2"))
+)
+# Bi-encoder candidates reranked per finding
+RERANK_CANDIDATES = _int("DPDP_RERANK_CANDIDATES", 10)
+RERANK_BATCH_SIZE = _int("DPDP_RERANK_BATCH_SIZE", 64)
+RERANK_MAX_LENGTH = _int("DPDP_RERANK_MAX_LENGTH", 512)
+# Per-request time for the rerank stage; findings beyond it keep bi-encoder order
+RERANK_BUDGET_MS = _float("DPDP_RERANK_BUDGET_MS", 500)
+# Calibrated relevance probability a reranked candidate needs (replaces the cosine threshold)
+RERANK_MIN_SCORE = _float("DPDP_RERANK_MIN_SCORE", 0.5)
+
+# Findings whose estimated Jaccard similarity (MinHash over character
+# shingles) reaches this are mapped once (see segmenter.py); 1.0 = exact only
+DEDUP_THRESHOLD = _float("DPDP_DEDUP_THRESHOLD", 0.85)
+
+# Instrumentation (see metrics.py): X-Debug-Timing response headers on request,
+# and per-request profiles written to PROFILE_DIR ("" = profiling off)
+DEBUG_TIMING = os.environ.get("DPDP_DEBUG_TIMING", "1") != "0"
+PROFILE_DIR = os.environ.get("DPDP_PROFILE_DIR", "")
+# cProfile | pyinstrument
+PROFILER = os.environ.get("DPDP_PROFILER", "cProfile")
+# Fraction of requests profiled without an X-Profile header
+PROFILE_SAMPLE_RATE = _float("DPDP_PROFILE_SAMPLE_RATE", 0)
@@ -0,0 +1,328 @@
+"""
+Security-control crosswalk: CWE, OWASP Top 10 and ISO/IEC 27001 Annex A
+controls to DPDP sections and clauses.
+
+Scanner findings often arrive tagged ("CWE-311", "A02:2021", "ISO 27001
+A.8.24"). The curated source, data/crosswalk/controls.json, lists each
+control with its title, a canonical description and the DPDP ids it falls
+under. ``build`` compiles it into data/processed/crosswalk.json: curated ids
+are checked against the section store, and a control without any is mapped
+once from its canonical description by the semantic mapper. The artifact
+is keyed by control id, by alias (a 2017 OWASP category, an ISO 27001:2013
+control) and by normalized title, and is versioned by a hash of its inputs.
+index_dpdp.py builds it; so does the first lookup when it is missing or was
+built from another sections.json, source file or model. An index snapshot
+carries its own artifact, built with it and used as is.
+
+``resolve`` is then a dictionary lookup per control id found in a finding
+(or per finding that is exactly a control title), so tagged findings skip
+the encoder; rag.resolve_references runs it on the findings that cite no
+section. /crosswalk serves the table.
+
+    python crosswalk.py --build
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+import config
+import snapshots
+from lexical import ref_candidates
+
+FORMAT_VERSION = 1
+
+# "CWE-79", "CWE 79", "cwe:79"
+CWE_ID = re.compile(r"\bCWE[\s:_-]?(\d{1,5})\b", re.IGNORECASE)
+# "A02:2021", "A3:2017", "OWASP A01" (2021 when no year is given)
+OWASP_ID = re.compile(
+    r"\bOWASP(?:[\s-]+Top[\s-]*10)?(?:[\s-]+20\d\d)?[\s:-]+A(\d{1,2})(?:\s*[:-]\s*(20\d\d))?\b"
+    r"|\bA(\d{1,2})\s*:\s*(20\d\d)\b",
+    re.IGNORECASE
+)
+# Annex A controls: "A.8.24" (2022 numbering), "A.12.4.1" (2013)
+ISO_ID = re.compile(r"(?<![\w.])A\.(\d{1,2}(?:\.\d{1,2}){1,2})\b")
+TITLE_WORD = re.compile(r"[a-z0-9]+")
+
+
+def find_control_ids(text):
+    """
+    Control ids tagged in ``text``, canonical and in order of appearance:
+    "CWE-311 / A02:2021 (ISO A.8.24)" -> ["CWE-311", "OWASP:A02:2021",
+    "ISO27001:A.8.24"].
+    """
+    found = []
+    for m in CWE_ID.finditer(text):
+        found.append((m.start(), f"CWE-{int(m.group(1))}"))
+    for m in OWASP_ID.finditer(text):
+        number, year = (m.group(1), m.group(2)) if m.group(1) else (m.group(3), m.group(4))
+        found.append((m.start(), f"OWASP:A{int(number):02d}:{year or 2021}"))
+    for m in ISO_ID.finditer(text):
+        found.append((m.start(), f"ISO27001:A.{m.group(1)}"))
+    return list(dict.fromkeys(control_id for _, control_id in sorted(found)))
+
+
+def title_key(text):
+    return " ".join(TITLE_WORD.findall(text.lower()))
+
+
+def _framework(control_id):
+    return "CWE" if control_id.startswith("CWE-") else control_id.split(":", 1)[0]
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Crosswalk:
+    """The compiled artifact, with every mapping expanded against the section store once."""
+
+    def __init__(self, artifact, store):
+        self.artifact = artifact
+        self.version = artifact["version"]
+        self.controls = artifact["controls"]
+        # Alias and title -> control id; a control id maps to itself
+        self.keys = {control_id: control_id for control_id in self.controls}
+        self.keys.update(artifact["aliases"])
+        self.titles = artifact["titles"]
+        self.rows = {}
+        for control_id, control in self.controls.items():
+            rows = []
+            for m in control["mappings"]:
+                record = store.get(m["id"])
+                if record is None:
+                    continue
+                row = {
+                    "section_number": record["section"],
+                    "section_title": record["title"],
+                    "chapter": record["chapter"],
+                    # Sections are the first entries of the store, so their entry index is their row
+                    "description": store.section_texts[store.find(record["section"])],
+                    "score": m["score"],
+                    "match": "crosswalk",
+                    "control": control_id,
+                }
+                if record["kind"] == "clause":
+                    row["clause"] = record["id"]
+                    row["clause_text"] = record["text"]
+                rows.append(row)
+            self.rows[control_id] = rows
+
+    def lookup(self, finding):
+        """Ids of the known controls a finding is tagged with, or whose title it is."""
+        ids = [self.keys[c] for c in find_control_ids(finding) if c in self.keys]
+        if not ids:
+            # "Missing Encryption of Sensitive Data" or "Missing Encryption of Sensitive Data: /api/users"
+            for key in (title_key(finding), title_key(finding.split(":", 1)[0])):
+                if key in self.titles:
+                    ids.append(self.titles[key])
+                    break
+        return list(dict.fromkeys(ids))
+
+    def resolve(self, findings, indexes, top_k):
+        """``(results, pending)`` for ``findings[i]``, i in ``indexes``, as in rag.resolve_references."""
+        results = []
+        pending = []
+        for i in indexes:
+            rows = []
+            for control_id in self.lookup(findings[i]):
+                for row in self.rows[control_id]:
+                    if all(r["section_number"] != row["section_number"] for r in rows):
+                        rows.append(row)
+            if not rows:
+                pending.append(i)
+                continue
+            for rank, row in enumerate(rows[:top_k], start=1):
+                results.append({"finding": findings[i], "finding_index": i, **row, "rank": rank})
+        return results, pending
+
+    def export(self, framework=None, control=None):
+        """The table for /crosswalk, optionally one framework's controls or one control (by id, alias or title)."""
+        controls = self.controls
+        if control is not None:
+            ids = [self.keys[c] for c in find_control_ids(control) if c in self.keys]
+            control_id = self.keys.get(control) or (ids[0] if ids else self.titles.get(title_key(control)))
+            controls = {control_id: controls[control_id]} if control_id else {}
+        if framework is not None:
+            controls = {k: v for k, v in controls.items() if v["framework"].lower() == framework.lower()}
+        return {
+            "version": self.version,
+            "built_at": self.artifact["built_at"],
+            "source_hash": self.artifact["source_hash"],
+            "model": self.artifact["model"],
+            "frameworks": self.artifact["frameworks"],
+            "controls": controls,
+        }
+
+
+def _section_store():
+    import rag
+    try:
+        return rag.section_store_resource.get()
+    except LookupError:
+        # Compiled along with the mapping index
+        return rag.mapping_index.get().store
+
+
+def _resolve_id(store, ref):
+    """The section store id for a curated DPDP id, falling back to its ancestors, or None."""
+    for candidate in ref_candidates(ref):
+        if store.find(candidate) >= 0:
+            return candidate
+    return None
+
+
+def build(source_path=None, out_path=None):
+    """Compile the curated source into the crosswalk artifact; returns the artifact."""
+    import rag
+
+    source_path = source_path or config.CROSSWALK_SOURCE
+    out_path = out_path or config.CROSSWALK_PATH
+    with open(source_path, encoding="utf-8") as f:
+        source = json.load(f)
+    store = _section_store()
+
+    controls = {}
+    aliases = {}
+    titles = {}
+    uncurated = []
+    for entry in source["controls"]:
+        control_id = entry["id"]
+        mappings = []
+        for ref in entry.get("dpdp", []):
+            resolved = _resolve_id(store, ref)
+            if resolved is None:
+                print(f"Warning: {control_id}: DPDP id {ref} is not in the section store")
+                continue
+            if resolved != ref:
+                print(f"Warning: {control_id}: DPDP id {ref} not found, using {resolved}")
+            if all(m["id"] != resolved for m in mappings):
+                mappings.append({"id": resolved, "score": 1.0, "source": "curated"})
+        controls[control_id] = {
+            "framework": _framework(control_id),
+            "title": entry["title"],
+            "description": entry.get("description", ""),
+            "mappings": mappings,
+        }
+        if not mappings:
+            uncurated.append(control_id)
+        for alias in entry.get("aliases", []):
+            aliases[alias] = control_id
+        titles.setdefault(title_key(entry["title"]), control_id)
+
+    model = None
+    if uncurated:
+        # Map the canonical descriptions once, here, so lookups never need the model
+        texts = [f"{controls[c]['title']}. {controls[c]['description']}" for c in uncurated]
+        model = rag.mapping_index.get().model_name
+        mapped = rag.map_findings(
+            texts, rag.encode_findings(texts), config.CROSSWALK_THRESHOLD, config.CROSSWALK_TOP_K, "clause"
+        )
+        for m in mapped:
+            controls[uncurated[m["finding_index"]]]["mappings"].append({
+                "id": m.get("clause", m["section_number"]),
+                "score": m["score"],
+                "source": "semantic",
+            })
+
+    frameworks = {}
+    for name, title in source.get("frameworks", {}).items():
+        frameworks[name] = {"title": title, "controls": sum(c["framework"] == name for c in controls.values())}
+    source_hash = rag.source_hash.get()
+    control_hash = _file_hash(source_path)
+    version = hashlib.sha256(
+        json.dumps([FORMAT_VERSION, control_hash, source_hash, model], sort_keys=True).encode("utf-8")
+    ).hexdigest()[:12]
+    artifact = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "source_hash": source_hash,
+        "controls_hash": control_hash,
+        "model": model,
+        "frameworks": frameworks,
+        "controls": controls,
+        "aliases": aliases,
+        "titles": titles,
+    }
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, out_path)
+    print(f"Crosswalk {version}: {len(controls)} controls ({len(uncurated)} mapped semantically) -> {out_path}")
+    return artifact
+
+
+def _is_current(artifact, snapshot):
+    import rag
+
+    if artifact.get("format") != FORMAT_VERSION:
+        return False
+    if artifact["source_hash"] != rag.source_hash.get():
+        return False
+    # A snapshot keeps the controls it was built with, whatever the source file says now
+    if not snapshot.immutable and artifact["controls_hash"] != _file_hash(config.CROSSWALK_SOURCE):
+        return False
+    return artifact["model"] is None or artifact["model"] == rag.mapping_index.get().model_name
+
+
+def _load(snapshot):
+    artifact = None
+    if os.path.exists(snapshot.crosswalk_path):
+        with open(snapshot.crosswalk_path, encoding="utf-8") as f:
+            artifact = json.load(f)
+    if artifact is None or not _is_current(artifact, snapshot):
+        if snapshot.immutable:
+            raise ValueError(f"Index snapshot {snapshot.version} has no crosswalk for this model and corpus")
+        artifact = build(None, snapshot.crosswalk_path)
+    return Crosswalk(artifact, _section_store())
+
+
+crosswalk = snapshots.resource("crosswalk", _load)
+_warned = set()
+
+
+def _table():
+    """The loaded crosswalk, or None (with one warning per cause) when it cannot be loaded."""
+    try:
+        return crosswalk.get()
+    except (OSError, ValueError, KeyError) as e:
+        message = f"{type(e).__name__}: {e}"
+        if message not in _warned:
+            _warned.add(message)
+            print(f"Warning: control crosswalk unavailable, tagged findings are encoded: {message}")
+        return None
+
+
+def resolve(findings, indexes, top_k=1):
+    """
+    Map the findings ``indexes`` that are tagged with a known control from
+    the crosswalk. Returns ``(results, pending)`` like
+    rag.resolve_references; every finding stays pending when the crosswalk
+    is disabled or unavailable.
+    """
+    table = _table() if config.CROSSWALK else None
+    if table is None:
+        return [], list(indexes)
+    return table.resolve(findings, indexes, top_k)
+
+
+def version():
+    """Version of the crosswalk if it is loaded (part of the mapping cache key); never loads it."""
+    return crosswalk.get().version if config.CROSSWALK and crosswalk.loaded else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the security-control crosswalk")
+    parser.add_argument("--build", action="store_true", help="Compile data/crosswalk/controls.json")
+    parser.add_argument("--source", help="Curated controls (default: DPDP_CROSSWALK_SOURCE)")
+    parser.add_argument("--output", help="Artifact path (default: DPDP_CROSSWALK_PATH)")
+    args = parser.parse_args()
+    if args.build:
+        build(args.source, args.output)
+    else:
+        parser.print_help()
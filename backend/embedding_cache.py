@@ -0,0 +1,117 @@
+"""
+Content-addressed on-disk cache for DPDP embeddings.
+
+Each model and corpus (``name``: sections, clauses, ...) gets a
+``<model>.<name>.npy`` matrix of L2-normalized float32 rows and a JSON
+sidecar listing the content hash of every row. The matrix is opened with
+``mmap_mode="r"`` so every worker shares the same page cache instead of
+holding its own copy, and only texts whose hash is not already cached are
+sent to the encoder.
+"""
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "data", "processed", "embeddings"))
+
+
+def text_hash(model_name, text):
+    """Cache key for one text: model name + SHA-256 of the text."""
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _cache_paths(model_name, cache_dir, name):
+    safe_name = re.sub(r"[^\w.-]+", "_", f"{model_name}.{name}")
+    return (
+        os.path.join(cache_dir, f"{safe_name}.npy"),
+        os.path.join(cache_dir, f"{safe_name}.json"),
+    )
+
+
+def _load(model_name, cache_dir, name):
+    """Open the cached matrix (memory-mapped) and its row keys, if valid."""
+    matrix_path, meta_path = _cache_paths(model_name, cache_dir, name)
+    if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+        return None, []
+
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None, []
+
+    keys = meta.get("keys", [])
+    # A writer may have replaced one file but not yet the other
+    if meta.get("model") != model_name or matrix.ndim != 2 or matrix.shape[0] != len(keys):
+        return None, []
+    return matrix, keys
+
+
+def _save(model_name, cache_dir, name, matrix, keys):
+    """Atomically replace the cached matrix and sidecar."""
+    os.makedirs(cache_dir, exist_ok=True)
+    matrix_path, meta_path = _cache_paths(model_name, cache_dir, name)
+
+    tmp_matrix = f"{matrix_path}.{os.getpid()}.tmp"
+    with open(tmp_matrix, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp_matrix, matrix_path)
+
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "dim": int(matrix.shape[1]), "keys": keys}, f)
+    os.replace(tmp_meta, meta_path)
+
+
+def normalize(embeddings):
+    """L2-normalize rows so cosine similarity is a plain dot product."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def load_or_encode(model_name, texts, encode_fn, cache_dir=CACHE_DIR, name="sections"):
+    """
+    Return normalized embeddings for ``texts``, one row per text.
+
+    ``encode_fn(list_of_texts)`` is only called for texts whose content hash
+    is missing from the cache. When nothing changed the cached file is
+    returned as a read-only memmap without copying.
+    """
+    keys = [text_hash(model_name, t) for t in texts]
+    cached, cached_keys = _load(model_name, cache_dir, name)
+
+    if cached is not None and cached_keys == keys:
+        return cached
+
+    cached_rows = {k: i for i, k in enumerate(cached_keys)} if cached is not None else {}
+    missing = [i for i, k in enumerate(keys) if k not in cached_rows]
+
+    fresh = None
+    if missing:
+        print(f"Encoding {len(missing)} of {len(texts)} {name} (embedding cache miss)...")
+        fresh = normalize(encode_fn([texts[i] for i in missing]))
+
+    if fresh is not None:
+        dim = fresh.shape[1]
+    elif cached is not None:
+        dim = cached.shape[1]
+    else:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    matrix = np.empty((len(texts), dim), dtype=np.float32)
+    hit_rows = [i for i, k in enumerate(keys) if k in cached_rows]
+    if hit_rows:
+        matrix[hit_rows] = cached[[cached_rows[keys[i]] for i in hit_rows]]
+    if missing:
+        matrix[missing] = fresh
+
+    _save(model_name, cache_dir, name, matrix, keys)
+    matrix_path, _ = _cache_paths(model_name, cache_dir, name)
+    return np.load(matrix_path, mmap_mode="r")
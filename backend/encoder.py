@@ -0,0 +1,121 @@
+"""
+Sentence encoders behind one interface.
+
+``get_encoder()`` returns the process-wide encoder selected by
+DPDP_ENCODER_BACKEND:
+
+- ``torch``: the full-precision SentenceTransformer model.
+- ``onnx``: the same model exported to ONNX (scripts/export_onnx.py) and run
+  with ONNX Runtime, loaded from a local directory with no network access.
+- ``onnx-int8``: the dynamically int8-quantized ONNX export.
+
+Every backend returns L2-normalized float32 rows, and ``name`` differs per
+backend so embedding caches never mix vectors from different encoders.
+Run scripts/check_encoder_parity.py before switching a deployment.
+"""
+import os
+import threading
+
+import numpy as np
+
+import config
+from embedding_cache import normalize
+
+
+class TorchEncoder:
+    backend = "torch"
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize(self.model.encode(
+            list(texts), batch_size=config.ENCODER_BATCH_SIZE, convert_to_numpy=True
+        ))
+
+
+class OnnxEncoder:
+    """
+    Transformer forward pass in ONNX Runtime plus the mean pooling that
+    all-MiniLM-L6-v2's SentenceTransformer pipeline applies.
+    """
+
+    def __init__(self, model_name, model_dir, quantized=False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.name = encoder_name(self.backend, model_name)
+        model_path = os.path.join(model_dir, "model.int8.onnx" if quantized else "model.onnx")
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        for path in (model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found. Run scripts/export_onnx.py first.")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=config.ENCODER_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feed)[0]
+        # Mean pooling over real (unpadded) tokens
+        mask = attention_mask[..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        size = config.ENCODER_BATCH_SIZE
+        batches = [self._encode_batch(texts[i:i + size]) for i in range(0, len(texts), size)]
+        return normalize(np.vstack(batches))
+
+
+_encoders = {}
+_lock = threading.Lock()
+
+
+def encoder_name(backend=None, model_name=None):
+    """The ``name`` an encoder would have, without loading it."""
+    backend = backend or config.ENCODER_BACKEND
+    model_name = model_name or config.ENCODER_MODEL
+    return model_name if backend == "torch" else f"{model_name}-{backend}"
+
+
+def load_encoder(backend, model_name=None, onnx_dir=None):
+    """Construct a new encoder (no caching); used by get_encoder and the parity check."""
+    model_name = model_name or config.ENCODER_MODEL
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(model_name, onnx_dir or config.ENCODER_ONNX_DIR, quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown encoder backend: {backend!r} (expected torch, onnx or onnx-int8)")
+
+
+def get_encoder(backend=None):
+    """Shared encoder for ``backend`` (default DPDP_ENCODER_BACKEND), loaded once per process."""
+    backend = backend or config.ENCODER_BACKEND
+    with _lock:
+        if backend not in _encoders:
+            _encoders[backend] = load_encoder(backend)
+        return _encoders[backend]
@@ -1,64 +1,123 @@
+import argparse
 import json
-import chromadb
 import os
-from sentence_transformers import SentenceTransformer
-from utils.chunker import extract_chunks
+import config
+import crosswalk
+from encoder import encoder_name, get_encoder
+from utils.chunker import extract_chunks, assign_chunk_ids
+from vector_index import chroma_client
 
 DATA_PATH = os.path.join("..", "data", "processed", "sections.json")
-VECTOR_DIR = "vector_store"
+VECTOR_DIR = config.VECTOR_DIR
 COLLECTION_NAME = "dpdp_act"
 
-def main():
-    print("Starting DPDP indexing")
-
-    if not os.path.exists(DATA_PATH):
-        print(f"Error: {DATA_PATH} not found. Run the extraction scripts first.")
-        return
-
+def index_chunks(data_path, vector_dir, full=False):
+    """Bring the Chroma collection in ``vector_dir`` in line with the chunks of ``data_path``."""
     # Load DPDP sections
-    with open(DATA_PATH, encoding="utf-8") as f:
+    with open(data_path, encoding="utf-8") as f:
         data = json.load(f)
 
     # Pass the whole data object, chunker handles chapters/sections
     chunks = extract_chunks(data)
+    ids = assign_chunk_ids(chunks)
     print(f"Total chunks created: {len(chunks)}")
 
-    # Load embedding model
-    print("Loading embedding model...")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-
     # Initialize vector DB (Modern PersistentClient)
-    client = chromadb.PersistentClient(path=VECTOR_DIR)
-
-    # Remove existing collection to re-index correctly
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-    except:
-        pass
-        
-    collection = client.create_collection(name=COLLECTION_NAME)
-
-    # Embed and store chunks
-    print("Indexing chunks into ChromaDB...")
-    documents = [c["text"] for c in chunks]
-    embeddings = model.encode(documents).tolist()
+    client = chroma_client(vector_dir)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+
+    # Chunk ids do not depend on the encoder, so a collection built by
+    # another model or backend is re-embedded in full rather than mixed
+    name = encoder_name()
+    built_with = (collection.metadata or {}).get("encoder")
+    got = collection.get(include=["metadatas"])
+    existing = got["ids"]
+    if existing and built_with != name:
+        print(f"Collection was built with {built_with or 'an unrecorded encoder'}, re-embedding with {name}")
+        full = True
+        dim = len(collection.get(ids=existing[:1], include=["embeddings"])["embeddings"][0])
+        if dim != get_encoder().dim:
+            # Chroma fixes a collection's dimension at the first insert
+            client.delete_collection(name=COLLECTION_NAME)
+            collection = client.create_collection(name=COLLECTION_NAME)
+            existing = []
+
     metadatas = [{
         "section_id": c["section_id"],
         "title": c["title"],
-        "chapter": c["chapter"]
+        "chapter": c["chapter"],
+        "clause_path": c["clause_path"]
     } for c in chunks]
-    ids = [f"dpdp_{idx}" for idx in range(len(chunks))]
 
-    # Batch add
-    collection.add(
-        documents=documents,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        ids=ids
-    )
+    # Diff against what is already indexed
+    existing_ids = set(existing)
+    wanted_ids = set(ids)
+    if full:
+        to_embed = list(range(len(chunks)))
+    else:
+        to_embed = [i for i, chunk_id_ in enumerate(ids) if chunk_id_ not in existing_ids]
+    stale_ids = sorted(existing_ids - wanted_ids)
+    # Ids hash only the text, so a fixed title or chapter leaves the id (and
+    # the vector) as is; its metadata is updated without re-encoding
+    stored = dict(zip(existing, got.get("metadatas") or [])) if existing else {}
+    embedded = set(to_embed)
+    to_update = [
+        i for i, chunk_id_ in enumerate(ids)
+        if i not in embedded and chunk_id_ in stored and stored[chunk_id_] != metadatas[i]
+    ]
+
+    print(f"Chunks to embed: {len(to_embed)}, metadata only: {len(to_update)}, "
+          f"unchanged: {len(chunks) - len(to_embed) - len(to_update)}, stale: {len(stale_ids)}")
+
+    if to_embed:
+        # Load embedding model only when there is something to encode
+        print("Loading embedding model...")
+        encoder = get_encoder()
+
+        print("Indexing chunks into ChromaDB...")
+        documents = [chunks[i]["text"] for i in to_embed]
+        embeddings = encoder.encode(documents).tolist()
+
+        # Upsert first and delete afterwards, so the live collection is never empty
+        collection.upsert(
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[metadatas[i] for i in to_embed],
+            ids=[ids[i] for i in to_embed]
+        )
+
+    if to_update:
+        collection.update(ids=[ids[i] for i in to_update], metadatas=[metadatas[i] for i in to_update])
+
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+    if built_with != name:
+        # hnsw:* settings cannot be passed to modify(), even unchanged
+        metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+        collection.modify(metadata={**metadata, "encoder": name})
 
     print("DPDP Act indexed successfully")
-    print(f"Vector store saved at: {VECTOR_DIR}")
+    print(f"Vector store saved at: {vector_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the DPDP Act into ChromaDB")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every chunk instead of only new or changed ones")
+    parser.add_argument("--skip-crosswalk", action="store_true",
+                        help="Do not recompile the security-control crosswalk")
+    args = parser.parse_args()
+
+    print("Starting DPDP indexing")
+
+    if not os.path.exists(DATA_PATH):
+        print(f"Error: {DATA_PATH} not found. Run the extraction scripts first.")
+        return
+
+    index_chunks(DATA_PATH, VECTOR_DIR, full=args.full)
+
+    # Control id -> section table, so tagged findings never need the model
+    if not args.skip_crosswalk:
+        crosswalk.build()
 
 if __name__ == "__main__":
     main()
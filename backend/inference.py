@@ -0,0 +1,160 @@
+"""
+Async service layer for CPU-bound inference.
+
+Encoding and similarity search run on a thread or process pool instead of
+the event loop. Admission is bounded: once ``max_pending`` requests are in
+flight new ones fail fast with ``PoolSaturated`` (served as 503), and each
+request is subject to a timeout and cancelled if the client disconnects.
+"""
+import asyncio
+import contextvars
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import config
+import metrics
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool already has ``max_pending`` requests in flight."""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before its result was ready."""
+
+
+def _warm_worker(modules):
+    # Runs once per worker process: load the model and index before serving
+    for name in modules:
+        module = importlib.import_module(name)
+        if hasattr(module, "warm_up"):
+            module.warm_up()
+
+
+class InferencePool:
+    def __init__(self, kind=None, workers=None, max_pending=None, timeout=None, warm_modules=()):
+        self.kind = kind or config.INFERENCE_POOL
+        self.workers = workers or config.INFERENCE_WORKERS
+        self.max_pending = max_pending or config.INFERENCE_MAX_PENDING
+        self.timeout = timeout or config.INFERENCE_TIMEOUT_S
+        self.warm_modules = tuple(warm_modules)
+        self.in_flight = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            # spawn, not fork: forking after torch has started threads can deadlock
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+                initargs=(self.warm_modules,),
+            )
+        elif self.kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        else:
+            raise ValueError(f"Unknown inference pool kind: {self.kind!r}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def acquire(self):
+        """Admit one request, or raise PoolSaturated if the queue is full."""
+        if self.in_flight >= self.max_pending:
+            raise PoolSaturated(f"{self.in_flight} requests already in flight")
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` on the pool. Cancelling the await drops it if still queued."""
+        self.start()
+        if self.kind == "thread":
+            # Carry the request's context (e.g. its metrics timings and profile) into the worker thread
+            return await asyncio.wrap_future(
+                self._executor.submit(contextvars.copy_context().run, metrics.run_profiled, fn, *args)
+            )
+        return await asyncio.wrap_future(self._executor.submit(fn, *args))
+
+    async def submit(self, coro, is_disconnected=None, timeout=None, poll_interval=0.1):
+        """
+        Admit and await ``coro`` with the request timeout, cancelling it if
+        ``is_disconnected()`` (e.g. Starlette's ``request.is_disconnected``)
+        reports that the client went away.
+        """
+        timeout = timeout or self.timeout
+        if self.in_flight >= self.max_pending:
+            coro.close()
+            raise PoolSaturated(f"{self.in_flight} requests already in flight")
+        async with self.slot():
+            task = asyncio.ensure_future(coro)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            try:
+                while True:
+                    done, _ = await asyncio.wait({task}, timeout=min(poll_interval, max(deadline - loop.time(), 0)))
+                    if done:
+                        return task.result()
+                    if loop.time() >= deadline:
+                        raise asyncio.TimeoutError(f"Inference exceeded {timeout}s")
+                    if is_disconnected is not None and await is_disconnected():
+                        raise ClientDisconnected()
+            finally:
+                if not task.done():
+                    task.cancel()
+
+
+class Warmup:
+    """
+    Loads a module's model and index (its ``warm_up()``) on the inference
+    pool, so the load happens wherever inference runs: this process for a
+    thread pool, a worker for a process pool. ``status()`` backs /readyz.
+    """
+
+    def __init__(self, pool, module_name):
+        self.pool = pool
+        self.module_name = module_name
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def _run(self):
+        module = importlib.import_module(self.module_name)
+        await self.pool.run(module.warm_up)
+        return await self.pool.run(module.readiness)
+
+    async def wait(self):
+        await asyncio.shield(self.start())
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def status(self):
+        """``(ready, details)`` without blocking on the load."""
+        if self._task is None or not self._task.done():
+            return False, {"ready": False, "loading": self._task is not None}
+        if self._task.cancelled():
+            return False, {"ready": False, "loading": False, "error": "warm-up cancelled"}
+        if self._task.exception() is not None:
+            return False, {"ready": False, "loading": False, "error": str(self._task.exception())}
+        details = self._task.result()
+        return bool(details.get("ready")), details
@@ -0,0 +1,70 @@
+"""
+Streaming ingestion of uploaded findings reports.
+
+PDFs are read page by page with pypdf and split into findings lazily, so a
+several-hundred-page VAPT report never has to be held as one string. The
+generators here only produce text; encoding and mapping stay with the caller
+so they can go through the shared batcher and inference pool.
+"""
+import json
+
+from pypdf import PdfReader
+
+import metrics
+from rag import split_findings
+
+
+def iter_pdf_pages(fileobj):
+    """Yield ``(page_number, text)`` for each page of a PDF file object."""
+    reader = PdfReader(fileobj)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+
+def iter_text_pages(fileobj, encoding="utf-8", max_lines=200):
+    """
+    Read a plain-text upload lazily. Each paragraph (lines up to a blank
+    line, at most ``max_lines``) counts as one page, numbered by its first
+    line, so wrapped sentences and bullets are segmented whole.
+    """
+    first, lines = 1, []
+    for number, line in enumerate(fileobj, start=1):
+        line = line.decode(encoding, errors="replace") if isinstance(line, bytes) else line
+        if not lines:
+            first = number
+        lines.append(line)
+        if not line.strip() or len(lines) >= max_lines:
+            yield first, "".join(lines)
+            lines = []
+    if lines:
+        yield first, "".join(lines)
+
+
+def iter_findings(pages):
+    """Yield ``(page_number, finding)`` pairs from an iterable of pages."""
+    for number, text in pages:
+        for finding in split_findings(text):
+            yield number, finding
+
+
+def iter_batches(findings, batch_size):
+    """Group ``(page, finding)`` pairs into ``(pages, findings)`` lists of up to batch_size."""
+    pages, batch = [], []
+    for page, finding in findings:
+        pages.append(page)
+        batch.append(finding)
+        if len(batch) >= batch_size:
+            yield pages, batch
+            pages, batch = [], []
+    if batch:
+        yield pages, batch
+
+
+def format_event(payload, fmt="ndjson", event=None):
+    """Serialize one streamed message as an NDJSON line or a Server-Sent Event."""
+    with metrics.stage("serialize"):
+        data = json.dumps(payload, ensure_ascii=False)
+    if fmt == "sse":
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {data}\n\n"
+    return data + "\n"
@@ -0,0 +1,433 @@
+"""
+Background analysis jobs with durable SQLite state.
+
+``POST /jobs`` stores a report and returns at once; local worker processes
+(see ``JobWorkers``) claim jobs from the same SQLite file, map them batch by
+batch and append each batch's results as they go, so ``GET /jobs/{id}``
+shows progress and partial results while a large report is still running.
+Mapping happens in the workers, never on the server's request threads or
+inference pool, so bulk reports do not slow interactive calls down.
+
+- Jobs are claimed highest ``priority`` first, then oldest first.
+- A claimed job holds a lease that its worker renews after every batch. A
+  job whose worker died (its lease expired) is claimed again.
+- A failed attempt is retried with exponential backoff until
+  ``max_attempts``; every attempt starts from scratch.
+- Submitting the same input with the same options again returns the
+  existing job (``content_hash``), unless that job failed or was cancelled,
+  or finished on another index snapshot than the active one.
+
+The queue needs no broker: WAL mode lets the server and any number of
+workers share the file. Workers can also run on their own, without the
+server starting them: ``python jobs.py --workers 4``.
+
+A job runs start to finish on the index snapshot that was active when it
+was claimed, recorded as its ``version``.
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+import metrics
+import snapshots
+from lazy import LazyResource
+
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    filename TEXT,
+    payload BLOB NOT NULL,
+    options TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    findings INTEGER NOT NULL DEFAULT 0,
+    mappings INTEGER NOT NULL DEFAULT 0,
+    compliance TEXT,
+    version TEXT,
+    error TEXT,
+    worker TEXT,
+    lease_until REAL,
+    available_at REAL NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created);
+CREATE INDEX IF NOT EXISTS jobs_content ON jobs (content_hash, status);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    batch INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    PRIMARY KEY (job_id, batch)
+);
+"""
+
+
+class LeaseLost(Exception):
+    """The job was cancelled, or reclaimed after this worker's lease expired."""
+
+
+def content_hash(kind, payload, options):
+    digest = hashlib.sha256()
+    digest.update(kind.encode())
+    digest.update(b"\x00")
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    digest.update(b"\x00")
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+class JobQueue:
+    """The jobs table; safe to share between threads (one connection each) and processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        # Queues created before jobs recorded their index version
+        if "version" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN version TEXT")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; multi-statement updates take BEGIN IMMEDIATE explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def submit(self, kind, payload, options, priority=0, filename=None, max_attempts=None, version=None):
+        """
+        Queue a job; ``payload`` is the report bytes (UTF-8 text, or a PDF).
+        A finished job is only reused if it ran on index ``version`` (when
+        given). Returns ``(job_id, deduplicated)``.
+        """
+        key = content_hash(kind, payload, options)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, priority FROM jobs WHERE content_hash = ? AND (status IN ('queued', 'running') "
+                "OR (status = 'done' AND (? IS NULL OR version IS ?))) ORDER BY created DESC LIMIT 1",
+                (key, version, version)
+            ).fetchone()
+            if row is not None:
+                if priority > row["priority"]:
+                    # A more urgent resubmission bumps the queued job
+                    conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, row["id"]))
+                conn.execute("COMMIT")
+                return row["id"], True
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, content_hash, kind, filename, payload, options, priority, status, "
+                "max_attempts, available_at, created) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, key, kind, filename, payload, json.dumps(options), priority,
+                 max_attempts or config.JOB_MAX_ATTEMPTS, now, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id, False
+
+    def claim(self, worker):
+        """Lease the next runnable job to ``worker``; returns its row, or None when there is none."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A job whose workers kept dying has used up its attempts
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, lease_until = NULL, "
+                "error = COALESCE(error, 'Worker lost') WHERE status = 'running' AND lease_until < ? "
+                "AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, created LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started = ?, progress = 0, findings = 0, mappings = 0, error = NULL WHERE id = ?",
+                (worker, now + config.JOB_LEASE_S, now, row["id"])
+            )
+            # Each attempt starts over
+            conn.execute("DELETE FROM job_results WHERE job_id = ?", (row["id"],))
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def append(self, job_id, worker, batch, results, progress, findings):
+        """Store one batch of results and renew the lease; raises LeaseLost if the job is no longer ours."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_until = ?, progress = ?, findings = findings + ?, mappings = mappings + ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + config.JOB_LEASE_S, progress, findings, len(results), job_id, worker)
+            )
+            if cur.rowcount == 0:
+                raise LeaseLost(job_id)
+            conn.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, batch, results) VALUES (?, ?, ?)",
+                (job_id, batch, json.dumps(results, ensure_ascii=False))
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, job_id, worker, compliance, version=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', progress = 1, compliance = ?, version = ?, finished = ?, "
+            "lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(compliance), version, time.time(), job_id, worker)
+        )
+
+    def fail(self, job_id, worker, error):
+        """Record a failed attempt: back to the queue with backoff, or failed after the last attempt."""
+        conn = self._connect()
+        row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        now = time.time()
+        if row["attempts"] < row["max_attempts"]:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, now + config.JOB_RETRY_BACKOFF_S * 2 ** (row["attempts"] - 1), job_id, worker)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, now, job_id, worker)
+            )
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it had already finished (or does not exist)."""
+        cur = self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ?, lease_until = NULL "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id)
+        )
+        return cur.rowcount > 0
+
+    def get(self, job_id, include_results=True, since=0):
+        """
+        Job status as a dict, or None. ``results`` holds the mapped rows so
+        far, starting at row ``since``, so a poller can fetch only new ones.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, kind, filename, options, priority, status, attempts, max_attempts, progress, findings, "
+            "mappings, compliance, version, error, created, started, finished FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["compliance"] = json.loads(job["compliance"]) if job["compliance"] else None
+        job["progress"] = round(job["progress"], 4)
+        if job["status"] == "queued":
+            job["position"] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND created < ?))",
+                (row["priority"], row["priority"], row["created"])
+            ).fetchone()[0]
+        if include_results:
+            results = []
+            for (batch,) in conn.execute("SELECT results FROM job_results WHERE job_id = ? ORDER BY batch", (job_id,)):
+                results.extend(json.loads(batch))
+            job["since"] = since
+            job["results"] = results[since:]
+        return job
+
+    def counts(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        found = {status: count for status, count in rows}
+        return {status: found.get(status, 0) for status in STATUSES}
+
+
+queue = LazyResource("job_queue", lambda: JobQueue(config.JOBS_DB_PATH))
+
+
+@metrics.REGISTRY.collector
+def _job_metrics():
+    if not queue.loaded:
+        return []
+    samples = [({"status": status}, count) for status, count in queue.get().counts().items()]
+    return [("dpdp_jobs", "gauge", "Background jobs by status", samples)]
+
+
+def _pages(job):
+    """
+    ``(pages, total, unit)``: the job's ``(page_number, text)`` pages and the
+    progress denominator, in PDF pages or (for text) findings.
+    """
+    import rag
+    from ingest import iter_pdf_pages
+
+    if job["kind"] == "pdf":
+        from pypdf import PdfReader
+        total = len(PdfReader(io.BytesIO(job["payload"])).pages)
+        return iter_pdf_pages(io.BytesIO(job["payload"])), total, "pages"
+    text = bytes(job["payload"]).decode("utf-8", errors="replace")
+    return [(1, text)], len(rag.split_findings(text)), "findings"
+
+
+def run_job(job_queue, job, worker):
+    """Map one claimed job batch by batch, storing results as it goes."""
+    import rag
+    from ingest import iter_batches, iter_findings
+    from scoring import Tally
+    from segmenter import Deduplicator
+
+    opts = json.loads(job["options"])
+    include_text = opts.pop("include_text", True)
+    pages, total, unit = _pages(job)
+    # Duplicates are tracked across batches, as for streamed uploads
+    dedup = Deduplicator()
+    known = {}
+    tally = Tally()
+    offset = 0
+    for batch, (pages_, findings) in enumerate(iter_batches(iter_findings(pages), config.JOB_BATCH_SIZE)):
+        reps = [dedup.add(f) for f in findings]
+        new = [r for r in dict.fromkeys(reps) if r not in known]
+        if new:
+            for r in new:
+                known[r] = []
+            unique = [dedup.representatives[r] for r in new]
+            references = rag.resolve_references(unique, opts["top_k"])
+            pending = [unique[i] for i in references[1]]
+            query_embs = rag.encode_findings(pending) if pending else None
+            for m in rag.map_findings(unique, query_embs, references=references, **opts):
+                known[new[m["finding_index"]]].append(m)
+        mappings = [
+            {**m, "finding": finding, "finding_index": i}
+            for i, (finding, r) in enumerate(zip(findings, reps)) for m in known[r]
+        ]
+        results = rag.format_results(mappings, include_text)
+        if job["kind"] == "pdf":
+            for row, m in zip(results, mappings):
+                row["page"] = pages_[m["finding_index"]]
+        tally.add(mappings, offset=offset)
+        offset += len(findings)
+        done = pages_[-1] if unit == "pages" else offset
+        progress = min(done / total, 1.0) if total else 1.0
+        job_queue.append(job["id"], worker, batch, results, progress, len(findings))
+    job_queue.complete(job["id"], worker, tally.summary(), rag.get_index_version())
+
+
+def work(path=None, stop=None, poll_interval=None, threads=None):
+    """Worker loop: claim and run jobs until ``stop`` (a multiprocessing Event) is set."""
+    if threads:
+        # Cap intra-op threads before the model loads so workers leave CPUs to the server
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(name, str(threads))
+    import rag
+    rag.warm_up()
+
+    job_queue = JobQueue(path or config.JOBS_DB_PATH)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = poll_interval or config.JOB_POLL_INTERVAL_S
+    while stop is None or not stop.is_set():
+        job = job_queue.claim(worker)
+        if job is None:
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        try:
+            # Every batch of a job is mapped by the same index snapshot
+            with snapshots.bound():
+                run_job(job_queue, job, worker)
+        except LeaseLost:
+            # Cancelled, or another worker took over after our lease expired
+            continue
+        except Exception as e:
+            job_queue.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+
+
+class JobWorkers:
+    """Local worker processes started and stopped with the server."""
+
+    def __init__(self, workers=None, path=None):
+        self.workers = config.JOB_WORKERS if workers is None else workers
+        self.path = path or config.JOBS_DB_PATH
+        self._processes = []
+        self._stop = None
+
+    def start(self):
+        if self._processes or self.workers <= 0:
+            return
+        # spawn, not fork: forking after torch has started threads can deadlock
+        ctx = multiprocessing.get_context("spawn")
+        self._stop = ctx.Event()
+        for i in range(self.workers):
+            process = ctx.Process(
+                target=work, args=(self.path, self._stop, None, config.JOB_WORKER_THREADS),
+                name=f"job-worker-{i}", daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+    def shutdown(self, timeout=10):
+        """
+        Give workers ``timeout`` seconds to finish their current job, then
+        terminate them; a job cut short is claimed again once its lease expires.
+        """
+        if self._stop is not None:
+            self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers against the jobs database")
+    parser.add_argument("--workers", type=int, default=max(1, config.JOB_WORKERS))
+    parser.add_argument("--db", default=config.JOBS_DB_PATH)
+    args = parser.parse_args()
+    pool = JobWorkers(args.workers, args.db)
+    pool.start()
+    try:
+        for p in pool._processes:
+            p.join()
+    except KeyboardInterrupt:
+        pool.shutdown()
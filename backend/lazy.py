@@ -0,0 +1,66 @@
+"""
+Thread-safe lazy initialization for the model and indexes.
+
+Importing rag.py or search_dpdp.py no longer loads anything; the expensive
+state is built on first use, exactly once per process even when several
+threads ask for it at the same time. Servers warm it up front (blocking or
+in a background thread) and report progress on /readyz.
+"""
+import threading
+
+
+class LazyResource:
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self.error = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def loading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get(self):
+        """Return the value, building it on the first call."""
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                try:
+                    self._value = self._loader()
+                except Exception as e:
+                    self.error = e
+                    raise
+                self.error = None
+                self._loaded = True
+        return self._value
+
+    def warm(self, background=False):
+        """Build now, or in a daemon thread when ``background`` (errors land in ``self.error``)."""
+        if not background:
+            return self.get()
+        with self._lock:
+            if self._loaded or self.loading:
+                return self._thread
+            self._thread = threading.Thread(target=self._warm_quietly, name=f"warm-{self.name}", daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def _warm_quietly(self):
+        try:
+            self.get()
+        except Exception:
+            pass
+
+    def reset(self):
+        """Drop the value so the next ``get`` rebuilds it."""
+        with self._lock:
+            self._value = None
+            self._loaded = False
@@ -0,0 +1,219 @@
+"""
+Lexical (BM25) retrieval over the DPDP chunks, and its fusion with dense scores.
+
+Dense embeddings blur exact statutory terms: a finding about a "Significant
+Data Fiduciary" can rank a loosely related section above section 10. The
+inverted index here is built once over the same chunks as the vector store
+(``utils.chunker.extract_chunks``). Every posting already carries its BM25
+weight, so scoring a query is one ``bincount`` over the postings of its
+terms. Terms are lowercased words plus adjacent-word bigrams, which keeps
+multi-word terms like "consent manager" together.
+
+``fuse`` combines dense and lexical scores with reciprocal-rank fusion or a
+weighted sum. ``find_section_refs`` spots explicit citations ("Sec 9",
+"s. 8(5)") so callers can look them up directly without embedding anything.
+"""
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+import config
+import snapshots
+from utils.chunker import extract_chunks, assign_chunk_ids
+
+DATA_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "processed", "sections.json"))
+
+FUSION_METHODS = ("rrf", "weighted")
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with".split()
+)
+
+# "Section 8(6)", "Sec. 9", "s. 8(5)(b)", "ss. 8 and 9", "§ 10"
+SECTION_REF = re.compile(
+    r"(?<![\w.])(?:sections?|secs?\.?|ss?\.|§+)\s*"
+    r"(\d+[A-Z]?(?:\s?\([0-9A-Za-z]+\))*"
+    r"(?:\s*(?:,|and|or|&)\s*\d+[A-Z]?(?:\s?\([0-9A-Za-z]+\))*)*)",
+    re.IGNORECASE
+)
+# Last "(5)" or "[proviso 1]" of a section or clause id
+LAST_PART = re.compile(r"(?:\([^()]*\)|\[[^\]]*\])$")
+REF_ITEM = re.compile(r"\d+[A-Z]?(?:\s?\([0-9A-Za-z]+\))*", re.IGNORECASE)
+# "section 43A of the Information Technology Act" cites another statute
+OTHER_ACT = re.compile(
+    r"\s*,?\s+of\s+(?!(?:the\s+)?(?:dpdp\b|digital\s+personal\b|act\b|this\s+act\b))(?:[\w-]+\s+){0,6}(?:act|code|rules?)\b",
+    re.IGNORECASE
+)
+
+
+def tokenize(text):
+    """Lowercased words without stopwords, plus adjacent-word bigrams."""
+    words = [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with precomputed BM25 postings.
+
+    Mirrors the VectorIndex shape: parallel ``ids``, ``metadatas`` and
+    ``documents`` lists, and ``search()`` returning best-first rows.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.metadatas = []
+        self.documents = []
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, ids, texts, metadatas=None, documents=None):
+        """Index ``texts``; ``documents`` (default: the texts) is what results return."""
+        self.ids = list(ids)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.ids]
+        self.documents = list(documents) if documents is not None else list(texts)
+
+        term_docs = defaultdict(list)
+        lengths = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_docs[term].append((row, tf))
+
+        n = len(self.ids)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avg_len = float(lengths.mean()) if n and lengths.mean() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * lengths / avg_len)
+
+        self.postings = {}
+        for term, entries in term_docs.items():
+            rows = np.fromiter((r for r, _ in entries), dtype=np.int64, count=len(entries))
+            tf = np.fromiter((t for _, t in entries), dtype=np.float32, count=len(entries))
+            idf = np.log1p((n - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[term] = (rows, (idf * tf * (self.k1 + 1.0) / (tf + norm[rows])).astype(np.float32))
+        return self
+
+    def scores(self, query):
+        """BM25 score of every document for ``query`` (zeros when nothing matches)."""
+        hits = [self.postings[t] for t in set(tokenize(query)) if t in self.postings]
+        if not hits:
+            return np.zeros(len(self.ids), dtype=np.float32)
+        rows = np.concatenate([h[0] for h in hits])
+        weights = np.concatenate([h[1] for h in hits])
+        return np.bincount(rows, weights=weights, minlength=len(self.ids)).astype(np.float32)
+
+    def search(self, query, top_k, allowed=None):
+        """
+        ``(rows, scores)`` of the ``top_k`` best matching documents, best-first,
+        score > 0 only; ``allowed`` is an optional boolean mask of eligible rows.
+        """
+        scores = self.scores(query)
+        hit = scores > 0
+        if allowed is not None:
+            hit &= allowed
+        rows = np.nonzero(hit)[0]
+        order = np.argsort(-scores[rows], kind="stable")[:top_k]
+        return rows[order], scores[rows[order]]
+
+
+def load_chunk_index(data_path=DATA_PATH):
+    """BM25 over the chunks of sections.json; ids match the vector store's chunk ids."""
+    with open(data_path, encoding="utf-8") as f:
+        chunks = extract_chunks(json.load(f))
+    metadatas = [{
+        "section_id": c["section_id"],
+        "title": c["title"],
+        "chapter": c["chapter"],
+        "clause_path": c["clause_path"]
+    } for c in chunks]
+    # Titles carry most defined terms ("Significant Data Fiduciary"), so they are indexed too
+    return BM25Index().build(
+        assign_chunk_ids(chunks), [f"{c['title']}. {c['text']}" for c in chunks], metadatas, [c["text"] for c in chunks]
+    )
+
+
+# Shared by rag.py and search_dpdp.py; built on first hybrid query or warm-up, once per index snapshot
+chunk_index = snapshots.resource("lexical_chunk_index", lambda snapshot: load_chunk_index(snapshot.sections_path))
+
+
+def fusion_options(lexical_weight=None, fusion=None):
+    """Per-request ``(weight, method)``, falling back to config; raises ValueError when invalid."""
+    weight = config.LEXICAL_WEIGHT if lexical_weight is None else float(lexical_weight)
+    method = fusion or config.FUSION
+    if not 0.0 <= weight <= 1.0:
+        raise ValueError("lexical_weight must be between 0 and 1")
+    if method not in FUSION_METHODS:
+        raise ValueError(f"fusion must be one of {', '.join(FUSION_METHODS)}")
+    return weight, method
+
+
+def _ranks(scores, present):
+    """1-based rank of every column within its row (best = 1); 0 where not ``present``."""
+    order = np.argsort(np.where(present, -scores, np.inf), axis=1, kind="stable")
+    return np.where(present, np.argsort(order, axis=1) + 1, 0)
+
+
+def fuse(semantic, lexical, weight, method="rrf", k=60):
+    """
+    Fuse ``(n_queries, n_docs)`` dense and lexical score matrices.
+
+    ``semantic`` holds cosine similarities, -inf for documents the dense
+    search did not return; ``lexical`` holds BM25 scores, 0 for no match.
+    ``weight`` is the lexical share in [0, 1]. With "rrf" each list adds
+    ``share / (k + rank)``; with "weighted" the fused score is
+    ``(1 - weight) * cosine + weight * bm25 / max_bm25``, counting a missing
+    cosine as 0. Documents found by neither search come back as -inf.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method!r}")
+    semantic = np.asarray(semantic, dtype=np.float32)
+    lexical = np.asarray(lexical, dtype=np.float32)
+    dense_hit = np.isfinite(semantic)
+    lexical_hit = lexical > 0
+
+    if method == "rrf":
+        fused = (
+            np.where(dense_hit, (1.0 - weight) / (k + _ranks(semantic, dense_hit)), 0.0)
+            + np.where(lexical_hit, weight / (k + _ranks(lexical, lexical_hit)), 0.0)
+        )
+    else:
+        top = lexical.max(axis=1, keepdims=True) if lexical.size else np.zeros((lexical.shape[0], 1))
+        normalized = lexical / np.where(top > 0, top, 1.0)
+        fused = (1.0 - weight) * np.where(dense_hit, semantic, 0.0) + weight * normalized
+    return np.where(dense_hit | lexical_hit, fused, -np.inf).astype(np.float32)
+
+
+def find_section_refs(text):
+    """
+    Explicit citations in ``text`` as ids, in order of appearance, e.g.
+    "breach of s. 8(5) and Sec 9" -> ["8(5)", "9"]. Citations of other
+    statutes ("section 43A of the IT Act") are ignored.
+    """
+    refs = []
+    for m in SECTION_REF.finditer(text):
+        if OTHER_ACT.match(text, m.end()):
+            continue
+        for item in REF_ITEM.findall(m.group(1)):
+            ref = re.sub(r"\s+", "", item)
+            if ref not in refs:
+                refs.append(ref)
+    return refs
+
+
+def ref_candidates(ref):
+    """``ref`` and its ancestors, most specific first: "8(5)(b)" -> "8(5)(b)", "8(5)", "8"."""
+    candidates = [ref]
+    while True:
+        m = LAST_PART.search(candidates[-1])
+        if m is None or m.start() == 0:
+            return candidates
+        candidates.append(candidates[-1][:m.start()])
@@ -1,9 +1,54 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+
+from fastapi import Body, FastAPI, File, Header, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-from rag import query_dpdp
+from starlette.concurrency import run_in_threadpool
+from rag import (
+    split_findings, encode_findings, resolve_references, map_findings, format_results, results_cache_key,
+    get_section, section_outline, get_index_version
+)
+from batcher import MicroBatcher
+from inference import InferencePool, PoolSaturated, ClientDisconnected, Warmup
+from segmenter import Deduplicator, dedupe, expand
+from scoring import Tally, score_mappings
+from jobs import JobWorkers, queue as job_queue
+from crosswalk import crosswalk
+from ingest import iter_pdf_pages, iter_text_pages, iter_findings, iter_batches, format_event
+import config
+import cache
+import metrics
+import snapshots
+
+# CPU-bound work runs here, never on the event loop
+pool = InferencePool(warm_modules=("rag",))
+# Coalesces query encodes from concurrent requests into shared model calls
+batcher = MicroBatcher(encode_findings, runner=pool.run)
+# Model + index load; importing rag no longer does it
+warmup = Warmup(pool, "rag")
+# Background job workers: separate processes, so bulk jobs never hold a request thread
+job_workers = JobWorkers()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    pool.start()
+    batcher.start()
+    warmup.start()
+    job_workers.start()
+    if config.WARMUP == "blocking":
+        await warmup.wait()
+    yield
+    warmup.cancel()
+    await batcher.stop()
+    pool.shutdown()
+    await run_in_threadpool(job_workers.shutdown)
+
+# JSON rendering shows up as the "serialize" stage
+TimedJSONResponse = metrics.timed_response(JSONResponse)
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -11,31 +56,410 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Debug-Timing", "X-Profile-Path", "X-Profile-Skipped", "X-Index-Version"],
 )
+# Per-request latency, status counts and the opt-in X-Debug-Timing header
+app.middleware("http")(metrics.asgi_middleware)
+# Each request is served by the index snapshot active when it arrived (X-Index-Version)
+app.middleware("http")(snapshots.asgi_middleware)
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated(request, exc):
+    return JSONResponse({"error": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(asyncio.TimeoutError)
+async def inference_timeout(request, exc):
+    return JSONResponse({"error": "Analysis timed out"}, status_code=504)
 
-class Query(BaseModel):
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected(request, exc):
+    # Nobody is listening; 499 mirrors nginx's "client closed request"
+    return JSONResponse({"error": "Client disconnected"}, status_code=499)
+
+class MappingOptions(BaseModel):
+    top_k: int = Field(1, ge=1, le=50)
+    threshold: float = 0.3
+    # "clause" maps to individual clauses and returns their path, e.g. 8(5)
+    granularity: Literal["section", "clause"] = "section"
+    aggregation: Literal["max", "mean"] = "max"
+    # False returns only section/clause ids; fetch texts from /sections/{id}
+    include_text: bool = True
+    # Share of BM25 in the hybrid ranking (0 = dense only) and how it is fused;
+    # None uses DPDP_LEXICAL_WEIGHT / DPDP_FUSION
+    lexical_weight: Optional[float] = Field(None, ge=0, le=1)
+    fusion: Optional[Literal["rrf", "weighted"]] = None
+    # Cross-encoder second stage (see rerank.py) and its time budget; None uses DPDP_RERANK_BUDGET_MS
+    rerank: bool = False
+    rerank_budget_ms: Optional[float] = Field(None, gt=0)
+
+class Query(MappingOptions):
+    input: str
+
+class BatchQuery(MappingOptions):
+    inputs: List[str]
+
+class JobRequest(MappingOptions):
     input: str
+    # Higher runs first
+    priority: int = 0
+
+async def map_unique(findings, opts):
+    """Map already-deduplicated findings off the event loop; only those without a section citation are encoded."""
+    references = await pool.run(resolve_references, findings, opts.top_k)
+    pending = [findings[i] for i in references[1]]
+    # The batcher encodes in its own task, so this request's timing is the wait for its batch
+    with metrics.stage("encode_wait"):
+        query_embs = await batcher.encode(pending) if pending else None
+    return await pool.run(
+        map_findings, findings, query_embs, opts.threshold, opts.top_k, opts.granularity, opts.aggregation,
+        opts.lexical_weight, opts.fusion, references, opts.rerank, opts.rerank_budget_ms
+    )
+
+async def map_findings_async(findings, opts):
+    """Map findings, encoding each group of (near-)duplicates once."""
+    # MinHash/LSH over a large report takes seconds; keep it off the event loop
+    unique, occurrences = await pool.run(dedupe, findings)
+    return expand(await map_unique(unique, opts), findings, occurrences)
+
+async def map_document(text, opts):
+    key = results_cache_key(
+        text, opts.threshold, opts.top_k, opts.granularity, opts.aggregation, opts.lexical_weight, opts.fusion,
+        opts.rerank, opts.rerank_budget_ms
+    )
+    cached = cache.query_results.get(key)
+    if cached is not cache.MISSING:
+        return list(cached)
+
+    findings = await pool.run(split_findings, text)
+    if not findings:
+        return []
+    mappings = await map_findings_async(findings, opts)
+    cache.query_results.put(key, mappings)
+    return mappings
+
+async def map_documents(texts, opts):
+    return await asyncio.gather(*(map_document(text, opts) for text in texts))
 
 @app.post("/analyze")
-def analyze(q: Query):
-    mappings = query_dpdp(q.input)
+async def analyze(q: Query, request: Request):
+    mappings = await pool.submit(map_document(q.input, q), request.is_disconnected)
     
     # Standardized response format (No AI branding)
-    results = []
-    for m in mappings:
-        results.append({
-            "finding": m["finding"],
-            "section": m["section_number"],
-            "title": m["section_title"],
-            "chapter": m["chapter"],
-            "description": m["description"]
-        })
-        
     return {
         "status": "success",
-        "results": results
+        "version": get_index_version(),
+        "results": format_results(mappings, q.include_text),
+        "compliance": score_mappings(mappings)
     }
 
+@app.post("/analyze/batch")
+async def analyze_batch(q: BatchQuery, request: Request):
+    """
+    Maps many documents in one call. Sentences from every document (and from
+    other in-flight requests) share encode batches.
+    """
+    all_mappings = await pool.submit(map_documents(q.inputs, q), request.is_disconnected)
+
+    return {
+        "status": "success",
+        "version": get_index_version(),
+        "documents": [
+            {"index": i, "results": format_results(mappings, q.include_text), "compliance": score_mappings(mappings)}
+            for i, mappings in enumerate(all_mappings)
+        ]
+    }
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving, whether or not the model has loaded."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 once the model and indexes are loaded, 503 while loading or failed."""
+    ready, details = warmup.status()
+    return JSONResponse(details, status_code=200 if ready else 503)
+
+@app.get("/sections")
+def list_sections():
+    """Section ids, titles, chapters and clause ids (no texts), from the section store."""
+    try:
+        return {"sections": section_outline()}
+    except LookupError as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+
+@app.get("/sections/{section_id}")
+def read_section(section_id: str, include_text: bool = True):
+    """
+    One section ("8") or clause ("8(5)(b)", "9[proviso 1]") served straight
+    from the memory-mapped section store.
+    """
+    try:
+        record = get_section(section_id, include_text)
+    except LookupError as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown section or clause: {section_id}")
+    return record
+
+@app.get("/crosswalk")
+def read_crosswalk(request: Request, framework: Optional[str] = None, control: Optional[str] = None):
+    """
+    The precompiled CWE / OWASP Top 10 / ISO 27001 Annex A to DPDP table
+    (see crosswalk.py), optionally one framework or one control (by id,
+    alias or title). The ETag is the table's version.
+    """
+    try:
+        table = crosswalk.get()
+    except (OSError, ValueError, KeyError) as e:
+        return JSONResponse({"error": f"Crosswalk unavailable: {e}"}, status_code=503)
+    etag = f'"{table.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    body = table.export(framework, control)
+    if control is not None and not body["controls"]:
+        raise HTTPException(status_code=404, detail=f"Unknown control: {control}")
+    return TimedJSONResponse(body, headers={"ETag": etag})
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Hit/miss counters of this worker's caches. With a process inference pool
+    the embedding cache lives in the pool workers; use the SQLite tier to
+    share it.
+    """
+    return cache.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's latency histograms and counters."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/cache/clear")
+def cache_clear(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    cache.query_embeddings.clear()
+    cache.invalidate_results()
+    return {"status": "success"}
+
+async def stream_upload(upload, opts, fmt, request):
+    """
+    Map an uploaded report batch by batch, yielding each batch's mappings as
+    soon as they are ready. The pool slot is taken here rather than by the
+    caller: a body that never starts (the client left first) never runs this
+    generator, so its ``finally`` could not give the slot back.
+    """
+    try:
+        pool.acquire()
+    except PoolSaturated:
+        # Admitted moments ago, but the pool filled up before the body started
+        yield format_event({"status": "error", "error": "Server busy, retry shortly"}, fmt, event="error")
+        await upload.close()
+        return
+    try:
+        if upload.filename and upload.filename.lower().endswith(".pdf"):
+            pages = iter_pdf_pages(upload.file)
+        else:
+            pages = iter_text_pages(upload.file)
+        batches = iter_batches(iter_findings(pages), config.UPLOAD_BATCH_SIZE)
+
+        # Scanner exports repeat findings across the whole report, so
+        # duplicates are tracked across batches: each group is mapped once
+        dedup = Deduplicator()
+        known = {}
+        tally = Tally()
+        total_findings = 0
+        total_mappings = 0
+        last_page = 0
+
+        def next_batch():
+            batch = next(batches, None)
+            if batch is None:
+                return None
+            pages_, findings = batch
+            return pages_, findings, [dedup.add(f) for f in findings]
+
+        while True:
+            # pypdf parsing and deduplication are blocking; keep them off the event loop
+            batch = await run_in_threadpool(next_batch)
+            if batch is None:
+                break
+            if await request.is_disconnected():
+                return
+
+            pages_, findings, reps = batch
+            new = [r for r in dict.fromkeys(reps) if r not in known]
+            if new:
+                for r in new:
+                    known[r] = []
+                for m in await map_unique([dedup.representatives[r] for r in new], opts):
+                    known[new[m["finding_index"]]].append(m)
+            mappings = [
+                {**m, "finding": finding, "finding_index": i}
+                for i, (finding, r) in enumerate(zip(findings, reps)) for m in known[r]
+            ]
+            results = format_results(mappings, opts.include_text)
+            for row, m in zip(results, mappings):
+                row["page"] = pages_[m["finding_index"]]
+            tally.add(mappings, offset=total_findings)
+
+            total_findings += len(findings)
+            total_mappings += len(results)
+            last_page = pages_[-1]
+            yield format_event({"pages_done": last_page, "results": results}, fmt)
+
+        yield format_event({
+            "status": "success",
+            "pages": last_page,
+            "findings": total_findings,
+            "mappings": total_mappings,
+            "version": get_index_version(),
+            "compliance": tally.summary()
+        }, fmt, event="done")
+    except Exception as e:
+        yield format_event({"status": "error", "error": str(e)}, fmt, event="error")
+    finally:
+        pool.release()
+        await upload.close()
+
+@app.post("/analyze/upload")
+async def analyze_upload(
+    request: Request,
+    file: UploadFile = File(...),
+    top_k: int = 1,
+    threshold: float = 0.3,
+    granularity: Literal["section", "clause"] = "section",
+    aggregation: Literal["max", "mean"] = "max",
+    format: Literal["ndjson", "sse"] = "ndjson",
+    include_text: bool = True,
+    lexical_weight: Optional[float] = None,
+    fusion: Optional[Literal["rrf", "weighted"]] = None,
+    rerank: bool = False,
+    rerank_budget_ms: Optional[float] = None
+):
+    """
+    Streams mappings for an uploaded PDF (or text) report as NDJSON lines or
+    Server-Sent Events, one message per encoded batch plus a final summary.
+    """
+    if not 1 <= top_k <= 50:
+        raise HTTPException(status_code=422, detail="top_k must be between 1 and 50")
+    if lexical_weight is not None and not 0 <= lexical_weight <= 1:
+        raise HTTPException(status_code=422, detail="lexical_weight must be between 0 and 1")
+    if rerank_budget_ms is not None and rerank_budget_ms <= 0:
+        raise HTTPException(status_code=422, detail="rerank_budget_ms must be positive")
+    opts = MappingOptions(
+        top_k=top_k, threshold=threshold, granularity=granularity, aggregation=aggregation, include_text=include_text,
+        lexical_weight=lexical_weight, fusion=fusion, rerank=rerank, rerank_budget_ms=rerank_budget_ms
+    )
+
+    # Refuse with a 503 while that is still possible; stream_upload takes the slot
+    if pool.in_flight >= pool.max_pending:
+        raise PoolSaturated(f"{pool.in_flight} requests already in flight")
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_upload(file, opts, format, request), media_type=media_type)
+
+def queued_job(job_id, deduplicated):
+    """Response of both job submission endpoints."""
+    return {"id": job_id, "deduplicated": deduplicated, "status": job_queue.get().get(job_id, False)["status"]}
+
+@app.post("/jobs", status_code=202)
+def submit_job(q: JobRequest):
+    """
+    Queue a report for background mapping and return its id at once; poll
+    GET /jobs/{id}. The same input with the same options returns the
+    existing job.
+    """
+    options = q.model_dump(exclude={"input", "priority"})
+    job_id, deduplicated = job_queue.get().submit(
+        "text", q.input.encode("utf-8"), options, q.priority, version=get_index_version()
+    )
+    return queued_job(job_id, deduplicated)
+
+@app.post("/jobs/upload", status_code=202)
+async def submit_job_upload(
+    file: UploadFile = File(...),
+    priority: int = 0,
+    top_k: int = 1,
+    threshold: float = 0.3,
+    granularity: Literal["section", "clause"] = "section",
+    aggregation: Literal["max", "mean"] = "max",
+    include_text: bool = True,
+    lexical_weight: Optional[float] = None,
+    fusion: Optional[Literal["rrf", "weighted"]] = None,
+    rerank: bool = False,
+    rerank_budget_ms: Optional[float] = None
+):
+    """Queue an uploaded PDF (or text) report; same options as /analyze/upload."""
+    if not 1 <= top_k <= 50:
+        raise HTTPException(status_code=422, detail="top_k must be between 1 and 50")
+    if lexical_weight is not None and not 0 <= lexical_weight <= 1:
+        raise HTTPException(status_code=422, detail="lexical_weight must be between 0 and 1")
+    if rerank_budget_ms is not None and rerank_budget_ms <= 0:
+        raise HTTPException(status_code=422, detail="rerank_budget_ms must be positive")
+    opts = MappingOptions(
+        top_k=top_k, threshold=threshold, granularity=granularity, aggregation=aggregation, include_text=include_text,
+        lexical_weight=lexical_weight, fusion=fusion, rerank=rerank, rerank_budget_ms=rerank_budget_ms
+    )
+    payload = await file.read(config.JOB_MAX_UPLOAD_BYTES + 1)
+    await file.close()
+    if len(payload) > config.JOB_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Reports are limited to {config.JOB_MAX_UPLOAD_BYTES} bytes")
+    kind = "pdf" if file.filename and file.filename.lower().endswith(".pdf") else "text"
+    job_id, deduplicated = await run_in_threadpool(
+        job_queue.get().submit, kind, payload, opts.model_dump(), priority, file.filename, None, get_index_version()
+    )
+    return await run_in_threadpool(queued_job, job_id, deduplicated)
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str, include_results: bool = True, since: int = 0):
+    """
+    Status, progress (0-1), attempts and the results mapped so far. Pass
+    since=<rows already received> to fetch only new rows while polling.
+    """
+    job = job_queue.get().get(job_id, include_results, max(0, since))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job; a running one stops after its current batch."""
+    if not job_queue.get().cancel(job_id):
+        job = job_queue.get().get(job_id, False)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return {"id": job_id, "status": "cancelled"}
+
+def check_admin(token):
+    if not snapshots.authorized(token):
+        raise HTTPException(status_code=403, detail="Admin token missing or invalid; /admin and /cache/clear need DPDP_ADMIN_TOKEN set")
+
+@app.get("/admin/snapshots")
+def admin_snapshots(x_admin_token: Optional[str] = Header(None)):
+    """The active index snapshot, the one CURRENT names, and every snapshot on disk."""
+    check_admin(x_admin_token)
+    return {**snapshots.status(), "snapshots": snapshots.list_snapshots()}
+
+@app.post("/admin/snapshots/{action}")
+def admin_snapshot_action(
+    action: Literal["reload", "activate", "rollback"],
+    version: Optional[str] = Body(None, embed=True),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    reload: load CURRENT (or ``version``) in this process; activate: point
+    CURRENT at ``version``; rollback: point it back at the previous one. The
+    new snapshot loads in the background and is swapped in when ready.
+    """
+    check_admin(x_admin_token)
+    try:
+        return snapshots.admin(action, version)
+    except (LookupError, FileNotFoundError) as e:
+        raise HTTPException(status_code=404 if isinstance(e, FileNotFoundError) else 409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,401 @@
+"""
+Per-stage latency instrumentation and Prometheus metrics.
+
+``stage(name)`` times one step of the mapping pipeline (segment, dedupe,
+references, encode, search, format, serialize...) into the
+``dpdp_stage_seconds`` histogram and, when the current request asked for
+it, into that request's timings, returned as an ``X-Debug-Timing``
+header. Counters track findings per document, findings resolved by
+citation or deduplication, threshold rejections and errors; cache hit and
+miss counts are read from cache.stats() at scrape time. ``render()``
+produces the Prometheus text exposition format served on /metrics.
+
+Metrics are per process. With a process inference pool
+(DPDP_INFERENCE_POOL=process) stages that run inside pool workers are not
+visible to the server's /metrics.
+
+A request can also be profiled: send ``X-Profile: 1`` (or set
+DPDP_PROFILE_SAMPLE_RATE to profile a fraction of all requests) with
+DPDP_PROFILE_DIR set, and a cProfile dump (or a pyinstrument HTML report
+with DPDP_PROFILER=pyinstrument) is written there per request. The report
+covers the thread that handles the request and the calls it makes on a
+thread InferencePool, including the shared encode batch it joined (work in
+process pool workers is not profiled). One request per process is profiled
+at a time; a request asking while another is profiled is served unprofiled
+with an ``X-Profile-Skipped`` header.
+"""
+import bisect
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                out.append((f"{self.name}_bucket", self.labelnames + ("le",), key + (_number(bound),), cumulative))
+            out.append((f"{self.name}_sum", self.labelnames, key, total))
+            out.append((f"{self.name}_count", self.labelnames, key, cumulative))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, kind, help, [(labels dict, value)])]``, called at scrape time."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, names, values, value in metric.samples():
+                lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+        for fn in self.collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("dpdp_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram("dpdp_request_seconds", "End-to-end request latency", ["route", "method"])
+REQUESTS = REGISTRY.counter("dpdp_requests_total", "Requests served", ["route", "method", "status"])
+FINDINGS_PER_DOCUMENT = REGISTRY.histogram(
+    "dpdp_findings_per_document", "Findings segmented from one input document", (),
+    (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+FINDINGS = REGISTRY.counter(
+    "dpdp_findings_total", "Findings by how they were mapped (encoded, reference, crosswalk, duplicate)", ["path"]
+)
+THRESHOLD_REJECTIONS = REGISTRY.counter(
+    "dpdp_threshold_rejections_total", "Top-k candidates dropped for scoring at or below the threshold"
+)
+RERANK_FALLBACKS = REGISTRY.counter(
+    "dpdp_rerank_fallbacks_total", "Findings kept in bi-encoder order instead of reranked", ["reason"]
+)
+ERRORS = REGISTRY.counter("dpdp_errors_total", "Unhandled errors by route", ["route"])
+
+
+@REGISTRY.collector
+def _cache_metrics():
+    import cache
+    stats = cache.stats()
+    out = []
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("entries", "gauge"), ("bytes", "gauge")):
+        samples = [({"cache": name}, s[field]) for name, s in stats.items() if field in s]
+        if samples:
+            out.append((f"dpdp_cache_{field}" + ("_total" if kind == "counter" else ""), kind, f"Cache {field}", samples))
+    return out
+
+
+def render():
+    return REGISTRY.render()
+
+
+# Per-request stage timings, set only when the request asked for X-Debug-Timing
+_timings = contextvars.ContextVar("dpdp_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into the histogram (and the current request's timings)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed_response(response_class):
+    """
+    Subclass of a Starlette response class (e.g. JSONResponse) whose body
+    rendering is timed as the "serialize" stage.
+    """
+    class TimedResponse(response_class):
+        def render(self, content):
+            with stage("serialize"):
+                return super().render(content)
+
+    TimedResponse.__name__ = f"Timed{response_class.__name__}"
+    return TimedResponse
+
+
+def wants_timing(headers):
+    return config.DEBUG_TIMING and headers.get("x-debug-timing", "").lower() in ("1", "true", "yes")
+
+
+def wants_profile(headers):
+    if not config.PROFILE_DIR:
+        return False
+    if headers.get("x-profile", "").lower() in ("1", "true", "yes"):
+        return True
+    return config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE
+
+
+def format_timings(timings, total):
+    parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts)
+
+
+# cProfile (from 3.12, on sys.monitoring) and pyinstrument's async mode
+# cannot run two profiles at once, so profiled requests take turns
+_profile_lock = threading.Lock()
+# The profile of the current request, followed into pool threads by run_profiled()
+_profiler = contextvars.ContextVar("dpdp_profiler", default=None)
+
+
+class Profiler:
+    """cProfile or pyinstrument around one request; the report lands in DPDP_PROFILE_DIR."""
+
+    def __init__(self, label):
+        self.label = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "root"
+        self.kind = config.PROFILER
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler as _Pyinstrument
+            self._profiler = _Pyinstrument(async_mode="enabled")
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+        # Profiles taken on pool threads, merged into the report by stop()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def run(self, fn, *args):
+        """Call ``fn(*args)`` on this (pool) thread, profiled into this request's report."""
+        if self.kind != "pyinstrument" and sys.version_info >= (3, 12):
+            # cProfile on sys.monitoring already sees every thread
+            return fn(*args)
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler as _Pyinstrument
+            profiler = _Pyinstrument(async_mode="disabled")
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return fn(*args)
+        finally:
+            if self.kind == "pyinstrument":
+                profiler.stop()
+                profile = profiler.last_session
+            else:
+                profiler.disable()
+                profile = profiler
+            with self._threads_lock:
+                self._threads.append(profile)
+
+    def stop(self):
+        """Stop profiling and write the report; returns its path."""
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(config.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.label}")
+        if self.kind == "pyinstrument":
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+
+            self._profiler.stop()
+            session = self._profiler.last_session
+            for other in self._threads:
+                session = Session.combine(session, other)
+            path = f"{stem}.html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            import pstats
+
+            self._profiler.disable()
+            stats = pstats.Stats(self._profiler)
+            for other in self._threads:
+                stats.add(other)
+            path = f"{stem}.prof"
+            stats.dump_stats(path)
+        return path
+
+
+def run_profiled(fn, *args):
+    """``fn(*args)``, profiled into the current request's report if it is being profiled (see InferencePool.run)."""
+    profiler = _profiler.get()
+    return fn(*args) if profiler is None else profiler.run(fn, *args)
+
+
+def current_profiler():
+    return _profiler.get()
+
+
+@contextmanager
+def profiling(profiler):
+    """Attribute pool calls made in this block to ``profiler`` (e.g. a shared encode batch)."""
+    token = _profiler.set(profiler)
+    try:
+        yield
+    finally:
+        _profiler.reset(token)
+
+
+class RequestTimer:
+    """Bookkeeping for one request, shared by the FastAPI middleware and the Flask hooks."""
+
+    def __init__(self, method, path, headers):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.timings = {} if wants_timing(headers) else None
+        self._token = _timings.set(self.timings)
+        self.profiler = None
+        self.profile_skipped = False
+        if wants_profile(headers):
+            if _profile_lock.acquire(blocking=False):
+                try:
+                    self.profiler = Profiler(f"{method}_{path}")
+                    self.profiler.start()
+                except BaseException:
+                    _profile_lock.release()
+                    raise
+                self._profiler_token = _profiler.set(self.profiler)
+            else:
+                self.profile_skipped = True
+
+    def finish(self, route, status, headers):
+        """Record the request and add debug headers to ``headers`` (a mutable mapping)."""
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            try:
+                headers["X-Profile-Path"] = self.profiler.stop()
+            except OSError as e:
+                # A bad DPDP_PROFILE_DIR must not fail the request being profiled
+                print(f"Warning: could not write profile: {e}")
+            finally:
+                _profile_lock.release()
+            try:
+                _profiler.reset(self._profiler_token)
+            except ValueError:
+                _profiler.set(None)
+        elif self.profile_skipped:
+            headers["X-Profile-Skipped"] = "another request is being profiled"
+        REQUEST_SECONDS.observe(elapsed, route=route, method=self.method)
+        REQUESTS.inc(route=route, method=self.method, status=str(status))
+        if status >= 500:
+            ERRORS.inc(route=route)
+        if self.timings is not None:
+            headers["X-Debug-Timing"] = format_timings(self.timings, elapsed)
+        try:
+            _timings.reset(self._token)
+        except ValueError:
+            # Flask may finish a request in a different context than it started in
+            _timings.set(None)
+
+
+async def asgi_middleware(request, call_next):
+    """FastAPI/Starlette ``http`` middleware: time, count and optionally profile the request."""
+    timer = RequestTimer(request.method, request.url.path, request.headers)
+    try:
+        response = await call_next(request)
+    except Exception:
+        timer.finish(_route(request), 500, {})
+        raise
+    timer.finish(_route(request), response.status_code, response.headers)
+    return response
+
+
+def _route(request):
+    # The route template ("/sections/{section_id}") keeps label cardinality bounded
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
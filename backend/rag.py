@@ -1,23 +1,27 @@
+import hashlib
 import json
 import numpy as np
 import os
-import re
-from sentence_transformers import SentenceTransformer
-
-# Load Model (Offline)
-print("Loading compliance mapping model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from embedding_cache import load_or_encode
+from encoder import get_encoder, encoder_name
+from clause_index import ClauseIndex
+from vector_index import chroma_client, create_index
+from ranking import top_k_columns
+from rerank import rerank_scores
+import cache
+import config
+import crosswalk
+import lexical
+import metrics
+import scoring
+import section_store
+import segmenter
+import snapshots
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_PATH = os.path.abspath(os.path.join(BASE_DIR, "..", "data", "processed", "sections.json"))
 
-with open(DATA_PATH, encoding="utf-8") as f:
-    dpdp_data = json.load(f)
-
-documents = []
-metadata = []
-
 def extract_all_text(content):
     text = ""
     if not isinstance(content, dict): return text
@@ -29,62 +33,511 @@ def extract_all_text(content):
                 text += f"({sub_key}) " + extract_all_text(sub_val)
     return text.strip()
 
-# Indexing
-print("Analyzing legal sections...")
-for ch in dpdp_data.get("chapters", []):
-    chapter_info = f"Chapter {ch.get('chapter_number')}: {ch.get('chapter_title')}"
-    for sec in ch.get("sections", []):
-        sec_num = sec.get('section_number', 'Unknown')
-        sec_title = sec.get('section_title', 'Unknown')
-        full_content = extract_all_text(sec.get("content", {}))
-        
-        doc_text = f"Section {sec_num}. {sec_title}. {full_content}"
-        documents.append(doc_text)
-        metadata.append({
-            "section_number": sec_num,
-            "section_title": sec_title,
-            "chapter": chapter_info,
-            "description": full_content
+class Corpus:
+    """The DPDP sections parsed from sections.json (only needed to compile the section store)."""
+
+    def __init__(self, data_path=DATA_PATH):
+        with open(data_path, encoding="utf-8") as f:
+            self.dpdp_data = json.load(f)
+
+        self.documents = []
+        self.metadata = []
+        self.sections = []
+
+        print("Analyzing legal sections...")
+        for ch in self.dpdp_data.get("chapters", []):
+            chapter_info = f"Chapter {ch.get('chapter_number')}: {ch.get('chapter_title')}"
+            for sec in ch.get("sections", []):
+                sec_num = sec.get('section_number', 'Unknown')
+                sec_title = sec.get('section_title', 'Unknown')
+                full_content = extract_all_text(sec.get("content", {}))
+
+                doc_text = f"Section {sec_num}. {sec_title}. {full_content}"
+                self.documents.append(doc_text)
+                self.metadata.append({
+                    "section_number": sec_num,
+                    "section_title": sec_title,
+                    "chapter": chapter_info,
+                    "description": full_content
+                })
+                self.sections.append((sec_num, sec_title, sec.get("content", {})))
+
+def _source_hash(snapshot):
+    if snapshot.manifest.get("source_hash"):
+        return snapshot.manifest["source_hash"]
+    with open(snapshot.sections_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _store_path(snapshot, model_name):
+    return snapshot.store_path or section_store.store_path(model_name)
+
+def _open_section_store(snapshot):
+    model_name = encoder_name()
+    store = section_store.open_store(_store_path(snapshot, model_name), source_hash.get(), model_name)
+    if store is None and snapshot.immutable:
+        # Snapshots are never written to after they are created
+        raise ValueError(
+            f"Index snapshot {snapshot.version} has no section store for {model_name} "
+            f"(built with {snapshot.manifest.get('model')})"
+        )
+    if store is None:
+        raise LookupError("Section store not compiled yet; it is built when the model loads")
+    return store
+
+class MappingIndex:
+    """Encoder plus section and clause indexes, served from the compiled section store."""
+
+    def __init__(self, snapshot):
+        # Load Model (Offline)
+        print("Loading compliance mapping model...")
+        self.encoder = get_encoder()
+        # Backend-specific name, so cached vectors never mix encoders
+        self.model_name = self.encoder.name
+
+        try:
+            store = section_store_resource.get()
+        except LookupError:
+            compile_section_store(self.encoder, _store_path(snapshot, self.model_name))
+            store = section_store_resource.get()
+        self.store = store
+
+        # Rows are already normalized (cosine similarity == dot product) and
+        # memory-mapped from the store, so workers share the same pages
+        self.section_embeddings = store.section_embeddings
+        # Light per-section metadata; full texts are decoded from the store on demand
+        self.metadata = [store.section(row) for row in range(len(store.section_texts))]
+
+        # Section-level retrieval goes through the configured VectorIndex backend
+        self.section_index = create_index(
+            config.INDEX_BACKEND,
+            collection=_open_section_collection(snapshot) if config.INDEX_BACKEND == "chroma" else None
+        ).build(
+            [f"section-{i}" for i in range(len(self.metadata))],
+            self.section_embeddings, self.metadata, store.section_texts
+        )
+
+        # Clause-level leaves (subsections, clauses, provisos...) for precise mapping
+        self.clause_index = ClauseIndex.from_arrays(
+            [store.clause_path(row) for row in range(len(store.clause_texts))],
+            store.clause_texts, store.clause_sections(), store.clause_embeddings
+        )
+        print(f"Indexed {len(self.metadata)} sections, {len(self.clause_index)} clauses.")
+
+def compile_section_store(encoder, path):
+    """
+    Encode the current generation's sections.json (through the embedding
+    cache) and write its section store to ``path``; returns its counts.
+    """
+    docs = corpus.get()
+    print(f"Compiling section store for {len(docs.documents)} sections...")
+    section_embeddings = load_or_encode(encoder.name, docs.documents, encoder.encode)
+    clause_index = ClauseIndex(
+        docs.sections,
+        lambda leaf_docs: load_or_encode(encoder.name, leaf_docs, encoder.encode, name="clauses")
+    )
+    section_store.build_store(
+        path, source_hash.get(), encoder.name,
+        [{
+            "number": m["section_number"],
+            "title": m["section_title"],
+            "chapter": m["chapter"],
+            "text": m["description"],
+        } for m in docs.metadata],
+        section_embeddings,
+        list(zip(clause_index.paths, clause_index.texts, clause_index.leaf_section.tolist())),
+        clause_index.embeddings,
+    )
+    return {"sections": len(docs.documents), "clauses": len(clause_index), "dim": int(section_embeddings.shape[1])}
+
+def _open_section_collection(snapshot):
+    # One collection per snapshot in the shared store, so a snapshot directory is never written to
+    name = f"dpdp_sections-{snapshot.version}" if snapshot.immutable else "dpdp_sections"
+    return chroma_client().get_or_create_collection(name=name)
+
+def _chunk_sections():
+    """Section row of every lexical chunk (-1 for a chunk whose section is not indexed)."""
+    rows = {}
+    for row, m in enumerate(mapping_index.get().metadata):
+        rows.setdefault(m["section_number"], row)
+    return np.array([rows.get(m["section_id"], -1) for m in lexical.chunk_index.get().metadatas], dtype=np.int64)
+
+# Nothing is loaded at import time; see warm_up() and readiness(). Each
+# index snapshot gets its own copy of these (see snapshots.py)
+corpus = snapshots.resource("corpus", lambda snapshot: Corpus(snapshot.sections_path))
+source_hash = snapshots.resource("source_hash", _source_hash)
+section_store_resource = snapshots.resource("section_store", _open_section_store)
+mapping_index = snapshots.resource("mapping_index", MappingIndex)
+chunk_sections = snapshots.resource("chunk_sections", lambda snapshot: _chunk_sections())
+
+# Module attributes kept for callers that predate lazy loading (rag.documents, rag.encoder...)
+_CORPUS_ATTRS = {"dpdp_data", "documents", "metadata", "sections"}
+_INDEX_ATTRS = {"encoder", "section_embeddings", "section_index", "clause_index"}
+
+def __getattr__(name):
+    if name in _CORPUS_ATTRS:
+        return getattr(corpus.get(), name)
+    if name in _INDEX_ATTRS:
+        return getattr(mapping_index.get(), name)
+    if name == "MODEL_NAME":
+        return mapping_index.get().model_name
+    if name == "index_version":
+        return get_index_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_index_version():
+    """
+    Identifies the index snapshot serving this request (the sections.json
+    hash without snapshots); cached mapping results are keyed on it.
+    """
+    return snapshots.version()
+
+def get_section(section_id, include_text=True):
+    """A section ("8") or clause ("8(5)(b)") record from the section store, or None."""
+    return section_store_resource.get().get(section_id, include_text=include_text)
+
+def section_outline():
+    """Every section with its title, chapter and clause ids, without texts."""
+    return section_store_resource.get().outline()
+
+def warm_up(background=False):
+    """
+    Load the model and build the indexes now (in a daemon thread when
+    ``background``), and follow index snapshot switches from then on.
+    """
+    snapshots.watch()
+    mapping_index.warm(background=background)
+    if config.LEXICAL_WEIGHT > 0:
+        lexical.chunk_index.warm(background=background)
+
+def readiness():
+    """Load state for /readyz: whether the model is loaded, index size, embedding dimension."""
+    status = {
+        "ready": mapping_index.loaded,
+        "model_loaded": mapping_index.loaded,
+        "loading": mapping_index.loading,
+    }
+    if mapping_index.loaded:
+        idx = mapping_index.get()
+        status.update({
+            "model": idx.model_name,
+            "index_backend": config.INDEX_BACKEND,
+            "index_size": len(idx.section_index),
+            "clauses": len(idx.clause_index),
+            "embedding_dim": idx.section_index.dim,
+            "index_version": get_index_version(),
+            "crosswalk_version": crosswalk.version(),
         })
+    if mapping_index.error is not None:
+        status["error"] = str(mapping_index.error)
+    return status
+
+def split_findings(raw_input):
+    """Split raw input into candidate findings (see segmenter.segment)."""
+    with metrics.stage("segment"):
+        findings = segmenter.segment(raw_input)
+    metrics.FINDINGS_PER_DOCUMENT.observe(len(findings))
+    return findings
+
+def encode_findings(findings):
+    """Encode findings into normalized query embeddings (repeat sentences hit the cache)."""
+    idx = mapping_index.get()
+    with metrics.stage("encode"):
+        return cache.cached_encode(idx.model_name, findings, idx.encoder.encode)
 
-# Create Vector Index (Numpy version)
-print(f"Indexing {len(documents)} sections...")
-section_embeddings = model.encode(documents, convert_to_numpy=True)
-# Normalize for Cosine Similarity
-section_embeddings = section_embeddings / np.linalg.norm(section_embeddings, axis=1, keepdims=True)
+def results_cache_key(raw_input, threshold=0.3, top_k=1, granularity="section", aggregation="max",
+                      lexical_weight=None, fusion=None, rerank=False, rerank_budget_ms=None):
+    return ("query_dpdp", get_index_version(), crosswalk.version(), raw_input, threshold, top_k, granularity,
+            aggregation, lexical.fusion_options(lexical_weight, fusion), bool(rerank),
+            rerank_budget_ms if rerank else None)
 
-def query_dpdp(raw_input, threshold=0.3):
+def _resolve_ref(store, ref):
+    """Store record for a cited id, falling back to its ancestors ("8(5)(z)" -> "8(5)" -> "8")."""
+    for candidate in lexical.ref_candidates(ref):
+        for key in dict.fromkeys((candidate, candidate.lower())):
+            if store.find(key) >= 0:
+                return store.get(key)
+    return None
+
+def resolve_references(findings, top_k=1):
     """
-    Splits input into granular findings and maps each to a DPDP section using Numpy Cosine Similarity.
+    Map findings that cite a section ("Sec 9", "s. 8(5)") directly from the
+    section store, and findings tagged with a known security control
+    ("CWE-311", "A02:2021") from the crosswalk, with no embedding. Returns
+    ``(results, pending)``: result dicts for those findings and the indexes
+    of the findings that still need to be encoded. Pass both to
+    map_findings as ``references``.
     """
-    sentences = re.split(r'[\.\!\?\n]+', raw_input)
-    candidate_findings = [s.strip() for s in sentences if len(s.strip()) > 10]
-    
-    if not candidate_findings:
-        return []
+    results, pending = [], list(range(len(findings)))
+    if config.SECTION_REFERENCES:
+        with metrics.stage("references"):
+            results, pending = _resolve_references(mapping_index.get().store, findings, top_k)
+        metrics.FINDINGS.inc(len(findings) - len(pending), path="reference")
+    if config.CROSSWALK and pending:
+        with metrics.stage("crosswalk"):
+            tagged, still_pending = crosswalk.resolve(findings, pending, top_k)
+        metrics.FINDINGS.inc(len(pending) - len(still_pending), path="crosswalk")
+        results, pending = results + tagged, still_pending
+    return results, pending
 
-    # Encode and Normalize query embeddings
-    query_embs = model.encode(candidate_findings, convert_to_numpy=True)
-    query_embs = query_embs / np.linalg.norm(query_embs, axis=1, keepdims=True)
-    
-    # Compute Cosine Similarities (Dot product of normalized vectors)
-    similarities = np.dot(query_embs, section_embeddings.T)
-    
+def _resolve_references(store, findings, top_k):
     results = []
-    for i, finding in enumerate(candidate_findings):
-        # Get highest similarity score and its index
-        best_match_idx = np.argmax(similarities[i])
-        score = similarities[i][best_match_idx]
-        
-        # In Cosine Similarity, higher is better (0 to 1)
-        if score > threshold:
-            match = metadata[best_match_idx]
-            results.append({
+    pending = []
+    for i, finding in enumerate(findings):
+        records = []
+        for ref in lexical.find_section_refs(finding):
+            record = _resolve_ref(store, ref)
+            if record is not None and all(r["section"] != record["section"] for r in records):
+                records.append(record)
+        if not records:
+            pending.append(i)
+            continue
+        for rank, record in enumerate(records[:top_k], start=1):
+            # Sections are the first entries of the store, so their entry index is their row
+            sec = store.find(record["section"])
+            result = {
                 "finding": finding,
+                "finding_index": i,
+                "section_number": record["section"],
+                "section_title": record["title"],
+                "chapter": record["chapter"],
+                "description": store.section_texts[sec],
+                "score": 1.0,
+                "rank": rank,
+                "match": "reference"
+            }
+            if record["kind"] == "clause":
+                result["clause"] = record["id"]
+                result["clause_text"] = record["text"]
+            results.append(result)
+    return results, pending
+
+def _lexical_section_scores(findings, n_sections):
+    """BM25 of each finding against every section: the best score among the section's chunks."""
+    bm25 = lexical.chunk_index.get()
+    owners = chunk_sections.get()
+    indexed = owners >= 0
+    scores = np.zeros((len(findings), n_sections), dtype=np.float32)
+    for i, finding in enumerate(findings):
+        np.maximum.at(scores[i], owners[indexed], bm25.scores(finding)[indexed])
+    return scores
+
+def _rank_sections(idx, findings, query_embs, top_k, granularity, aggregation, weight, method):
+    """
+    Top sections per finding as ``(rows, cosine scores, leaf rows or None, fused scores or None)``.
+    Dense only when ``weight`` is 0; otherwise the dense candidates are fused with BM25.
+    """
+    if weight <= 0:
+        if granularity == "clause":
+            return (*idx.clause_index.search(query_embs, idx.section_index, top_k=top_k, aggregation=aggregation), None)
+        return (*idx.section_index.search(query_embs, top_k), None, None)
+
+    n, n_sections = len(findings), len(idx.metadata)
+    n_cand = min(max(top_k, config.HYBRID_CANDIDATES), n_sections)
+    if granularity == "clause":
+        rows, scores, leaves = idx.clause_index.search(query_embs, idx.section_index, top_k=n_cand, aggregation=aggregation)
+    else:
+        (rows, scores), leaves = idx.section_index.search(query_embs, n_cand), None
+
+    semantic = np.full((n, n_sections), -np.inf, dtype=np.float32)
+    best_leaf = np.full((n, n_sections), -1, dtype=np.int64)
+    found, col = np.nonzero(rows >= 0)
+    semantic[found, rows[found, col]] = scores[found, col]
+    if leaves is not None:
+        best_leaf[found, rows[found, col]] = leaves[found, col]
+
+    lexical_scores = _lexical_section_scores(findings, n_sections)
+    # Sections found only lexically still report their true (section-level) cosine
+    fill_rows, fill_cols = np.nonzero(np.isneginf(semantic) & (lexical_scores > 0))
+    if fill_rows.size:
+        semantic[fill_rows, fill_cols] = np.einsum(
+            "ij,ij->i", query_embs[fill_rows], idx.section_embeddings[fill_cols]
+        )
+
+    fused = lexical.fuse(semantic, lexical_scores, weight, method, config.RRF_K)
+    top_idx, top_fused = top_k_columns(fused, top_k)
+    leaf_idx = np.take_along_axis(best_leaf, top_idx, axis=1) if granularity == "clause" else None
+    return top_idx, np.take_along_axis(semantic, top_idx, axis=1), leaf_idx, top_fused
+
+def _rerank(idx, queries, top_idx, top_scores, leaf_idx, budget_ms):
+    """
+    Cross-encoder pass over every finding's candidates (see rerank.py).
+    Returns ``(order, probs)``: the column order, best first, and the
+    calibrated probabilities, NaN where a finding was not reranked (budget
+    spent or no model); those findings keep their bi-encoder order.
+    """
+    columns, candidates = [], []
+    for i in range(len(queries)):
+        # Padding and sections found by neither ranking are not candidates
+        cols = np.nonzero((top_idx[i] >= 0) & np.isfinite(top_scores[i]))[0].tolist()
+        texts = []
+        for col in cols:
+            sec = int(top_idx[i, col])
+            leaf = int(leaf_idx[i, col]) if leaf_idx is not None else -1
+            text = idx.clause_index.texts[leaf] if leaf >= 0 else idx.store.section_texts[sec]
+            texts.append(f"{idx.metadata[sec]['section_title']}. {text}")
+        columns.append(cols)
+        candidates.append(texts)
+
+    probs = np.full(top_idx.shape, np.nan, dtype=np.float32)
+    for i, (cols, scores) in enumerate(zip(columns, rerank_scores(queries, candidates, budget_ms))):
+        if scores is not None:
+            probs[i, cols] = scores
+    reranked = ~np.isnan(probs).all(axis=1, keepdims=True)
+    # Stable sort: unscored columns of a reranked finding go last, other findings keep their order
+    key = np.where(reranked, np.where(np.isnan(probs), np.inf, -probs), 0.0)
+    return np.argsort(key, axis=1, kind="stable"), probs
+
+def map_findings(findings, query_embs, threshold=0.3, top_k=1, granularity="section", aggregation="max",
+                 lexical_weight=None, fusion=None, references=None, rerank=False, rerank_budget_ms=None):
+    """
+    Maps each finding to its top_k DPDP sections given normalized embeddings.
+    The whole similarity matrix is ranked in one vectorized pass.
+
+    With granularity="clause" findings are scored against individual clauses
+    (two-stage: section prune, then clause rerank), section scores are the
+    max/mean of their clause scores, and the best clause path is returned.
+
+    With a lexical_weight above 0 the dense ranking is fused with BM25 over
+    the same chunks (see lexical.py); "score" stays the cosine similarity
+    the threshold applies to, "rank" follows the fused order.
+
+    ``references`` is the ``(results, pending)`` pair from
+    resolve_references(); ``query_embs`` then holds only the pending
+    findings' rows and the cited findings' results are merged in.
+
+    With ``rerank`` the top DPDP_RERANK_CANDIDATES candidates are reordered
+    by a cross-encoder within ``rerank_budget_ms`` (see rerank.py); reranked
+    results carry "rerank_score", a calibrated probability that replaces
+    the cosine threshold.
+    """
+    idx = mapping_index.get()
+    weight, method = lexical.fusion_options(lexical_weight, fusion)
+    cited, pending = references if references is not None else ([], range(len(findings)))
+    pending = list(pending)
+    queries = [findings[i] for i in pending]
+
+    results = []
+    if queries:
+        metrics.FINDINGS.inc(len(queries), path="encoded")
+        # Reranking reorders a longer candidate list than it returns
+        n_cand = max(top_k, config.RERANK_CANDIDATES) if rerank else top_k
+        with metrics.stage("search"):
+            top_idx, top_scores, leaf_idx, fused = _rank_sections(
+                idx, queries, query_embs, n_cand, granularity, aggregation, weight, method
+            )
+
+        probs = None
+        if rerank:
+            order, probs = _rerank(idx, queries, top_idx, top_scores, leaf_idx, rerank_budget_ms)
+            top_idx, top_scores, probs = (np.take_along_axis(a, order, axis=1)[:, :top_k] for a in (top_idx, top_scores, probs))
+            if leaf_idx is not None:
+                leaf_idx = np.take_along_axis(leaf_idx, order, axis=1)[:, :top_k]
+            if fused is not None:
+                fused = np.take_along_axis(fused, order, axis=1)[:, :top_k]
+
+        # In Cosine Similarity, higher is better (0 to 1); reranked findings use the calibrated probability
+        passed = top_scores > threshold
+        if probs is not None:
+            passed = np.where(np.isnan(probs), passed, probs >= config.RERANK_MIN_SCORE)
+        metrics.THRESHOLD_REJECTIONS.inc(int((np.isfinite(top_scores) & ~passed).sum()))
+        finding_rows, ranks = np.nonzero(passed)
+        section_rows = top_idx[finding_rows, ranks]
+        scores = top_scores[finding_rows, ranks]
+        leaves = leaf_idx[finding_rows, ranks].tolist() if leaf_idx is not None else [None] * len(scores)
+        fused_scores = fused[finding_rows, ranks].tolist() if fused is not None else [None] * len(scores)
+        rerank_probs = probs[finding_rows, ranks].tolist() if probs is not None else [float("nan")] * len(scores)
+
+        for i, rank, sec, score, leaf, fused_score, prob in zip(
+            finding_rows.tolist(), ranks.tolist(), section_rows.tolist(), scores.tolist(), leaves, fused_scores,
+            rerank_probs
+        ):
+            match = idx.metadata[sec]
+            result = {
+                "finding": queries[i],
+                "finding_index": pending[i],
                 "section_number": match["section_number"],
                 "section_title": match["section_title"],
                 "chapter": match["chapter"],
-                "description": match["description"]
-            })
-            
+                "description": idx.store.section_texts[sec],
+                "score": round(score, 4),
+                "rank": rank + 1
+            }
+            if fused_score is not None:
+                result["match"] = "hybrid"
+                result["fused_score"] = round(fused_score, 6)
+            if not np.isnan(prob):
+                result["match"] = "reranked"
+                result["rerank_score"] = round(prob, 4)
+            if leaf is not None and leaf >= 0:
+                result["clause"] = idx.clause_index.paths[leaf]
+                result["clause_text"] = idx.clause_index.texts[leaf]
+            results.append(result)
+
+    if cited:
+        results = sorted(cited + results, key=lambda r: (r["finding_index"], r["rank"]))
     return results
+
+def query_dpdp(raw_input, threshold=0.3, top_k=1, granularity="section", aggregation="max",
+               lexical_weight=None, fusion=None, rerank=False, rerank_budget_ms=None):
+    """
+    Splits input into granular findings and maps each to its top_k DPDP sections using Numpy Cosine Similarity.
+    Findings that cite a section are looked up directly; lexical_weight/fusion tune the hybrid ranking and
+    rerank adds the cross-encoder stage.
+    """
+    key = results_cache_key(
+        raw_input, threshold, top_k, granularity, aggregation, lexical_weight, fusion, rerank, rerank_budget_ms
+    )
+    cached = cache.query_results.get(key)
+    if cached is not cache.MISSING:
+        return list(cached)
+
+    candidate_findings = split_findings(raw_input)
+    
+    if not candidate_findings:
+        return []
+
+    # Repeated and near-duplicate findings are mapped once
+    unique, occurrences = segmenter.dedupe(candidate_findings)
+    references = resolve_references(unique, top_k)
+    pending = [unique[i] for i in references[1]]
+    # Encode and Normalize query embeddings (only for findings without a citation)
+    query_embs = encode_findings(pending) if pending else None
+    results = map_findings(
+        unique, query_embs, threshold, top_k, granularity, aggregation, lexical_weight, fusion, references,
+        rerank, rerank_budget_ms
+    )
+    results = segmenter.expand(results, candidate_findings, occurrences)
+    cache.query_results.put(key, results)
+    return results
+
+def format_results(mappings, include_text=True):
+    """
+    Standardized API response format (No AI branding), shared by the Flask and FastAPI apps.
+    With include_text=False only ids are returned; clients fetch /sections/{id} on demand.
+    Every row carries its risk, maximum penalty and rationale (see scoring.py).
+    """
+    with metrics.stage("format"):
+        return [scoring.annotate(_format_row(m, include_text), m) for m in mappings]
+
+def _format_row(m, include_text):
+    row = {
+        "finding": m["finding"],
+        "section": m["section_number"],
+        "title": m["section_title"],
+        "chapter": m["chapter"]
+    }
+    if include_text:
+        row["description"] = m["description"]
+    row["score"] = m["score"]
+    row["rank"] = m["rank"]
+    if "match" in m:
+        row["match"] = m["match"]
+    if "rerank_score" in m:
+        row["rerank_score"] = m["rerank_score"]
+    if "control" in m:
+        row["control"] = m["control"]
+    if "clause" in m:
+        row["clause"] = m["clause"]
+        if include_text:
+            row["clause_text"] = m["clause_text"]
+    return row
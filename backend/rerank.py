@@ -0,0 +1,210 @@
+"""
+Optional cross-encoder reranking of the bi-encoder candidates.
+
+The bi-encoder embeds a finding and a section separately, so its cosine is
+a coarse relevance signal and the 0.3 threshold on it a guess. A
+cross-encoder reads the finding and the candidate together. ``score``
+rates the top DPDP_RERANK_CANDIDATES candidates of every finding in a
+request, with the (finding, candidate) pairs of all findings batched into
+shared model calls, and returns calibrated probabilities of relevance.
+Callers keep candidates scoring at least DPDP_RERANK_MIN_SCORE instead of
+applying the cosine threshold.
+
+Calibration is Platt scaling of the model's logits, fitted on
+data/eval/gold_mappings.json with ``python rerank.py --calibrate`` and
+stored next to the model as calibration.json (identity until fitted).
+
+Each call has a latency budget. Findings are scored in order, a batch at a
+time, and a batch that would overrun the budget is not started; the
+findings left over keep their bi-encoder order and threshold (``None`` in
+the returned list). The model is read from DPDP_RERANK_MODEL_DIR and never
+downloaded; when it is missing every finding falls back the same way.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import config
+import metrics
+from lazy import LazyResource
+
+CALIBRATION_FILE = "calibration.json"
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def fit_platt(logits, labels, iterations=100):
+    """
+    Platt scaling: ``(a, b)`` such that ``sigmoid(a * logit + b)`` is the
+    probability that the label is 1. Newton's method with backtracking on
+    the log loss and Platt's smoothed targets (Lin, Lin and Weng's version,
+    which stays finite on separable or degenerate data).
+    """
+    logits = np.asarray(logits, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+    n_pos, n_neg = int(labels.sum()), int((~labels).sum())
+    targets = np.where(labels, (n_pos + 1.0) / (n_pos + 2.0), 1.0 / (n_neg + 2.0))
+
+    def loss(a, b):
+        z = a * logits + b
+        # log(1 + e^z) - t * z, computed without overflow
+        return float((np.logaddexp(0.0, z) - targets * z).sum())
+
+    a, b = 1.0, 0.0
+    current = loss(a, b)
+    for _ in range(iterations):
+        p = sigmoid(a * logits + b)
+        w = p * (1.0 - p)
+        grad = np.array([((p - targets) * logits).sum(), (p - targets).sum()])
+        if np.abs(grad).max() < 1e-5:
+            break
+        # Small ridge keeps the Hessian invertible when the logits barely vary
+        hess = np.array([[(w * logits * logits).sum(), (w * logits).sum()],
+                         [(w * logits).sum(), w.sum()]]) + 1e-12 * np.eye(2)
+        step = np.linalg.solve(hess, grad)
+        size = 1.0
+        while size >= 1e-10:
+            na, nb = a - size * step[0], b - size * step[1]
+            new = loss(na, nb)
+            if new < current + 1e-4 * size * float(grad @ -step):
+                break
+            size /= 2.0
+        else:
+            break
+        a, b, current = na, nb, new
+    return float(a), float(b)
+
+
+class Reranker:
+    def __init__(self, model_dir):
+        from sentence_transformers import CrossEncoder
+
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError(
+                f"Cross-encoder not found at {model_dir}. Save one there, e.g. "
+                f"CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2').save('{model_dir}')"
+            )
+        self.model_dir = model_dir
+        self.model = CrossEncoder(model_dir, max_length=config.RERANK_MAX_LENGTH)
+        self.a, self.b = 1.0, 0.0
+        path = os.path.join(model_dir, CALIBRATION_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                calibration = json.load(f)
+            self.a, self.b = calibration["a"], calibration["b"]
+        # Seconds per pair, averaged over the calls so far; predicts whether the next batch fits the budget
+        self.pair_seconds = None
+        self._lock = threading.Lock()
+
+    def logits(self, pairs):
+        return np.asarray(
+            self.model.predict(pairs, batch_size=config.RERANK_BATCH_SIZE, show_progress_bar=False), dtype=np.float32
+        ).reshape(-1)
+
+    def score(self, queries, candidates, budget_s):
+        """
+        ``candidates[i]`` lists the candidate texts of ``queries[i]``. Returns
+        one array of probabilities per query, or None for the queries left
+        unscored when the budget ran out.
+        """
+        start = time.perf_counter()
+        out = [None] * len(queries)
+        i = 0
+        while i < len(queries):
+            # Whole findings per model call, so a finding is either reranked or not
+            j, pairs = i, []
+            while j < len(queries) and (not pairs or len(pairs) + len(candidates[j]) <= config.RERANK_BATCH_SIZE):
+                pairs.extend((queries[j], c) for c in candidates[j])
+                j += 1
+            elapsed = time.perf_counter() - start
+            estimate = self.pair_seconds * len(pairs) if self.pair_seconds is not None else 0.0
+            if elapsed + estimate > budget_s:
+                break
+            t = time.perf_counter()
+            probs = sigmoid(self.a * self.logits(pairs) + self.b) if pairs else np.zeros(0, dtype=np.float32)
+            per_pair = (time.perf_counter() - t) / max(len(pairs), 1)
+            with self._lock:
+                self.pair_seconds = per_pair if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * per_pair
+            offset = 0
+            for q in range(i, j):
+                out[q] = probs[offset:offset + len(candidates[q])]
+                offset += len(candidates[q])
+            i = j
+        return out
+
+
+def _load():
+    model = Reranker(config.RERANK_MODEL_DIR)
+    # One tiny call so the first request's budget starts from a measured cost per pair
+    model.score(["warm-up"], [["warm-up"]], float("inf"))
+    return model
+
+
+reranker = LazyResource("reranker", _load)
+
+
+def rerank_scores(queries, candidates, budget_ms=None):
+    """
+    Calibrated probabilities per query (see Reranker.score) within
+    ``budget_ms`` (default DPDP_RERANK_BUDGET_MS); all None when the model
+    cannot be loaded.
+    """
+    budget_ms = config.RERANK_BUDGET_MS if budget_ms is None else budget_ms
+    try:
+        model = reranker.get()
+    except (OSError, ImportError, ValueError) as e:
+        print(f"Warning: reranking unavailable, keeping bi-encoder order: {e}")
+        metrics.RERANK_FALLBACKS.inc(len(queries), reason="unavailable")
+        return [None] * len(queries)
+    with metrics.stage("rerank"):
+        scores = model.score(queries, candidates, budget_ms / 1000.0)
+    skipped = sum(s is None for s in scores)
+    if skipped:
+        metrics.RERANK_FALLBACKS.inc(skipped, reason="budget")
+    return scores
+
+
+def calibrate(gold_path, candidates=None):
+    """Fit Platt scaling on the gold findings' bi-encoder candidates and write calibration.json."""
+    import rag
+
+    with open(gold_path, encoding="utf-8") as f:
+        items = json.load(f)["items"]
+    candidates = candidates or config.RERANK_CANDIDATES
+    model = Reranker(config.RERANK_MODEL_DIR)
+    pairs, labels = [], []
+    for item in items:
+        for m in rag.query_dpdp(item["finding"], threshold=-1.0, top_k=candidates, lexical_weight=0):
+            pairs.append((item["finding"], f"{m['section_title']}. {m['description']}"))
+            labels.append(m["section_number"] in item["sections"])
+    logits = model.logits(pairs)
+    labels = np.asarray(labels)
+    a, b = fit_platt(logits, labels)
+
+    def brier(probs):
+        return round(float(((probs - labels) ** 2).mean()), 4)
+
+    path = os.path.join(config.RERANK_MODEL_DIR, CALIBRATION_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"a": a, "b": b, "pairs": len(pairs), "positives": int(labels.sum())}, f, indent=2)
+    print(f"Fitted on {len(pairs)} pairs ({int(labels.sum())} relevant): a={a:.4f}, b={b:.4f}")
+    print(f"Brier score: {brier(sigmoid(logits))} uncalibrated, {brier(sigmoid(a * logits + b))} calibrated")
+    print(f"Calibration written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-encoder reranker utilities")
+    parser.add_argument("--calibrate", action="store_true", help="Fit calibration.json on the gold set")
+    parser.add_argument("--gold", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       "..", "data", "eval", "gold_mappings.json"))
+    args = parser.parse_args()
+    if args.calibrate:
+        calibrate(args.gold)
+    else:
+        parser.print_help()
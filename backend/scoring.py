@@ -0,0 +1,238 @@
+"""
+Server-side compliance scoring of mapped findings.
+
+Every section and clause of the section store gets a precomputed risk row
+derived from the penalty Schedule of the Act (section 33(1)):
+
+    item  breach of                                   penalty up to
+    1     security safeguards, section 8(5)            Rs 250 crore
+    2     breach notification, section 8(6)            Rs 200 crore
+    3     obligations towards children, section 9      Rs 200 crore
+    4     Significant Data Fiduciary, section 10       Rs 150 crore
+    5     duties of the Data Principal, section 15     Rs 10,000
+    6     voluntary undertaking, section 32            as for the breach
+    7     any other provision                          Rs 50 crore
+
+A clause inherits its nearest scheduled ancestor ("8(5)(a)" -> item 1),
+and a section mapped without a clause carries its worst clause, since the
+finding may fall under it. Sections that impose no obligation on a Data
+Fiduciary (definitions, the Board, appeals...) are informational.
+
+Breaching a voluntary undertaking (item 6) is penalised as the breach it was
+given for. A finding mapped to section 32 takes the worst penalty of its
+other mappings; when it has none, the undertaking may concern any breach and
+is rated at the Schedule's maximum (Rs 250 crore).
+
+Scores are aggregated per section: several findings mapped to the same
+section count as one violation, so a report repeating one issue does not
+drive the score to zero. ``Tally`` accumulates mappings batch by batch for
+streamed uploads.
+"""
+import numpy as np
+
+import snapshots
+from lexical import ref_candidates
+
+CRORE = 10_000_000
+
+# (item, id, breach of, maximum penalty in rupees)
+SCHEDULE = [
+    (1, "8(5)", "the obligation to take reasonable security safeguards to prevent personal data breach", 250 * CRORE),
+    (2, "8(6)", "the obligation to notify the Board and affected Data Principals of a personal data breach", 200 * CRORE),
+    (3, "9", "the additional obligations in relation to children", 200 * CRORE),
+    (4, "10", "the additional obligations of a Significant Data Fiduciary", 150 * CRORE),
+    (5, "15", "the duties of a Data Principal", 10_000),
+    # Penalty as for the breach the undertaking concerns; see Tally
+    (6, "32", "a voluntary undertaking accepted by the Board", None),
+]
+UNDERTAKING_SECTION = "32"
+UNDERTAKING_FALLBACK = max(penalty for *_, penalty in SCHEDULE if penalty is not None)
+OTHER_ITEM = 7
+OTHER_PENALTY = 50 * CRORE
+
+# Sections whose breach falls under item 7: grounds, notice, consent,
+# legitimate uses, general obligations, Data Principal rights, transfers abroad
+OBLIGATION_SECTIONS = frozenset(str(n) for n in [4, 5, 6, 7, 8, 11, 12, 13, 14, 16])
+
+RISK_LEVELS = ["Informational", "Low", "Medium", "High", "Critical"]
+# Points deducted from 100 once per violated section
+RISK_DEDUCTION = np.array([0, 2, 6, 12, 18])
+
+
+def risk_level(penalty):
+    if penalty is None:
+        return 0
+    if penalty >= 200 * CRORE:
+        return 4
+    if penalty >= 100 * CRORE:
+        return 3
+    if penalty >= CRORE:
+        return 2
+    return 1
+
+
+def format_inr(amount):
+    if amount >= CRORE:
+        return f"Rs {amount // CRORE} crore"
+    return f"Rs {amount:,}"
+
+
+class RiskTable:
+    """Risk row per section and clause id, built once from the section store outline."""
+
+    def __init__(self, outline):
+        self.rows = {}
+        scheduled = {
+            ref: (item, breach, UNDERTAKING_FALLBACK if penalty is None else penalty)
+            for item, ref, breach, penalty in SCHEDULE
+        }
+
+        for section in outline:
+            number = section["id"]
+            own = scheduled.get(number)
+            if own is None and number in OBLIGATION_SECTIONS:
+                own = (OTHER_ITEM, f"the obligations under section {number}", OTHER_PENALTY)
+            for clause in section["clauses"]:
+                entry = next((scheduled[c] for c in ref_candidates(clause) if c in scheduled), own)
+                self.rows[clause] = self._row(clause, section["title"], entry)
+
+            # Worst case over the section's own entry and its clauses
+            candidates = [own] + [scheduled[c] for c in scheduled if c != number and ref_candidates(c)[-1] == number]
+            candidates = [c for c in candidates if c is not None]
+            worst = max(candidates, key=lambda c: c[2]) if candidates else None
+            self.rows.setdefault(number, self._row(number, section["title"], worst, own))
+
+    def _row(self, ref, title, entry, own=None):
+        level = risk_level(entry[2] if entry else None)
+        if entry is None:
+            rationale = f"Section {ref} ({title}) imposes no direct obligation on a Data Fiduciary; listed for context."
+        elif ref_candidates(ref)[-1] == UNDERTAKING_SECTION:
+            rationale = (
+                f"Breach of {entry[1]} is item {entry[0]} of the Schedule (section 33(1)) and is "
+                f"penalised as the breach it concerns; with that breach unknown, up to {format_inr(entry[2])}."
+            )
+        elif own is not None and own is not entry:
+            rationale = (
+                f"Section {ref} includes {entry[1]}, item {entry[0]} of the Schedule (section 33(1)), "
+                f"with a penalty of up to {format_inr(entry[2])}; its other obligations fall under "
+                f"item {own[0]} (up to {format_inr(own[2])})."
+            )
+        else:
+            rationale = (
+                f"Breach of {entry[1]} is item {entry[0]} of the Schedule (section 33(1)); "
+                f"the penalty may extend to {format_inr(entry[2])}."
+            )
+        return {
+            "risk": RISK_LEVELS[level],
+            "level": level,
+            "max_penalty_inr": entry[2] if entry else None,
+            "schedule_item": entry[0] if entry else None,
+            "rationale": rationale,
+        }
+
+    def lookup(self, section, clause=None):
+        """Risk row of the most specific known id: the clause, its ancestors, then the section."""
+        for ref in (ref_candidates(clause) if clause else []) + [section]:
+            row = self.rows.get(ref)
+            if row is not None:
+                return row
+        return self._row(section, f"Section {section}", None)
+
+
+def _load():
+    import rag
+    return RiskTable(rag.section_outline())
+
+
+# Built from the section outline of each index snapshot
+risk_table = snapshots.resource("risk_table", lambda snapshot: _load())
+
+
+def annotate(row, mapping):
+    """Add risk, max_penalty_inr and rationale to a formatted result row."""
+    risk = risk_table.get().lookup(mapping["section_number"], mapping.get("clause"))
+    row["risk"] = risk["risk"]
+    row["max_penalty_inr"] = risk["max_penalty_inr"]
+    row["rationale"] = risk["rationale"]
+    return row
+
+
+class Tally:
+    """Per-section aggregation of mappings; add() batches as they are mapped."""
+
+    def __init__(self):
+        self.findings = set()
+        self.sections = {}
+        # Worst (penalty, breach) per finding outside section 32, and the
+        # findings mapped to section 32, for pricing broken undertakings
+        self.breaches = {}
+        self.undertakings = set()
+
+    def add(self, mappings, offset=0):
+        """``offset`` shifts finding_index so batches of one report do not collide."""
+        table = risk_table.get()
+        for m in mappings:
+            finding = offset + m["finding_index"]
+            self.findings.add(finding)
+            key = m["section_number"]
+            risk = table.lookup(key, m.get("clause"))
+            if key == UNDERTAKING_SECTION:
+                self.undertakings.add(finding)
+            elif risk["max_penalty_inr"] is not None:
+                worst = self.breaches.get(finding)
+                if worst is None or risk["max_penalty_inr"] > worst[0]:
+                    self.breaches[finding] = (risk["max_penalty_inr"], f"section {m.get('clause') or key}")
+            entry = self.sections.get(key)
+            if entry is None:
+                entry = self.sections[key] = {
+                    "section": key,
+                    "title": m["section_title"],
+                    "level": risk["level"],
+                    "max_penalty_inr": risk["max_penalty_inr"],
+                    "rationale": risk["rationale"],
+                    "findings": 0,
+                }
+            elif risk["level"] > entry["level"]:
+                # A clause-level mapping can raise the section's risk
+                entry.update(level=risk["level"], max_penalty_inr=risk["max_penalty_inr"], rationale=risk["rationale"])
+            entry["findings"] += 1
+        return self
+
+    def summary(self):
+        """Compliance score (100 minus one deduction per violated section), overall risk and per-section rows."""
+        self._price_undertakings()
+        sections = sorted(self.sections.values(), key=lambda e: (-e["level"], -e["findings"], e["section"]))
+        levels = np.array([e["level"] for e in sections], dtype=np.int64)
+        score = max(0, 100 - int(RISK_DEDUCTION[levels].sum())) if levels.size else 100
+        return {
+            "score": score,
+            "risk": RISK_LEVELS[int(levels.max())] if levels.size else None,
+            "findings": len(self.findings),
+            "violations": int((levels > 0).sum()),
+            "max_penalty_inr": max((e["max_penalty_inr"] or 0 for e in sections), default=0),
+            "sections": [
+                {**{k: v for k, v in e.items() if k != "level"}, "risk": RISK_LEVELS[e["level"]]}
+                for e in sections
+            ],
+        }
+
+
+    def _price_undertakings(self):
+        entry = self.sections.get(UNDERTAKING_SECTION)
+        breaches = [self.breaches[f] for f in self.undertakings if f in self.breaches]
+        if entry is None or not breaches:
+            return
+        penalty, breach = max(breaches)
+        entry.update(
+            level=risk_level(penalty),
+            max_penalty_inr=penalty,
+            rationale=(
+                f"Breach of a voluntary undertaking is item 6 of the Schedule (section 33(1)) and is "
+                f"penalised as the breach it concerns, here {breach}: up to {format_inr(penalty)}."
+            ),
+        )
+
+
+def score_mappings(mappings):
+    """Compliance summary of one report's mappings."""
+    return Tally().add(mappings).summary()
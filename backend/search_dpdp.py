@@ -1,47 +1,282 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+import json
 import os
+import numpy as np
+import cache
+import config
+import lexical
+import metrics
+import snapshots
+from embedding_cache import load_or_encode
+from encoder import get_encoder
+from rerank import rerank_scores
+from utils.chunker import extract_chunks, assign_chunk_ids
+from vector_index import ChromaIndex, chroma_client, create_index, matches_where
 
-VECTOR_DIR = "vector_store"
+VECTOR_DIR = config.VECTOR_DIR
 COLLECTION_NAME = "dpdp_act"
+DATA_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "processed", "sections.json"))
 
-# Load model once
-print("Loading search model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+def open_chunk_index(backend=None, snapshot=None):
+    """
+    Chunk-level index behind the VectorIndex interface: the Chroma collection
+    built by index_dpdp.py, or a local numpy/hnsw/faiss index over the same chunks.
+    ``snapshot`` (default: the current one) selects the collection and corpus.
+    """
+    backend = backend or config.SEARCH_INDEX_BACKEND
+    snapshot = snapshot or snapshots.current().snapshot
+    if backend == "chroma":
+        if snapshot.immutable and not os.path.isdir(snapshot.vector_dir):
+            print(f"Warning: index snapshot {snapshot.version} was created without a vector store.")
+            return None
+        client = chroma_client(snapshot.vector_dir)
+        try:
+            collection = client.get_collection(name=COLLECTION_NAME)
+        except Exception:
+            print(f"Warning: Collection '{COLLECTION_NAME}' not found. Run index_dpdp.py first.")
+            return None
+        built_with = (collection.metadata or {}).get("encoder")
+        if built_with and built_with != get_encoder().name:
+            # Its vectors would not be comparable with this encoder's queries
+            print(f"Warning: Collection '{COLLECTION_NAME}' was built with {built_with}. Run index_dpdp.py again.")
+            return None
+        return ChromaIndex(collection).open()
 
-# Initialize client
-client = chromadb.PersistentClient(path=VECTOR_DIR)
+    with open(snapshot.sections_path, encoding="utf-8") as f:
+        chunks = extract_chunks(json.load(f))
+    documents = [c["text"] for c in chunks]
+    encoder = get_encoder()
+    embeddings = load_or_encode(encoder.name, documents, encoder.encode, name="chunks")
+    metadatas = [{
+        "section_id": c["section_id"],
+        "title": c["title"],
+        "chapter": c["chapter"],
+        "clause_path": c["clause_path"]
+    } for c in chunks]
+    return create_index(backend).build(assign_chunk_ids(chunks), embeddings, metadatas, documents)
 
-try:
-    collection = client.get_collection(name=COLLECTION_NAME)
-except Exception:
-    print(f"Warning: Collection '{COLLECTION_NAME}' not found. Run index_dpdp.py first.")
-    collection = None
+def _load(snapshot):
+    # Load model once
+    print("Loading search model...")
+    get_encoder()
+    return open_chunk_index(snapshot=snapshot)
 
-def search(query, top_k=3):
-    if collection is None:
-        return []
-        
-    embedding = model.encode(query).tolist()
+# Built on first search or by warm_up(), once per index snapshot; importing this module loads nothing
+chunk_index_resource = snapshots.resource("chunk_index", _load)
 
-    results = collection.query(
-        query_embeddings=[embedding],
-        n_results=top_k
-    )
+def __getattr__(name):
+    # Attributes kept for callers that predate lazy loading
+    if name == "chunk_index":
+        return chunk_index_resource.get()
+    if name == "encoder":
+        return get_encoder()
+    if name == "MODEL_NAME":
+        return get_encoder().name
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+def warm_up(background=False):
+    """
+    Load the model and open the chunk index now (in a daemon thread when
+    ``background``), and follow index snapshot switches from then on.
+    """
+    snapshots.watch()
+    chunk_index_resource.warm(background=background)
+    if config.LEXICAL_WEIGHT > 0:
+        lexical.chunk_index.warm(background=background)
+
+def readiness():
+    """Load state for /readyz. Not ready when the Chroma collection has not been built."""
+    loaded = chunk_index_resource.loaded
+    chunk_index = chunk_index_resource.get() if loaded else None
+    status = {
+        "ready": chunk_index is not None,
+        "model_loaded": loaded,
+        "loading": chunk_index_resource.loading,
+    }
+    if chunk_index is not None:
+        status.update({
+            "model": get_encoder().name,
+            "index_backend": config.SEARCH_INDEX_BACKEND,
+            "index_size": len(chunk_index),
+            # A Chroma collection opened as-is does not record its dimension
+            "embedding_dim": chunk_index.dim or get_encoder().dim,
+        })
+    elif loaded:
+        status["error"] = f"Collection '{COLLECTION_NAME}' not found or built with another encoder. Run index_dpdp.py."
+    if chunk_index_resource.error is not None:
+        status["error"] = str(chunk_index_resource.error)
+    return status
+
+def _match(document, metadata, score, **extra):
+    return {
+        "text": document,
+        "section_id": metadata["section_id"],
+        "title": metadata["title"],
+        "chapter": metadata["chapter"],
+        "score": round(score, 4) if score is not None else None,
+        # Squared L2 between unit vectors, as Chroma reports it
+        "distance": round(2.0 - 2.0 * score, 4) if score is not None else None,
+        **extra
+    }
+
+def _allowed(bm25, where):
+    """Mask of the lexical index rows matching ``where`` (None when unfiltered)."""
+    if not where:
+        return None
+    return np.fromiter((matches_where(m, where) for m in bm25.metadatas), dtype=bool, count=len(bm25))
+
+def _reference_matches(refs, top_k, allowed=None):
+    """Chunks of the cited sections, read from the lexical index without embedding the query."""
+    bm25 = lexical.chunk_index.get()
     matches = []
-    if results["documents"]:
-        for i in range(len(results["documents"][0])):
-            matches.append({
-                "text": results["documents"][0][i],
-                "section_id": results["metadatas"][0][i]["section_id"],
-                "title": results["metadatas"][0][i]["title"],
-                "chapter": results["metadatas"][0][i]["chapter"],
-                "distance": results["distances"][0][i] if "distances" in results else None
-            })
+    for ref in refs:
+        section = lexical.ref_candidates(ref)[-1]
+        rows = [r for r, m in enumerate(bm25.metadatas)
+                if m["section_id"] == section and (allowed is None or allowed[r])]
+        # Chunks starting at the cited clause come first
+        rows.sort(key=lambda r: not bm25.metadatas[r]["clause_path"].startswith(ref))
+        matches.extend(_match(bm25.documents[r], bm25.metadatas[r], 1.0, match="reference") for r in rows)
+    return matches[:top_k]
 
+def _hybrid_matches(query, hits, top_k, weight, method, allowed=None):
+    """Fuse one query's dense ``hits`` with its BM25 ranking."""
+    bm25 = lexical.chunk_index.get()
+    dense = {r["id"]: r for r in hits}
+    with metrics.stage("lexical"):
+        lex_rows, lex_scores = bm25.search(query, max(top_k, config.HYBRID_CANDIDATES), allowed)
+    lexical_hits = {bm25.ids[row]: (row, score) for row, score in zip(lex_rows.tolist(), lex_scores.tolist())}
+
+    # Chunk ids are content hashes shared with the vector store, so the two rankings join on them
+    ids = list(dict.fromkeys([*dense, *lexical_hits]))
+    semantic = np.array([dense[i]["score"] if i in dense else -np.inf for i in ids], dtype=np.float32)
+    lexical_scores = np.array([lexical_hits[i][1] if i in lexical_hits else 0.0 for i in ids], dtype=np.float32)
+    fused = lexical.fuse(semantic[None, :], lexical_scores[None, :], weight, method, config.RRF_K)[0]
+
+    matches = []
+    for j in np.argsort(-fused, kind="stable")[:top_k].tolist():
+        if ids[j] in dense:
+            r = dense[ids[j]]
+            document, metadata, score = r["document"], r["metadata"], r["score"]
+        else:
+            # Found only lexically: no cosine was computed for it
+            row = lexical_hits[ids[j]][0]
+            document, metadata, score = bm25.documents[row], bm25.metadatas[row], None
+        matches.append(_match(document, metadata, score, match="hybrid", fused_score=round(float(fused[j]), 6)))
     return matches
 
+def _chapters(snapshot):
+    """Chapter label of the chunk metadata ("II: OBLIGATIONS OF DATA FIDUCIARY") by chapter number."""
+    with open(snapshot.sections_path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        str(ch.get("chapter_number")).upper(): f"{ch.get('chapter_number')}: {ch.get('chapter_title')}"
+        for ch in data.get("chapters", [])
+    }
+
+chapters = snapshots.resource("chapters", _chapters)
+
+def metadata_filter(chapter=None, section=None):
+    """
+    Chroma ``where`` filter restricting a search to a chapter (its number,
+    "II", or full label) and/or sections (an id or a list; "8(5)" means
+    section 8). None when neither is given; ValueError for an unknown chapter.
+    """
+    conditions = []
+    if chapter:
+        labels = chapters.get()
+        label = labels.get(chapter.strip().upper())
+        if label is None:
+            label = next((l for l in labels.values() if l.lower() == chapter.strip().lower()), None)
+        if label is None:
+            raise ValueError(f"Unknown chapter: {chapter}")
+        conditions.append({"chapter": label})
+    if section:
+        sections = [section] if isinstance(section, str) else list(section)
+        ids = list(dict.fromkeys(lexical.ref_candidates(s.strip())[-1] for s in sections if s.strip()))
+        if ids:
+            conditions.append({"section_id": ids[0]} if len(ids) == 1 else {"section_id": {"$in": ids}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def search_many(queries, top_k=3, where=None, lexical_weight=None, fusion=None, rerank=False, rerank_budget_ms=None):
+    """
+    Search several queries at once. Queries answered by the cache or by a
+    section citation skip the model; the rest are encoded in one batch and
+    sent to the index as one query (one Chroma round trip for all of them).
+    ``where`` (see metadata_filter) is applied inside the index query.
+    With ``rerank`` the top DPDP_RERANK_CANDIDATES chunks of every query are
+    reordered by the cross-encoder in one batched pass (see rerank.py).
+    Returns one list of matches per query, as search() does.
+    """
+    weight, method = lexical.fusion_options(lexical_weight, fusion)
+    chunk_index = chunk_index_resource.get()
+    if chunk_index is None:
+        return [[] for _ in queries]
+
+    where_key = json.dumps(where, sort_keys=True) if where else None
+    rerank_key = (True, rerank_budget_ms) if rerank else None
+    index_version = snapshots.version()
+    keys = [("search", index_version, query, top_k, weight, method, where_key, rerank_key) for query in queries]
+    # Only loads the lexical index when a filter has to be applied to it
+    allowed = _allowed(lexical.chunk_index.get(), where) if where and (weight > 0 or config.SECTION_REFERENCES) else None
+
+    results = [None] * len(queries)
+    pending = []
+    for i, (query, key) in enumerate(zip(queries, keys)):
+        cached = cache.query_results.get(key)
+        if cached is not cache.MISSING:
+            results[i] = list(cached)
+            continue
+        refs = lexical.find_section_refs(query) if config.SECTION_REFERENCES else []
+        if refs:
+            with metrics.stage("references"):
+                matches = _reference_matches(refs, top_k, allowed)
+            if matches:
+                results[i] = matches
+                cache.query_results.put(key, matches)
+                continue
+        pending.append(i)
+
+    if pending:
+        # Shares query embeddings with rag.py (same encoder)
+        encoder = get_encoder()
+        with metrics.stage("encode"):
+            embeddings = cache.cached_encode(encoder.name, [queries[i] for i in pending], encoder.encode)
+        # Reranking reorders a longer candidate list than it returns
+        n_keep = max(top_k, config.RERANK_CANDIDATES) if rerank else top_k
+        n_cand = n_keep if weight <= 0 else max(n_keep, config.HYBRID_CANDIDATES)
+        with metrics.stage("search"):
+            hits = chunk_index.query(embeddings, n_cand, where)
+        for i, query_hits in zip(pending, hits):
+            if weight <= 0:
+                results[i] = [_match(r["document"], r["metadata"], r["score"]) for r in query_hits]
+            else:
+                results[i] = _hybrid_matches(queries[i], query_hits, n_keep, weight, method, allowed)
+        if rerank:
+            scored = rerank_scores(
+                [queries[i] for i in pending],
+                [[f"{m['title']}. {m['text']}" for m in results[i]] for i in pending],
+                rerank_budget_ms
+            )
+            for i, probs in zip(pending, scored):
+                if probs is not None:
+                    results[i] = [
+                        {**results[i][j], "match": "reranked", "rerank_score": round(float(probs[j]), 4)}
+                        for j in np.argsort(-probs, kind="stable").tolist()
+                    ]
+        for i in pending:
+            results[i] = results[i][:top_k]
+            cache.query_results.put(keys[i], results[i])
+    return results
+
+def search(query, top_k=3, lexical_weight=None, fusion=None, where=None, rerank=False, rerank_budget_ms=None):
+    """
+    Hybrid search over the DPDP chunks: dense neighbours fused with BM25
+    (see lexical.py), or dense only with lexical_weight=0. A query citing a
+    section ("Sec 9", "s. 8(5)") returns that section's chunks directly.
+    """
+    return search_many([query], top_k, where, lexical_weight, fusion, rerank, rerank_budget_ms)[0]
+
 if __name__ == "__main__":
     # Test query
     test_query = "Notice for processing personal data of children"
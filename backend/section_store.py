@@ -0,0 +1,315 @@
+"""
+Compiled, memory-mapped store of the DPDP sections.
+
+One file packs what rag.py used to rebuild from ``sections.json`` on every
+start: the section and clause records, their texts and their embeddings.
+
+    magic (8) | header length (8) | JSON header | entries | hash table |
+    strings (UTF-8) | section embeddings | clause embeddings
+
+Entries are fixed-size records, one per section ("8") and per clause leaf
+("8(5)(b)", "9[proviso 1]"). The open-addressing hash table maps an id to
+its entry, so a lookup touches a few bytes instead of parsing anything.
+Texts are decoded only when asked for. The file is opened with mmap, so
+every worker shares the same pages. Rebuild it with ``build_store``
+whenever ``sections.json`` or the encoder changes; ``open_store`` rejects a
+stale file.
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from embedding_cache import CACHE_DIR
+
+MAGIC = b"DPDPSTR1"
+# Bump when the layout or the clause leaves (clause_index.iter_leaves) change
+STORE_VERSION = 1
+ALIGN = 64
+
+SECTION = 0
+CLAUSE = 1
+KINDS = {SECTION: "section", CLAUSE: "clause"}
+
+ENTRY = np.dtype([
+    ("hash", "<u8"),
+    ("key_off", "<u8"), ("key_len", "<u4"),
+    ("text_off", "<u8"), ("text_len", "<u4"),
+    ("title_off", "<u8"), ("title_len", "<u4"),
+    ("chapter_off", "<u8"), ("chapter_len", "<u4"),
+    ("kind", "<u1"),
+    # Row in the kind's embedding matrix, and the owning section's row
+    ("row", "<i4"), ("section_row", "<i4"),
+    # For sections: their clauses are rows [child_start, child_start + child_count)
+    ("child_start", "<i4"), ("child_count", "<i4"),
+])
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def store_path(model_name, cache_dir=CACHE_DIR):
+    safe_name = re.sub(r"[^\w.-]+", "_", f"{model_name}.store")
+    return os.path.join(cache_dir, f"{safe_name}.bin")
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def build_store(path, source_hash, model_name, sections, section_embeddings, clauses, clause_embeddings):
+    """
+    Write a store atomically.
+
+    ``sections`` is a list of dicts with ``number``, ``title``, ``chapter``
+    and ``text``, in embedding row order. ``clauses`` is a list of
+    ``(path, text, section_row)``, grouped contiguously by section row.
+    """
+    strings = bytearray()
+    interned = {}
+
+    def intern(s):
+        if s not in interned:
+            data = s.encode("utf-8")
+            interned[s] = (len(strings), len(data))
+            strings.extend(data)
+        return interned[s]
+
+    entries = np.zeros(len(sections) + len(clauses), dtype=ENTRY)
+    child_start = {}
+    for row, (_, _, sec_row) in enumerate(clauses):
+        child_start.setdefault(sec_row, row)
+
+    def fill(i, key, text, sec, kind, row, sec_row):
+        e = entries[i]
+        e["hash"] = key_hash(key)
+        e["key_off"], e["key_len"] = intern(key)
+        e["text_off"], e["text_len"] = intern(text)
+        e["title_off"], e["title_len"] = intern(sec["title"])
+        e["chapter_off"], e["chapter_len"] = intern(sec["chapter"])
+        e["kind"], e["row"], e["section_row"] = kind, row, sec_row
+
+    counts = np.bincount([c[2] for c in clauses], minlength=len(sections)) if clauses else np.zeros(len(sections), int)
+    for row, sec in enumerate(sections):
+        fill(row, sec["number"], sec["text"], sec, SECTION, row, row)
+        entries[row]["child_start"] = child_start.get(row, 0)
+        entries[row]["child_count"] = counts[row]
+    for row, (clause_path, text, sec_row) in enumerate(clauses):
+        fill(len(sections) + row, clause_path, text, sections[sec_row], CLAUSE, row, sec_row)
+
+    # Open addressing, linear probing; slots hold entry index + 1 (0 = empty)
+    table_size = 1 << max(3, (2 * len(entries) - 1).bit_length())
+    table = np.zeros(table_size, dtype="<u4")
+    seen = set()
+    for i, e in enumerate(entries):
+        key = bytes(strings[e["key_off"]:e["key_off"] + e["key_len"]])
+        if key in seen:
+            # The first record wins (e.g. a section and a leaf both named "4")
+            continue
+        seen.add(key)
+        slot = int(e["hash"]) & (table_size - 1)
+        while table[slot]:
+            slot = (slot + 1) & (table_size - 1)
+        table[slot] = i + 1
+
+    section_embeddings = np.ascontiguousarray(section_embeddings, dtype="<f4")
+    clause_embeddings = np.ascontiguousarray(clause_embeddings, dtype="<f4")
+    dim = int(section_embeddings.shape[1]) if section_embeddings.size else 0
+
+    # Offsets depend on the header length, which depends on the offsets;
+    # reserve a fixed-size header and pad the JSON into it
+    header_size = 4096
+    offsets = {}
+    pos = _align(16 + header_size)
+    for name, size in (
+        ("entries", entries.nbytes),
+        ("table", table.nbytes),
+        ("strings", len(strings)),
+        ("section_embeddings", section_embeddings.nbytes),
+        ("clause_embeddings", clause_embeddings.nbytes),
+    ):
+        offsets[name] = pos
+        pos = _align(pos + size)
+
+    header = json.dumps({
+        "version": STORE_VERSION,
+        "source_hash": source_hash,
+        "model": model_name,
+        "dim": dim,
+        "sections": len(sections),
+        "clauses": len(clauses),
+        "entries": len(entries),
+        "table_size": table_size,
+        "strings_size": len(strings),
+        "offsets": offsets,
+    }).encode("utf-8")
+    if len(header) > header_size:
+        raise ValueError("Section store header too large")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header.ljust(header_size, b" "))
+        for name, data in (
+            ("entries", entries.tobytes()),
+            ("table", table.tobytes()),
+            ("strings", bytes(strings)),
+            ("section_embeddings", section_embeddings.tobytes()),
+            ("clause_embeddings", clause_embeddings.tobytes()),
+        ):
+            f.seek(offsets[name])
+            f.write(data)
+        f.truncate(pos)
+    os.replace(tmp, path)
+
+
+class _Texts:
+    """Lazy sequence of one kind's texts, decoded on access."""
+
+    def __init__(self, store, entries):
+        self._store = store
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, row):
+        e = self._entries[row]
+        return self._store._string(e["text_off"], e["text_len"])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class SectionStore:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{path} is not a section store")
+        (header_len,) = struct.unpack("<Q", self._mm[8:16])
+        self.header = json.loads(self._mm[16:16 + header_len])
+
+        h = self.header
+        off = h["offsets"]
+        self.entries = np.frombuffer(self._mm, dtype=ENTRY, count=h["entries"], offset=off["entries"])
+        self.table = np.frombuffer(self._mm, dtype="<u4", count=h["table_size"], offset=off["table"])
+        self._strings = off["strings"]
+        self.section_embeddings = np.frombuffer(
+            self._mm, dtype="<f4", count=h["sections"] * h["dim"], offset=off["section_embeddings"]
+        ).reshape(h["sections"], h["dim"])
+        self.clause_embeddings = np.frombuffer(
+            self._mm, dtype="<f4", count=h["clauses"] * h["dim"], offset=off["clause_embeddings"]
+        ).reshape(h["clauses"], h["dim"])
+
+        self.section_entries = self.entries[:h["sections"]]
+        self.clause_entries = self.entries[h["sections"]:]
+        self.section_texts = _Texts(self, self.section_entries)
+        self.clause_texts = _Texts(self, self.clause_entries)
+
+    @property
+    def model(self):
+        return self.header["model"]
+
+    @property
+    def source_hash(self):
+        return self.header["source_hash"]
+
+    @property
+    def dim(self):
+        return self.header["dim"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def _string(self, off, length):
+        start = self._strings + int(off)
+        return self._mm[start:start + int(length)].decode("utf-8")
+
+    def find(self, key):
+        """Entry index for ``key`` (a section number or clause path), or -1."""
+        h = key_hash(key)
+        raw = key.encode("utf-8")
+        mask = len(self.table) - 1
+        slot = h & mask
+        while True:
+            i = int(self.table[slot])
+            if i == 0:
+                return -1
+            e = self.entries[i - 1]
+            start = self._strings + int(e["key_off"])
+            if int(e["hash"]) == h and self._mm[start:start + int(e["key_len"])] == raw:
+                return i - 1
+            slot = (slot + 1) & mask
+
+    def _record(self, e):
+        return {
+            "id": self._string(e["key_off"], e["key_len"]),
+            "kind": KINDS[int(e["kind"])],
+            "section": self._string(self.section_entries[e["section_row"]]["key_off"],
+                                    self.section_entries[e["section_row"]]["key_len"]),
+            "title": self._string(e["title_off"], e["title_len"]),
+            "chapter": self._string(e["chapter_off"], e["chapter_len"]),
+        }
+
+    def get(self, key, include_text=True):
+        """The record for a section or clause id, or None."""
+        i = self.find(key)
+        if i < 0:
+            return None
+        e = self.entries[i]
+        record = self._record(e)
+        if include_text:
+            record["text"] = self._string(e["text_off"], e["text_len"])
+        if int(e["kind"]) == SECTION:
+            start, count = int(e["child_start"]), int(e["child_count"])
+            record["clauses"] = [self.clause_path(r) for r in range(start, start + count)]
+        return record
+
+    def section(self, row):
+        """Metadata of a section by embedding row (no text)."""
+        e = self.section_entries[row]
+        return {
+            "section_number": self._string(e["key_off"], e["key_len"]),
+            "section_title": self._string(e["title_off"], e["title_len"]),
+            "chapter": self._string(e["chapter_off"], e["chapter_len"]),
+        }
+
+    def clause_path(self, row):
+        e = self.clause_entries[row]
+        return self._string(e["key_off"], e["key_len"])
+
+    def clause_sections(self):
+        return self.clause_entries["section_row"].astype(np.int64)
+
+    def outline(self):
+        """Every section as ``{id, title, chapter, clauses}`` (no texts)."""
+        return [self.get(self._string(e["key_off"], e["key_len"]), include_text=False)
+                for e in self.section_entries]
+
+
+def open_store(path, source_hash=None, model_name=None):
+    """Open ``path`` if it exists and matches ``source_hash`` and ``model_name``, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        store = SectionStore(path)
+    except (OSError, ValueError):
+        return None
+    h = store.header
+    if h.get("version") != STORE_VERSION:
+        return None
+    if source_hash is not None and h.get("source_hash") != source_hash:
+        return None
+    if model_name is not None and h.get("model") != model_name:
+        return None
+    return store
@@ -0,0 +1,245 @@
+"""
+Finding extraction: sentence segmentation and near-duplicate removal.
+
+Reports arrive as prose, bulleted lists, tables pasted from scanners, or
+PDF text wrapped at arbitrary columns. ``segment`` turns them into findings:
+
+- sentences end at ``.``, ``!`` or ``?`` followed by whitespace, except
+  after known abbreviations ("Sec. 8", "e.g.", "No. 4"), so decimals, IPs
+  and versions ("10.0.0.1", "TLS 1.2") are never cut;
+- a line opens a new finding when it starts with a bullet or numbering, or
+  when the previous line ended a sentence; wrapped lines starting in lower
+  case continue the current one;
+- table rows (``|``- or tab-separated) become one finding each, cells
+  joined with "; ", and markdown separator rows are dropped.
+
+Scanner exports repeat the same finding hundreds of times with only a host,
+port or id changed. ``Deduplicator`` collapses them before anything is
+encoded, in three steps of increasing cost:
+
+1. exact repeats, after case and whitespace normalization (a dict);
+2. repeats that differ only in numbers ("10.0.3.7" vs "10.0.9.12"), by
+   the same dict keyed on the text with digit runs masked;
+3. near-duplicates, by MinHash over character shingles of the masked
+   text, bucketed by LSH bands.
+
+Findings citing different sections ("Sec 8" vs "Sec 9") or tagged with
+different controls (CWE-311 vs CWE-79, A02:2021 vs A03:2021) never merge.
+Only one representative per group is encoded; ``expand`` copies its mappings
+back to every original occurrence.
+"""
+import hashlib
+import re
+from collections import defaultdict
+
+import numpy as np
+
+import config
+import metrics
+from crosswalk import find_control_ids
+from lexical import find_section_refs
+
+MIN_FINDING_CHARS = 11
+
+ABBREVIATIONS = frozenset("""
+    s ss sec secs cl cls art arts para paras r rr sch no nos sr
+    e.g i.e viz vs cf al approx
+    mr mrs ms dr st ltd pvt inc co corp govt dept fig ref vol pp p
+""".split())
+
+# "a)" but not "a." as a letter bullet, so a line may start with "s. 8(5) ..."
+BULLET = re.compile(r"^\s*(?:[-*+•▪◦‣–—]|\(?\d{1,3}[.)]|\(?[a-zA-Z]\)|\([ivxlcdm]{1,6}\))\s+")
+TABLE_SEPARATOR = re.compile(r"^[\s|:+-]+$")
+SENTENCE_END = re.compile(r"[.!?]+(?=\s|$)")
+LAST_TOKEN = re.compile(r"(\S+)$")
+ENDS_SENTENCE = re.compile(r"[.!?:;][\"')\]]*$")
+WHITESPACE = re.compile(r"\s+")
+DIGITS = re.compile(r"\d+")
+
+SHINGLE = 5
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs at Jaccard 0.85 share a bucket with probability > 0.99
+BANDS = 16
+# Universal hashing (a * h + b) mod p with p < 2**32 and shingle hashes
+# h < 2**32, so every product fits in uint64
+_PRIME = np.uint64(4294967291)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+
+
+def _table_cells(line):
+    if "|" in line:
+        cells = line.strip().strip("|").split("|")
+    elif "\t" in line:
+        cells = line.split("\t")
+    else:
+        return None
+    cells = [c.strip() for c in cells if c.strip()]
+    return cells if len(cells) >= 2 else None
+
+
+def _blocks(text):
+    """Group lines into blocks: bullets, table rows and (possibly wrapped) paragraphs."""
+    blocks = []
+    current = []
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        stripped = line.strip()
+        if not stripped or ("|" in stripped and TABLE_SEPARATOR.match(stripped)):
+            if current:
+                blocks.append(" ".join(current))
+                current = []
+            continue
+        cells = _table_cells(line)
+        if cells is not None:
+            if current:
+                blocks.append(" ".join(current))
+                current = []
+            blocks.append("; ".join(cells))
+            continue
+        bullet = BULLET.match(line)
+        if bullet:
+            stripped = line[bullet.end():].strip()
+        continues = current and not bullet and stripped[:1].islower() and not ENDS_SENTENCE.search(current[-1])
+        if current and not continues:
+            blocks.append(" ".join(current))
+            current = []
+        current.append(stripped)
+    if current:
+        blocks.append(" ".join(current))
+    return blocks
+
+
+def _sentences(block):
+    start = 0
+    for m in SENTENCE_END.finditer(block):
+        if m.group() == ".":
+            # Search this sentence only: from 0 a one-line report costs O(n^2)
+            token = LAST_TOKEN.search(block, start, m.start())
+            word = token.group(1).lstrip("([\"'").lower() if token else ""
+            if word in ABBREVIATIONS:
+                continue
+        yield block[start:m.start()]
+        start = m.end()
+    yield block[start:]
+
+
+def segment(text):
+    """Split raw report text into candidate findings (abbreviation-, bullet- and table-aware)."""
+    findings = []
+    for block in _blocks(text):
+        for sentence in _sentences(block):
+            sentence = sentence.strip()
+            if len(sentence) >= MIN_FINDING_CHARS:
+                findings.append(sentence)
+    return findings
+
+
+def normalize(text):
+    return WHITESPACE.sub(" ", text).strip(" .;:!?").lower()
+
+
+def minhash(text):
+    """MinHash signature (NUM_PERM uint64) of the character shingles of ``text``."""
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    if data.size < SHINGLE:
+        data = np.concatenate([data, np.zeros(SHINGLE - data.size, dtype=np.uint64)])
+    # Polynomial hash of every window, kept below 2**32
+    h = np.zeros(data.size - SHINGLE + 1, dtype=np.uint64)
+    for j in range(SHINGLE):
+        h = (h * np.uint64(257) + data[j:data.size - SHINGLE + 1 + j]) & np.uint64(0xFFFFFFFF)
+    h = np.unique(h)
+    return ((_PERM_A[:, None] * h[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+class Deduplicator:
+    """
+    Assigns each finding the id of its representative: the first finding
+    that is equal to it after normalization, or whose estimated Jaccard
+    similarity is at least ``threshold`` (1.0 keeps exact matching only).
+    State persists across ``add`` calls, so a stream can be deduplicated
+    batch by batch.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        self.representatives = []
+        self._exact = {}
+        self._signatures = np.zeros((0, NUM_PERM), dtype=np.uint64)
+        self._buckets = defaultdict(list)
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def add(self, finding):
+        """Return the representative id of ``finding``, registering it if it is new."""
+        key = normalize(finding)
+        rep = self._exact.get(key)
+        if rep is not None:
+            return rep
+
+        # Citations and control ids stay part of the template so "Sec 8" and
+        # "Sec 9", or CWE-311 and CWE-79, never merge (digits are masked below)
+        refs = ",".join(find_section_refs(finding) + find_control_ids(finding))
+        template = f"{DIGITS.sub('0', key)}\x00{refs}"
+        rep = self._exact.get(template)
+        if rep is not None:
+            self._exact[key] = rep
+            return rep
+
+        bands = []
+        sig = None
+        if self.threshold < 1.0:
+            sig = minhash(DIGITS.sub("0", key))
+            rows = NUM_PERM // BANDS
+            # Bucket keys include the citations, so only findings citing the same sections and controls are compared
+            bands = [
+                hashlib.blake2b(f"{b}\x00{refs}\x00".encode() + sig[b * rows:(b + 1) * rows].tobytes(), digest_size=8).digest()
+                for b in range(BANDS)
+            ]
+            candidates = list(dict.fromkeys(r for band in bands for r in self._buckets.get(band, ())))
+            if candidates:
+                similarity = (self._signatures[candidates] == sig).mean(axis=1)
+                best = int(similarity.argmax())
+                if similarity[best] >= self.threshold:
+                    r = candidates[best]
+                    self._exact[key] = self._exact[template] = r
+                    return r
+
+        rep = len(self.representatives)
+        self.representatives.append(finding)
+        if sig is not None:
+            if rep >= len(self._signatures):
+                # Grow geometrically; rows past len(self) are unused
+                grown = np.zeros((max(64, 2 * len(self._signatures)), NUM_PERM), dtype=np.uint64)
+                grown[:rep] = self._signatures[:rep]
+                self._signatures = grown
+            self._signatures[rep] = sig
+        self._exact[key] = self._exact[template] = rep
+        for band in bands:
+            self._buckets[band].append(rep)
+        return rep
+
+
+def dedupe(findings, threshold=None):
+    """``(unique, occurrences)``: representative findings, and each finding's index into them."""
+    dedup = Deduplicator(threshold)
+    with metrics.stage("dedupe"):
+        occurrences = [dedup.add(f) for f in findings]
+    metrics.FINDINGS.inc(len(findings) - len(dedup), path="duplicate")
+    return dedup.representatives, occurrences
+
+
+def expand(mappings, findings, occurrences):
+    """
+    Copy mappings of the unique findings (``finding_index`` into the unique
+    list) back to every original finding, ordered by finding then rank.
+    """
+    by_unique = defaultdict(list)
+    for m in mappings:
+        by_unique[m["finding_index"]].append(m)
+    results = []
+    for i, (finding, u) in enumerate(zip(findings, occurrences)):
+        for m in by_unique.get(u, ()):
+            results.append({**m, "finding": finding, "finding_index": i})
+    return results
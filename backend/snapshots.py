@@ -0,0 +1,517 @@
+"""
+Versioned, immutable index snapshots and their hot-swap.
+
+A snapshot is a directory data/snapshots/<version>/ holding everything the
+services load for one corpus: sections.json, the compiled section store
+(embeddings, metadata and texts; its header records the model and source
+hash), the Chroma collection behind /search, the control crosswalk, and a
+manifest.json describing them. ``create`` builds one in a hidden temporary
+directory and renames it into place, so a half-built snapshot is never
+visible; nothing writes to a snapshot afterwards.
+
+data/snapshots/CURRENT names the active version. Every process that warms
+an index (servers, inference and job workers) polls it every
+DPDP_SNAPSHOT_POLL_S. When it changes, the new snapshot is loaded in a
+background thread, warming what the old one had loaded, and then swapped
+in with a single assignment. A request binds the generation that is active
+when it starts and keeps it to the end, so no request mixes two indexes or
+waits for a load. ``activate`` and ``rollback`` move the pointer (also on
+/admin/snapshots, closed unless DPDP_ADMIN_TOKEN is set); DPDP_SNAPSHOT
+pins a process to one version. With no snapshot the indexes load from
+data/processed as before, compiling the section store on demand.
+
+Index state is declared with ``resource(name, loader)`` instead of a
+LazyResource: it has the same interface, but resolves to the current
+generation's LazyResource, which calls ``loader(snapshot)``.
+
+With a process inference pool each worker process follows CURRENT on its
+own, so around a switch consecutive requests may be served by different
+versions (each one still by a single version).
+
+    python snapshots.py create [--source sections.json] [--activate]
+    python snapshots.py list | activate <version> | rollback | prune --keep 5
+"""
+import argparse
+import contextvars
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+from lazy import LazyResource
+
+MANIFEST = "manifest.json"
+POINTER = "CURRENT"
+HISTORY = "HISTORY"
+SECTIONS_FILE = "sections.json"
+STORE_FILE = "sections.store.bin"
+VECTOR_DIR = "vector_store"
+CROSSWALK_FILE = "crosswalk.json"
+
+LEGACY_SECTIONS = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "processed", "sections.json")
+)
+
+SWAPS = metrics.REGISTRY.counter("dpdp_snapshot_swaps_total", "Index snapshots loaded and swapped in, by outcome", ["outcome"])
+
+
+class Snapshot:
+    """Paths and manifest of one snapshot; ``version`` is None for the legacy data/processed layout."""
+
+    def __init__(self, directory=None, manifest=None):
+        self.directory = directory
+        self.manifest = manifest or {}
+        self.version = self.manifest.get("version")
+        if directory is None:
+            self.sections_path = LEGACY_SECTIONS
+            # section_store.store_path(model), shared with the embedding cache
+            self.store_path = None
+            self.vector_dir = config.VECTOR_DIR
+            self.crosswalk_path = config.CROSSWALK_PATH
+        else:
+            self.sections_path = os.path.join(directory, SECTIONS_FILE)
+            self.store_path = os.path.join(directory, STORE_FILE)
+            self.vector_dir = os.path.join(directory, VECTOR_DIR)
+            self.crosswalk_path = os.path.join(directory, CROSSWALK_FILE)
+
+    @property
+    def immutable(self):
+        return self.directory is not None
+
+
+def open_snapshot(version):
+    directory = os.path.join(config.SNAPSHOT_DIR, version)
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Unknown index snapshot: {version}")
+    with open(path, encoding="utf-8") as f:
+        return Snapshot(directory, json.load(f))
+
+
+# name -> loader(snapshot) of every resource declared with resource()
+_LOADERS = {}
+# The generation a request (or job) started with
+_bound = contextvars.ContextVar("dpdp_generation", default=None)
+
+
+class Generation:
+    """The resources loaded from one snapshot; replaced as a whole when another snapshot is activated."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._version = snapshot.version
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        if self._version is None:
+            # Legacy layout: the sections.json hash, as before snapshots existed
+            with open(self.snapshot.sections_path, "rb") as f:
+                self._version = hashlib.sha256(f.read()).hexdigest()[:12]
+        return self._version
+
+    def resource(self, name):
+        res = self._resources.get(name)
+        if res is None:
+            with self._lock:
+                res = self._resources.get(name)
+                if res is None:
+                    loader = _LOADERS[name]
+                    res = self._resources[name] = LazyResource(name, lambda: self.run(loader, self.snapshot))
+        return res
+
+    def run(self, fn, *args):
+        """Call ``fn`` with this generation current, so every resource it reads is this generation's."""
+        token = _bound.set(self)
+        try:
+            return fn(*args)
+        finally:
+            _bound.reset(token)
+
+    def loaded(self):
+        return [name for name, res in list(self._resources.items()) if res.loaded]
+
+
+class GenerationResource:
+    """LazyResource interface over the current generation's copy of a resource."""
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def _resource(self):
+        return current().resource(self.name)
+
+    @property
+    def loaded(self):
+        return self._resource.loaded
+
+    @property
+    def loading(self):
+        return self._resource.loading
+
+    @property
+    def error(self):
+        return self._resource.error
+
+    def get(self):
+        return self._resource.get()
+
+    def warm(self, background=False):
+        return self._resource.warm(background=background)
+
+    def reset(self):
+        self._resource.reset()
+
+
+def resource(name, loader):
+    """Declare per-snapshot state: ``loader(snapshot)`` builds it, once per generation."""
+    _LOADERS[name] = loader
+    return GenerationResource(name)
+
+
+_active = None
+_active_lock = threading.Lock()
+_load_lock = threading.Lock()
+_status = {"loading": None, "error": None, "failed": None}
+_watcher = None
+
+
+def _initial():
+    version = config.SNAPSHOT or read_pointer()
+    if version:
+        try:
+            return Generation(open_snapshot(version))
+        except (OSError, ValueError) as e:
+            print(f"Warning: cannot open index snapshot {version}, using data/processed: {e}")
+    return Generation(Snapshot())
+
+
+def active():
+    """The generation new requests bind to."""
+    global _active
+    if _active is None:
+        with _active_lock:
+            if _active is None:
+                _active = _initial()
+    return _active
+
+
+def current():
+    """The generation bound to this request or job, else the active one."""
+    gen = _bound.get()
+    return gen if gen is not None else active()
+
+
+def version():
+    """Index version served to the current request: the snapshot version, or the sections.json hash."""
+    return current().version
+
+
+def bind():
+    """Pin the current context to the active generation; returns a token for release()."""
+    return _bound.set(active())
+
+
+def release(token):
+    try:
+        _bound.reset(token)
+    except ValueError:
+        # Flask may finish a request in a different context than it started in
+        _bound.set(None)
+
+
+@contextmanager
+def bound():
+    """Run a block (a request, a job) against one generation, whatever is swapped in meanwhile."""
+    token = bind()
+    try:
+        yield current()
+    finally:
+        release(token)
+
+
+async def asgi_middleware(request, call_next):
+    """FastAPI/Starlette ``http`` middleware: bind the request to a generation and report its version."""
+    token = bind()
+    try:
+        response = await call_next(request)
+        response.headers["X-Index-Version"] = version()
+        return response
+    finally:
+        release(token)
+
+
+def read_pointer():
+    """The version CURRENT names, or None."""
+    try:
+        with open(os.path.join(config.SNAPSHOT_DIR, POINTER), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_pointer(version):
+    path = os.path.join(config.SNAPSHOT_DIR, POINTER)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp, path)
+    with open(os.path.join(config.SNAPSHOT_DIR, HISTORY), "a", encoding="utf-8") as f:
+        f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())} {version}\n")
+
+
+def load(version):
+    """
+    Load snapshot ``version``, warming the resources the active generation
+    has loaded, then make it active. Requests in flight finish on the old
+    generation. Returns the new generation; on failure the old one stays.
+    """
+    global _active
+    with _load_lock:
+        old = active()
+        if old.snapshot.version == version:
+            return old
+        _status.update(loading=version, error=None)
+        try:
+            gen = Generation(open_snapshot(version))
+            for name in old.loaded():
+                gen.resource(name).get()
+        except Exception as e:
+            _status.update(loading=None, error=f"{version}: {type(e).__name__}: {e}", failed=version)
+            SWAPS.inc(outcome="failed")
+            raise
+        with _active_lock:
+            _active = gen
+        _status.update(loading=None, error=None, failed=None)
+        SWAPS.inc(outcome="swapped")
+        print(f"Switched to index snapshot {version}")
+        return gen
+
+
+def _load_quietly(version):
+    try:
+        load(version)
+    except Exception as e:
+        print(f"Warning: index snapshot {version} not loaded, keeping {active().version}: {e}")
+
+
+def reload(version=None, background=True):
+    """
+    Load ``version`` (default: the one CURRENT names) unless it is already
+    active, in a daemon thread when ``background``. Returns the target.
+    """
+    target = version or read_pointer()
+    if target is None:
+        raise LookupError("No index snapshot is active; create one with python snapshots.py create")
+    open_snapshot(target)
+    if target != active().snapshot.version:
+        if background:
+            threading.Thread(target=_load_quietly, args=(target,), name=f"snapshot-{target}", daemon=True).start()
+        else:
+            load(target)
+    return target
+
+
+def point(version):
+    """Point CURRENT at ``version``; every watching process follows."""
+    open_snapshot(version)
+    _write_pointer(version)
+
+
+def previous_version():
+    """The version CURRENT named before its present one."""
+    pointer = read_pointer()
+    try:
+        with open(os.path.join(config.SNAPSHOT_DIR, HISTORY), encoding="utf-8") as f:
+            history = [line.split()[-1] for line in f if line.strip()]
+    except FileNotFoundError:
+        history = []
+    previous = next((v for v in reversed(history) if v != pointer), None)
+    if previous is None:
+        raise LookupError("No earlier index snapshot to roll back to")
+    return previous
+
+
+def activate(version, background=True):
+    """Point CURRENT at ``version`` and load it in this process too."""
+    point(version)
+    return reload(version, background)
+
+
+def rollback(background=True):
+    return activate(previous_version(), background)
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        target = read_pointer()
+        if target and target != active().snapshot.version and target != _status["failed"]:
+            _load_quietly(target)
+
+
+def watch(interval=None):
+    """Follow CURRENT in a daemon thread (once per process); nothing when pinned or polling is off."""
+    global _watcher
+    interval = config.SNAPSHOT_POLL_S if interval is None else interval
+    if config.SNAPSHOT or interval <= 0:
+        return None
+    with _active_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, args=(interval,), name="snapshot-watch", daemon=True)
+            _watcher.start()
+    return _watcher
+
+
+def list_snapshots():
+    """Manifests of every snapshot, oldest first."""
+    out = []
+    if os.path.isdir(config.SNAPSHOT_DIR):
+        for name in os.listdir(config.SNAPSHOT_DIR):
+            if name.startswith(".") or not os.path.isdir(os.path.join(config.SNAPSHOT_DIR, name)):
+                continue
+            try:
+                out.append(open_snapshot(name).manifest)
+            except (OSError, ValueError):
+                continue
+    return sorted(out, key=lambda m: m.get("created_at", ""))
+
+
+def status():
+    gen = active()
+    return {
+        "version": gen.version,
+        "snapshot": gen.snapshot.version,
+        "pointer": read_pointer(),
+        "pinned": config.SNAPSHOT or None,
+        "loading": _status["loading"],
+        "error": _status["error"],
+        "loaded": gen.loaded(),
+    }
+
+
+def create(source_path=None, activate_now=False, vectors=True):
+    """
+    Build a snapshot of ``source_path`` (default data/processed/sections.json)
+    and return its manifest; with ``activate_now`` also point CURRENT at it.
+    """
+    import crosswalk
+    import index_dpdp
+    import rag
+    from encoder import get_encoder
+
+    source_path = os.path.abspath(source_path or LEGACY_SECTIONS)
+    with open(source_path, "rb") as f:
+        raw = f.read()
+    # Refuse a broken file before encoding anything
+    json.loads(raw)
+    source_hash = hashlib.sha256(raw).hexdigest()
+    snapshot_version = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{source_hash[:8]}"
+    os.makedirs(config.SNAPSHOT_DIR, exist_ok=True)
+    tmp = os.path.join(config.SNAPSHOT_DIR, f".{snapshot_version}.{os.getpid()}.tmp")
+    os.makedirs(tmp)
+    try:
+        with open(os.path.join(tmp, SECTIONS_FILE), "wb") as f:
+            f.write(raw)
+        encoder = get_encoder()
+        manifest = {
+            "version": snapshot_version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "source": source_path,
+            "source_hash": source_hash,
+            "model": encoder.name,
+        }
+        gen = Generation(Snapshot(tmp, manifest))
+        manifest.update(gen.run(rag.compile_section_store, encoder, gen.snapshot.store_path))
+        if vectors:
+            index_dpdp.index_chunks(gen.snapshot.sections_path, gen.snapshot.vector_dir)
+        if config.CROSSWALK:
+            gen.run(crosswalk.build, None, gen.snapshot.crosswalk_path)
+        manifest["files"] = sorted(os.listdir(tmp))
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(tmp, os.path.join(config.SNAPSHOT_DIR, snapshot_version))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    print(f"Created index snapshot {snapshot_version}")
+    if activate_now:
+        point(snapshot_version)
+        print(f"CURRENT -> {snapshot_version}")
+    return manifest
+
+
+def prune(keep):
+    """Delete all but the ``keep`` newest snapshots, never the one CURRENT names."""
+    pointer = read_pointer()
+    removed = []
+    manifests = list_snapshots()
+    for m in manifests[:max(0, len(manifests) - keep)]:
+        if m["version"] != pointer:
+            shutil.rmtree(os.path.join(config.SNAPSHOT_DIR, m["version"]))
+            removed.append(m["version"])
+    return removed
+
+
+def authorized(token):
+    """
+    Whether an X-Admin-Token value may use the /admin endpoints. None may
+    while DPDP_ADMIN_TOKEN is unset, so the endpoints are closed by default.
+    """
+    if not config.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), config.ADMIN_TOKEN.encode("utf-8"))
+
+
+def admin(action, version=None):
+    """Shared by the /admin/snapshots endpoints of every app."""
+    if action == "reload":
+        return {"target": reload(version), **status()}
+    if action == "activate":
+        if not version:
+            raise ValueError("version is required")
+        return {"target": activate(version), **status()}
+    if action == "rollback":
+        return {"target": rollback(), **status()}
+    raise ValueError(f"Unknown action: {action}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned index snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_cmd = commands.add_parser("create", help="Build a snapshot from sections.json")
+    create_cmd.add_argument("--source", help="sections.json to snapshot (default: data/processed/sections.json)")
+    create_cmd.add_argument("--activate", action="store_true", help="Point CURRENT at the new snapshot")
+    create_cmd.add_argument("--no-vectors", action="store_true", help="Skip the Chroma collection used by /search")
+    commands.add_parser("list", help="List snapshots")
+    activate_cmd = commands.add_parser("activate", help="Point CURRENT at a snapshot")
+    activate_cmd.add_argument("version")
+    commands.add_parser("rollback", help="Point CURRENT back at the previous snapshot")
+    prune_cmd = commands.add_parser("prune", help="Delete old snapshots")
+    prune_cmd.add_argument("--keep", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create(args.source, args.activate, not args.no_vectors)
+    elif args.command == "list":
+        pointer = read_pointer()
+        for m in list_snapshots():
+            flag = "*" if m["version"] == pointer else " "
+            print(f"{flag} {m['version']}  {m['created_at']}  {m['model']}  "
+                  f"{m.get('sections', '?')} sections, {m.get('clauses', '?')} clauses")
+    elif args.command in ("activate", "rollback"):
+        # Only moves the pointer; running services pick it up within DPDP_SNAPSHOT_POLL_S
+        target = args.version if args.command == "activate" else previous_version()
+        point(target)
+        print(f"CURRENT -> {target}")
+    elif args.command == "prune":
+        for v in prune(args.keep):
+            print(f"Removed {v}")
@@ -1,35 +1,42 @@
-def flatten_content(content, path=""):
-    """Recursively flatten the hierarchical content into a list of strings."""
+import hashlib
+
+def flatten_with_paths(content, path=""):
+    """Recursively flatten the hierarchical content into (clause_path, text) pairs."""
     lines = []
     
     if "intro" in content:
-        lines.append(content["intro"])
+        lines.append((path, content["intro"]))
     if "text" in content:
-        lines.append(content["text"])
+        lines.append((path, content["text"]))
     
     # Process nested blocks
     for level_key in ["subsections", "clauses", "subclauses", "subsubclauses"]:
         if level_key in content:
             for key, sub_content in content[level_key].items():
-                lines.extend(flatten_content(sub_content, f"{path} ({key})"))
+                lines.extend(flatten_with_paths(sub_content, f"{path}({key})"))
     
     # Process special blocks
     if "illustrations" in content:
         for ill in content["illustrations"]:
-            lines.append(f"Illustration: {ill}")
+            lines.append((path, f"Illustration: {ill}"))
     if "explanations" in content:
         for exp in content["explanations"]:
-            lines.append(f"Explanation: {exp}")
+            lines.append((path, f"Explanation: {exp}"))
     if "provisos" in content:
         for prov in content["provisos"]:
-            lines.append(f"Proviso: {prov}")
+            lines.append((path, f"Proviso: {prov}"))
             
     return lines
 
+def flatten_content(content, path=""):
+    """Recursively flatten the hierarchical content into a list of strings."""
+    return [text for _, text in flatten_with_paths(content, path)]
+
 def extract_chunks(data, max_words=300):
     """
     Extract searchable chunks from the structured DPDP JSON.
-    Each chunk will include section metadata for traceability.
+    Each chunk will include section metadata for traceability, including the
+    clause path (e.g. "8(5)") of its first element.
     """
     chunks = []
     
@@ -45,24 +52,28 @@ def extract_chunks(data, max_words=300):
             sec_title = sec.get("section_title")
             
             # Get all text elements from this section
-            text_elements = flatten_content(sec.get("content", {}))
+            text_elements = flatten_with_paths(sec.get("content", {}))
             
             # Combine elements into chunks of ~max_words
             current_chunk = []
+            current_path = ""
             current_word_count = 0
             
-            for element in text_elements:
+            for path, element in text_elements:
                 words = element.split()
                 if current_word_count + len(words) > max_words and current_chunk:
                     chunks.append({
                         "section_id": sec_num,
                         "title": sec_title,
                         "chapter": f"{ch_num}: {ch_title}",
+                        "clause_path": f"{sec_num}{current_path}",
                         "text": " ".join(current_chunk)
                     })
                     current_chunk = []
                     current_word_count = 0
                 
+                if not current_chunk:
+                    current_path = path
                 current_chunk.append(element)
                 current_word_count += len(words)
             
@@ -71,7 +82,27 @@ def extract_chunks(data, max_words=300):
                     "section_id": sec_num,
                     "title": sec_title,
                     "chapter": f"{ch_num}: {ch_title}",
+                    "clause_path": f"{sec_num}{current_path}",
                     "text": " ".join(current_chunk)
                 })
                 
     return chunks
+
+def chunk_id(chunk):
+    """
+    Stable, content-derived id: section + clause path + text hash.
+    Unchanged chunks keep their id even when chunk order shifts.
+    """
+    digest = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()[:16]
+    return f"{chunk['section_id']}:{chunk['clause_path']}:{digest}"
+
+def assign_chunk_ids(chunks):
+    ids = []
+    seen = {}
+    for c in chunks:
+        base = chunk_id(c)
+        # Identical text under a repeated section number still needs a unique id
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}#{n}")
+    return ids
@@ -0,0 +1,284 @@
+"""
+One retrieval interface over interchangeable vector backends.
+
+Every backend stores L2-normalized embeddings with parallel ``ids``,
+``metadatas`` and ``documents`` lists and answers ``search()`` with cosine
+similarities, so callers get the same result schema whether the index is
+exact NumPy (right for the ~50 sections of the Act), ChromaDB, or a local
+approximate index (hnswlib / FAISS) for larger corpora such as rules, FAQs
+and case law. Pick one with ``create_index(backend)`` or DPDP_INDEX_BACKEND.
+
+``search()`` takes an optional Chroma-style ``where`` filter on metadata
+({"chapter": ...}, {"section_id": {"$in": [...]}}, "$and"/"$or"). Chroma
+applies it inside the query; the local backends rank every row and drop
+the ones it excludes.
+"""
+import os
+import threading
+
+import numpy as np
+
+import config
+from ranking import top_k_columns
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def chroma_client(path=None):
+    """
+    The process-wide Chroma PersistentClient for ``path`` (default
+    DPDP_VECTOR_DIR). Opening a client loads the store's SQLite metadata,
+    so every caller in a process shares one; forked workers open their own.
+    """
+    path = os.path.abspath(path or config.VECTOR_DIR)
+    key = (os.getpid(), path)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            import chromadb
+            client = _clients[key] = chromadb.PersistentClient(path=path)
+        return client
+
+
+def matches_where(metadata, where):
+    """Whether ``metadata`` satisfies a Chroma ``where`` filter ($eq, $ne, $in, $nin, $and, $or)."""
+    for field, cond in where.items():
+        if field == "$and":
+            if not all(matches_where(metadata, c) for c in cond):
+                return False
+        elif field == "$or":
+            if not any(matches_where(metadata, c) for c in cond):
+                return False
+        else:
+            value = metadata.get(field)
+            ops = cond if isinstance(cond, dict) else {"$eq": cond}
+            for op, operand in ops.items():
+                if op == "$eq":
+                    ok = value == operand
+                elif op == "$ne":
+                    ok = value != operand
+                elif op == "$in":
+                    ok = value in operand
+                elif op == "$nin":
+                    ok = value not in operand
+                else:
+                    raise ValueError(f"Unsupported where operator: {op!r}")
+                if not ok:
+                    return False
+    return True
+
+
+class VectorIndex:
+    backend = None
+
+    def __init__(self):
+        self.ids = []
+        self.metadatas = []
+        self.documents = []
+        self.dim = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, ids, embeddings, metadatas=None, documents=None):
+        """Replace the index contents. ``embeddings`` must be normalized rows."""
+        self.ids = list(ids)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.ids]
+        self.documents = list(documents) if documents is not None else [None for _ in self.ids]
+        self.dim = int(embeddings.shape[1]) if len(self.ids) else 0
+        self._build(embeddings)
+        return self
+
+    def _build(self, embeddings):
+        raise NotImplementedError
+
+    def search(self, query_embs, top_k, where=None):
+        """
+        Return ``(rows, scores)`` shaped ``(n_queries, k)``, best-first, where
+        scores are cosine similarities. Missing neighbours are padded with
+        row -1 and score -inf. With ``where``, only rows whose metadata
+        matches it are returned.
+        """
+        if not where:
+            return self._search(query_embs, top_k)
+        allowed = self.allowed(where)
+        rows, scores = self._search(query_embs, len(self))
+        keep = (rows >= 0) & allowed[np.maximum(rows, 0)]
+        # Stable sort moves kept rows to the front without reordering them
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :top_k]
+        keep = np.take_along_axis(keep, order, axis=1)
+        rows = np.where(keep, np.take_along_axis(rows, order, axis=1), -1)
+        scores = np.where(keep, np.take_along_axis(scores, order, axis=1), -np.inf).astype(np.float32)
+        return self._pad(rows, scores, top_k)
+
+    def _search(self, query_embs, top_k):
+        raise NotImplementedError
+
+    def allowed(self, where):
+        """Boolean mask of the rows whose metadata matches ``where``."""
+        return np.fromiter((matches_where(m or {}, where) for m in self.metadatas), dtype=bool, count=len(self))
+
+    def query(self, query_embs, top_k, where=None):
+        """Same as search(), as records: ``{"id", "score", "metadata", "document"}``."""
+        rows, scores = self.search(query_embs, top_k, where)
+        out = []
+        for row_ids, row_scores in zip(rows.tolist(), scores.tolist()):
+            out.append([
+                {
+                    "id": self.ids[r],
+                    "score": s,
+                    "metadata": self.metadatas[r],
+                    "document": self.documents[r],
+                }
+                for r, s in zip(row_ids, row_scores) if r >= 0
+            ])
+        return out
+
+    def _pad(self, rows, scores, k):
+        """Pad backend results that returned fewer than k neighbours."""
+        n = rows.shape[0]
+        if rows.shape[1] >= k:
+            return rows, scores
+        pad = k - rows.shape[1]
+        rows = np.hstack([rows, np.full((n, pad), -1, dtype=np.int64)])
+        scores = np.hstack([scores, np.full((n, pad), -np.inf, dtype=np.float32)])
+        return rows, scores
+
+
+class NumpyIndex(VectorIndex):
+    """Exact brute-force search; the matrix may be a read-only memmap."""
+    backend = "numpy"
+
+    def _build(self, embeddings):
+        self.embeddings = embeddings
+
+    def _search(self, query_embs, top_k):
+        if not len(self):
+            return self._pad(np.zeros((len(query_embs), 0), dtype=np.int64), np.zeros((len(query_embs), 0), dtype=np.float32), top_k)
+        rows, scores = top_k_columns(np.dot(query_embs, self.embeddings.T), top_k)
+        return self._pad(rows, scores, top_k)
+
+
+class HnswIndex(VectorIndex):
+    """Approximate HNSW graph search via hnswlib (inner product on normalized vectors)."""
+    backend = "hnsw"
+
+    def _build(self, embeddings):
+        import hnswlib
+
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.init_index(
+            max_elements=max(len(self), 1), ef_construction=config.HNSW_EF_CONSTRUCTION, M=config.HNSW_M
+        )
+        if len(self):
+            self._index.add_items(np.asarray(embeddings, dtype=np.float32), np.arange(len(self)))
+        self._index.set_ef(config.HNSW_EF_SEARCH)
+
+    def _search(self, query_embs, top_k):
+        k = min(top_k, len(self))
+        if k == 0:
+            return self._pad(np.zeros((len(query_embs), 0), dtype=np.int64), np.zeros((len(query_embs), 0), dtype=np.float32), top_k)
+        self._index.set_ef(max(config.HNSW_EF_SEARCH, k))
+        labels, distances = self._index.knn_query(np.asarray(query_embs, dtype=np.float32), k=k)
+        # hnswlib "ip" distance is 1 - dot product
+        return self._pad(labels.astype(np.int64), (1.0 - distances).astype(np.float32), top_k)
+
+
+class FaissIndex(VectorIndex):
+    """FAISS-CPU inner-product index: exact (Flat) for small corpora, HNSW beyond that."""
+    backend = "faiss"
+    flat_limit = 10000
+
+    def _build(self, embeddings):
+        import faiss
+
+        if len(self) <= self.flat_limit:
+            self._index = faiss.IndexFlatIP(self.dim)
+        else:
+            self._index = faiss.IndexHNSWFlat(self.dim, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            self._index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+            self._index.hnsw.efSearch = config.HNSW_EF_SEARCH
+        if len(self):
+            self._index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+
+    def _search(self, query_embs, top_k):
+        k = min(top_k, len(self))
+        if k == 0:
+            return self._pad(np.zeros((len(query_embs), 0), dtype=np.int64), np.zeros((len(query_embs), 0), dtype=np.float32), top_k)
+        scores, rows = self._index.search(np.ascontiguousarray(query_embs, dtype=np.float32), k)
+        scores = np.where(rows < 0, -np.inf, scores).astype(np.float32)
+        return self._pad(rows.astype(np.int64), scores, top_k)
+
+
+class ChromaIndex(VectorIndex):
+    """
+    A ChromaDB collection behind the same interface. ``build()`` upserts into
+    the collection; ``open()`` attaches to one that index_dpdp.py already built.
+    """
+    backend = "chroma"
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+        self._rows = {}
+
+    def open(self):
+        """Load ids/metadata/documents of an existing collection."""
+        got = self.collection.get(include=["metadatas", "documents"])
+        self.ids = list(got["ids"])
+        self.metadatas = list(got.get("metadatas") or [{} for _ in self.ids])
+        self.documents = list(got.get("documents") or [None for _ in self.ids])
+        self._rows = {id_: i for i, id_ in enumerate(self.ids)}
+        return self
+
+    def _build(self, embeddings):
+        if len(self):
+            self.collection.upsert(
+                ids=self.ids,
+                embeddings=np.asarray(embeddings, dtype=np.float32).tolist(),
+                metadatas=[m or {"row": i} for i, m in enumerate(self.metadatas)],
+                documents=[d or "" for d in self.documents],
+            )
+        self._rows = {id_: i for i, id_ in enumerate(self.ids)}
+
+    def search(self, query_embs, top_k, where=None):
+        n = len(query_embs)
+        k = min(top_k, len(self))
+        if k == 0:
+            return self._pad(np.zeros((n, 0), dtype=np.int64), np.zeros((n, 0), dtype=np.float32), top_k)
+        # Filtered in Chroma, so top_k counts matching rows only
+        kwargs = {"where": where} if where else {}
+        res = self.collection.query(
+            query_embeddings=np.asarray(query_embs, dtype=np.float32).tolist(),
+            n_results=k,
+            include=["distances"],
+            **kwargs
+        )
+        rows = np.full((n, k), -1, dtype=np.int64)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        for i, (ids, dists) in enumerate(zip(res["ids"], res["distances"])):
+            for j, (id_, d) in enumerate(zip(ids, dists)):
+                rows[i, j] = self._rows.get(id_, -1)
+                # Chroma's default space is squared L2; on unit vectors l2^2 = 2 - 2cos
+                scores[i, j] = 1.0 - d / 2.0 if rows[i, j] >= 0 else -np.inf
+        return self._pad(rows, scores, top_k)
+
+
+BACKENDS = {
+    "numpy": NumpyIndex,
+    "hnsw": HnswIndex,
+    "faiss": FaissIndex,
+}
+
+
+def create_index(backend=None, collection=None):
+    """Instantiate an empty index for ``backend`` (default DPDP_INDEX_BACKEND)."""
+    backend = backend or config.INDEX_BACKEND
+    if backend == "chroma":
+        if collection is None:
+            raise ValueError("The chroma backend needs a collection")
+        return ChromaIndex(collection)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend!r} (expected one of {sorted(BACKENDS) + ['chroma']})")
+    return BACKENDS[backend]()
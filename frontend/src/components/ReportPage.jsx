@@ -70,11 +70,15 @@ const ReportPage = ({ data }) => {
                         </div>
                         <div style={{ textAlign: 'right' }}>
                             <div className="text-sm text-muted">Compliance Readiness</div>
-                            <div style={{ fontSize: '2.5rem', fontWeight: 'bold', color: data.score > 70 ? '#16a34a' : '#ea580c' }}>{data.score}%</div>
+                            {data.score == null ? (
+                                <div style={{ fontSize: '2.5rem', fontWeight: 'bold', color: '#6b7280' }} title="The server returned no compliance score">N/A</div>
+                            ) : (
+                                <div style={{ fontSize: '2.5rem', fontWeight: 'bold', color: data.score > 70 ? '#16a34a' : '#ea580c' }}>{data.score}%</div>
+                            )}
                         </div>
                     </div>
                     <div style={{ height: '8px', width: '100%', background: '#e1e4e8', borderRadius: 4, overflow: 'hidden' }}>
-                        <div style={{ height: '100%', width: `${data.score}%`, background: data.score > 70 ? '#16a34a' : '#ea580c', transition: 'width 0.5s ease' }}></div>
+                        <div style={{ height: '100%', width: `${data.score ?? 0}%`, background: data.score > 70 ? '#16a34a' : '#ea580c', transition: 'width 0.5s ease' }}></div>
                     </div>
                 </div>
 
@@ -71,7 +71,7 @@ const ResultsPage = ({ data }) => {
                                     </span>
                                 </td>
                                 <td style={{ padding: '1rem' }}>
-                                    <span className={`badge badge-${item.risk}`}>{item.risk === 'High' ? 'High' : 'Medium'}</span>
+                                    <span className={`badge badge-${item.risk}`}>{item.risk}</span>
                                 </td>
                                 <td style={{ padding: '1rem' }}>
                                     <button
@@ -75,7 +75,7 @@ const UploadPage = ({ onAnalyze }) => {
 
             if (response.status === "success" && response.results) {
                 // Transform granular mappings into report data
-                const structuredData = transformMappings(response.results);
+                const structuredData = transformMappings(response.results, response.compliance);
 
                 if (onAnalyze) {
                     onAnalyze(structuredData);
@@ -0,0 +1,283 @@
+"""
+Retrieval benchmark and relevance regression suite.
+
+Measures cold start, latency percentiles and throughput of rag.query_dpdp and
+search_dpdp.search across input sizes and concurrency levels, and scores
+both against the labeled gold set (recall@k, MRR). Results are written as
+JSON; pass --baseline to compare against an earlier run and exit non-zero
+on a speed or accuracy regression.
+
+    python scripts/benchmark.py --output bench.json
+    python scripts/benchmark.py --quick --baseline bench.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+GOLD_PATH = ROOT / "data" / "eval" / "gold_mappings.json"
+
+SIZES = [1, 10, 100, 1000, 10000]
+CONCURRENCY = [1, 4, 16]
+K_VALUES = [1, 3, 5]
+
+
+def percentiles(samples):
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "mean_ms": round(float(arr.mean()), 3),
+        "n": len(samples),
+    }
+
+
+def measure_cold_start(module, runs):
+    """Time a fresh interpreter importing ``module`` and loading its model + index."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import {module}; {module}.warm_up()"],
+            cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return {"seconds_min": round(min(times), 3), "seconds_max": round(max(times), 3), "runs": runs}
+
+
+HEX_TO_LETTERS = str.maketrans("0123456789", "ghijklmnop")
+
+
+def make_report(findings, n):
+    """
+    A synthetic report of n distinct sentences: the gold findings cycled,
+    each naming its own host and path as scanner output does. The suffix has
+    to be long enough that near-duplicate dedupe (Jaccard 0.85) keeps every
+    sentence, or any size would collapse to len(findings) unique findings.
+    """
+    sentences = []
+    for i in range(n):
+        # Letters only: dedupe masks digit runs
+        digest = hashlib.sha1(str(i).encode()).hexdigest().translate(HEX_TO_LETTERS)
+        sentences.append(f"{findings[i % len(findings)].rstrip('. ')} on host {digest[:20]} at /srv/{digest[20:]}")
+    return ". ".join(sentences) + "."
+
+
+def reset_caches(cache, keep_warm):
+    if not keep_warm:
+        cache.query_embeddings.clear()
+        cache.invalidate_results()
+
+
+def bench_latency(fn, inputs, repeats, cache, keep_warm):
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            reset_caches(cache, keep_warm)
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_concurrency(fn, inputs, level, requests, cache, keep_warm):
+    """Issue ``requests`` calls from ``level`` threads; report throughput and latency."""
+    reset_caches(cache, keep_warm)
+    latencies = []
+
+    def call(i):
+        start = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as executor:
+        list(executor.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+    result = percentiles(latencies)
+    result["requests_per_s"] = round(requests / elapsed, 3)
+    return result
+
+
+def ranking_metrics(ranked_lists, gold_sets):
+    """recall@k (any relevant section in the top k) and MRR over the gold set."""
+    out = {}
+    for k in K_VALUES:
+        hits = [any(s in gold for s in ranked[:k]) for ranked, gold in zip(ranked_lists, gold_sets)]
+        out[f"recall@{k}"] = round(sum(hits) / len(hits), 4)
+    rr = []
+    for ranked, gold in zip(ranked_lists, gold_sets):
+        rank = next((i + 1 for i, s in enumerate(ranked) if s in gold), None)
+        rr.append(1.0 / rank if rank else 0.0)
+    out["mrr"] = round(sum(rr) / len(rr), 4)
+    return out
+
+
+def dedupe(seq):
+    seen = set()
+    return [x for x in seq if not (x in seen or seen.add(x))]
+
+
+def eval_query_dpdp(rag, items, granularity):
+    ranked = []
+    for item in items:
+        mappings = rag.query_dpdp(item["finding"], threshold=-1.0, top_k=max(K_VALUES), granularity=granularity)
+        ranked.append(dedupe(m["section_number"] for m in mappings))
+    return ranking_metrics(ranked, [set(i["sections"]) for i in items])
+
+
+def eval_search(search_dpdp, items):
+    ranked = []
+    for item in items:
+        # Several chunks can share a section, so over-fetch before deduping
+        results = search_dpdp.search(item["finding"], top_k=max(K_VALUES) * 3)
+        ranked.append(dedupe(r["section_id"] for r in results))
+    return ranking_metrics(ranked, [set(i["sections"]) for i in items])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, max_latency_regression, max_quality_drop):
+    """Return human-readable regressions of ``current`` against ``baseline``."""
+    problems = []
+    for name in ("query_dpdp", "search"):
+        cur_lat = current.get(name, {}).get("latency", {})
+        base_lat = baseline.get(name, {}).get("latency", {})
+        for size, stats in cur_lat.items():
+            if size in base_lat and base_lat[size]["p95_ms"] > 0:
+                ratio = stats["p95_ms"] / base_lat[size]["p95_ms"] - 1.0
+                if ratio > max_latency_regression:
+                    problems.append(f"{name} p95 latency at {size}: +{ratio:.0%}")
+        cur_q = current.get(name, {}).get("relevance", {})
+        base_q = baseline.get(name, {}).get("relevance", {})
+        for metric, value in cur_q.items():
+            if metric in base_q and base_q[metric] - value > max_quality_drop:
+                problems.append(f"{name} {metric}: {base_q[metric]} -> {value}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--quick", action="store_true", help="Small sizes and few repeats, for CI")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--cold-runs", type=int, default=1)
+    parser.add_argument("--warm-cache", action="store_true", help="Keep query caches between calls")
+    parser.add_argument("--granularity", choices=["section", "clause"], default="section")
+    parser.add_argument("--skip-search", action="store_true", help="Skip search_dpdp (e.g. no Chroma store)")
+    parser.add_argument("--max-latency-regression", type=float, default=0.25)
+    parser.add_argument("--max-quality-drop", type=float, default=0.02)
+    args = parser.parse_args()
+
+    sizes = [1, 10, 100] if args.quick else SIZES
+    levels = [1, 4] if args.quick else CONCURRENCY
+    repeats = 2 if args.quick else args.repeats
+
+    with open(GOLD_PATH, encoding="utf-8") as f:
+        items = json.load(f)["items"]
+    findings = [i["finding"] for i in items]
+
+    # Backend modules resolve their data relative to backend/
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "index_backend": os.environ.get("DPDP_INDEX_BACKEND", "numpy"),
+            "search_index_backend": os.environ.get("DPDP_SEARCH_INDEX_BACKEND", "chroma"),
+            "granularity": args.granularity,
+            "warm_cache": args.warm_cache,
+            "gold_items": len(items),
+        }
+    }
+
+    print("Measuring cold start...", file=sys.stderr)
+    results["cold_start"] = {"rag": measure_cold_start("rag", args.cold_runs)}
+    if not args.skip_search:
+        results["cold_start"]["search_dpdp"] = measure_cold_start("search_dpdp", args.cold_runs)
+
+    import cache
+    import rag
+    import segmenter
+
+    def run_query(text):
+        return rag.query_dpdp(text, granularity=args.granularity)
+
+    print("Benchmarking query_dpdp...", file=sys.stderr)
+    latency = {}
+    for n in sizes:
+        # Big reports are slow; fewer repeats keep the run bounded
+        reps = repeats if n <= 100 else 1
+        latency[f"{n}_sentences"] = bench_latency(run_query, [make_report(findings, n)], reps, cache, args.warm_cache)
+        latency[f"{n}_sentences"]["sentences_per_s"] = round(n / (latency[f"{n}_sentences"]["mean_ms"] / 1000.0), 1)
+        # What is actually encoded and mapped after near-duplicate dedupe
+        latency[f"{n}_sentences"]["unique_findings"] = len(segmenter.dedupe(rag.split_findings(make_report(findings, n)))[0])
+
+    reports = [make_report(findings[i:] + findings[:i], 10) for i in range(len(findings))]
+    throughput = {
+        f"concurrency_{c}": bench_concurrency(run_query, reports, c, max(c * 4, 8), cache, args.warm_cache)
+        for c in levels
+    }
+    results["query_dpdp"] = {
+        "latency": latency,
+        "throughput": throughput,
+        "relevance": eval_query_dpdp(rag, items, args.granularity),
+    }
+
+    if not args.skip_search:
+        import search_dpdp
+
+        print("Benchmarking search()...", file=sys.stderr)
+        results["search"] = {
+            "latency": {"1_query": bench_latency(search_dpdp.search, findings, repeats, cache, args.warm_cache)},
+            "throughput": {
+                f"concurrency_{c}": bench_concurrency(search_dpdp.search, findings, c, max(c * 4, 8), cache, args.warm_cache)
+                for c in levels
+            },
+            "relevance": eval_search(search_dpdp, items),
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.max_latency_regression, args.max_quality_drop)
+        for p in problems:
+            print(f"REGRESSION: {p}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
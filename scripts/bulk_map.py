@@ -0,0 +1,301 @@
+"""
+Offline bulk mapping of archived findings reports.
+
+Maps every PDF, TXT and JSON report under the given directories or globs
+with rag.query_dpdp, sharded across a process pool in which each worker
+loads the model once. Results stream to JSONL (one record per report, with
+its mappings and compliance summary) or CSV (one row per mapping) as
+reports finish, so memory stays flat however large the archive.
+
+Every finished report is appended to a checkpoint next to the output,
+together with the output size after its record. A killed run started again
+with the same arguments truncates any half-written record and skips the
+reports already done; --restart starts over. Reports that fail are logged
+and retried on the next run. Progress, docs/s and findings/s go to stderr.
+
+    python scripts/bulk_map.py archive/ --output mappings.jsonl
+    python scripts/bulk_map.py "archive/2024-Q*/**/*.pdf" --output mappings.csv --workers 8
+
+JSON reports may be a list of findings, {"findings": [...]}, or
+{"text": "..."}.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+# Workers are spawned and re-import this module, so they need the path too
+sys.path.insert(0, str(BACKEND_DIR))
+
+SUFFIXES = {".pdf", ".txt", ".json"}
+CSV_FIELDS = [
+    "file", "finding", "section", "clause", "title", "chapter", "score", "rank", "match", "control", "risk",
+    "max_penalty_inr"
+]
+
+
+def find_reports(inputs):
+    """Report files under ``inputs`` (files, directories or glob patterns), sorted and without repeats."""
+    found = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = path.rglob("*")
+        elif path.exists():
+            candidates = [path]
+        else:
+            candidates = (Path(p) for p in glob.glob(item, recursive=True))
+        found.update(p.resolve() for p in candidates if p.is_file() and p.suffix.lower() in SUFFIXES)
+    return sorted(found)
+
+
+def read_report(path):
+    """Report text; JSON findings are separated by blank lines so each stays one finding."""
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        from ingest import iter_pdf_pages
+        with open(path, "rb") as f:
+            return "\n".join(text for _, text in iter_pdf_pages(f))
+    if suffix == ".json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("findings", data.get("text", ""))
+        if isinstance(data, list):
+            return "\n\n".join(str(item.get("finding", item.get("text", ""))) if isinstance(item, dict) else str(item)
+                               for item in data)
+        return str(data)
+    return path.read_text(encoding="utf-8", errors="replace")
+
+
+def init_worker(threads):
+    # One model per worker; cap its intra-op threads so workers do not oversubscribe the CPUs
+    if threads:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(name, str(threads))
+    import rag
+    rag.warm_up()
+
+
+def map_report(path, opts, include_text):
+    """Map one report in a worker; returns its output record."""
+    import rag
+    from scoring import score_mappings
+
+    start = time.perf_counter()
+    try:
+        text = read_report(path)
+        findings = len(rag.split_findings(text))
+        mappings = rag.query_dpdp(text, **opts) if findings else []
+    except Exception as e:
+        return {"file": str(path), "error": f"{type(e).__name__}: {e}"}
+    return {
+        "file": str(path),
+        "findings": findings,
+        "results": rag.format_results(mappings, include_text),
+        "compliance": score_mappings(mappings),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def file_key(path):
+    stat = path.stat()
+    return {"file": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_checkpoint(checkpoint):
+    """``(done, offset, end)``: file keys already written, the output size after the last of them,
+    and the checkpoint size up to its last valid line."""
+    done = set()
+    offset = 0
+    end = 0
+    if not checkpoint.exists():
+        return done, offset, end
+    with open(checkpoint, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # A line cut short by the kill; it and its record are truncated away below
+                break
+            try:
+                entry = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                break
+            done.add((entry["file"], entry["size"], entry["mtime_ns"]))
+            offset = entry["offset"]
+            end += len(line)
+    return done, offset, end
+
+
+def serialize(record, fmt):
+    if fmt == "jsonl":
+        return json.dumps(record, ensure_ascii=False) + "\n"
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    for row in record["results"]:
+        writer.writerow({**row, "file": record["file"]})
+    return buf.getvalue()
+
+
+class Progress:
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.docs = 0
+        self.findings = 0
+        self.mappings = 0
+        self.errors = 0
+
+    def add(self, record):
+        self.docs += 1
+        if "error" in record:
+            self.errors += 1
+            return
+        self.findings += record["findings"]
+        self.mappings += len(record["results"])
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return {
+            "docs": self.docs,
+            "of": self.total,
+            "errors": self.errors,
+            "findings": self.findings,
+            "mappings": self.mappings,
+            "seconds": round(elapsed, 1),
+            "docs_per_s": round(self.docs / elapsed, 2),
+            "findings_per_s": round(self.findings / elapsed, 1),
+        }
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            s = self.summary()
+            print(
+                f"{s['docs']}/{s['of']} docs, {s['findings']} findings, {s['errors']} errors "
+                f"in {s['seconds']}s: {s['docs_per_s']} docs/s, {s['findings_per_s']} findings/s",
+                file=sys.stderr
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Report files, directories or glob patterns")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Default: from the output suffix")
+    parser.add_argument("--checkpoint", help="Default: <output>.checkpoint")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and overwrite the output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int,
+                        help="Intra-op threads per worker (default: CPUs / workers)")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--top-k", type=int, default=1)
+    parser.add_argument("--granularity", choices=["section", "clause"], default="section")
+    parser.add_argument("--aggregation", choices=["max", "mean"], default="max")
+    parser.add_argument("--rerank", action="store_true", help="Rerank candidates with the cross-encoder")
+    parser.add_argument("--rerank-budget-ms", type=float, help="Reranking budget per report (default: DPDP_RERANK_BUDGET_MS)")
+    parser.add_argument("--include-text", action="store_true", help="Include section texts (JSONL only)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    fmt = args.format or ("csv" if output.suffix.lower() == ".csv" else "jsonl")
+    checkpoint = Path(args.checkpoint or f"{output}.checkpoint")
+    opts = {
+        "threshold": args.threshold,
+        "top_k": args.top_k,
+        "granularity": args.granularity,
+        "aggregation": args.aggregation,
+        "rerank": args.rerank,
+        "rerank_budget_ms": args.rerank_budget_ms,
+    }
+
+    reports = find_reports(args.inputs)
+    if args.restart:
+        checkpoint.unlink(missing_ok=True)
+    done, offset, ckpt_end = load_checkpoint(checkpoint)
+    if not output.exists():
+        offset = 0
+        checkpoint.unlink(missing_ok=True)
+        done = set()
+    todo = []
+    for path in reports:
+        key = file_key(path)
+        if (key["file"], key["size"], key["mtime_ns"]) not in done:
+            todo.append((path, key))
+    print(f"{len(reports)} reports, {len(reports) - len(todo)} already mapped, {len(todo)} to go", file=sys.stderr)
+    if not todo:
+        return
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    out = open(output, "r+b" if offset else "wb")
+    # Drop anything written after the last checkpointed record
+    out.truncate(offset)
+    out.seek(offset)
+    if fmt == "csv" and offset == 0:
+        out.write((",".join(CSV_FIELDS) + "\n").encode("utf-8"))
+    ckpt = open(checkpoint, "a" if offset else "w", encoding="utf-8")
+    # Appending after a cut-short line would leave it in the middle of the
+    # checkpoint, and the next resume would stop there
+    ckpt.truncate(ckpt_end if offset else 0)
+
+    workers = max(1, min(args.workers, len(todo)))
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    progress = Progress(len(todo), args.progress_interval)
+    # spawn, not fork: forking after torch has started threads can deadlock
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(threads,),
+    ) as executor:
+        queue = iter(todo)
+        in_flight = {}
+        try:
+            while True:
+                # Keep a couple of reports queued per worker, not the whole archive
+                while len(in_flight) < 2 * workers:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    in_flight[executor.submit(map_report, item[0], opts, args.include_text)] = item[1]
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = in_flight.pop(future)
+                    record = future.result()
+                    progress.add(record)
+                    if "error" in record:
+                        print(f"Failed: {record['file']}: {record['error']}", file=sys.stderr)
+                        continue
+                    out.write(serialize(record, fmt).encode("utf-8"))
+                    out.flush()
+                    ckpt.write(json.dumps({**key, "offset": out.tell()}) + "\n")
+                    ckpt.flush()
+                progress.report()
+        except KeyboardInterrupt:
+            print("Interrupted; run again with the same arguments to resume.", file=sys.stderr)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            out.close()
+            ckpt.close()
+
+    progress.report(force=True)
+    print(json.dumps(progress.summary()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
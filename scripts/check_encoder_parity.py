@@ -0,0 +1,118 @@
+"""
+Parity check between two encoder backends (backend/encoder.py).
+
+Maps the gold findings (data/eval/gold_mappings.json) to DPDP sections with
+a reference encoder (fp32 torch by default) and a candidate (e.g. onnx-int8),
+then reports how often the top-k section mappings agree, the cosine between
+the two query embeddings, gold recall for both, and encode speed. Exits
+non-zero when top-1 agreement falls below --min-agreement.
+
+    python scripts/check_encoder_parity.py --candidate onnx-int8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+GOLD_PATH = ROOT / "data" / "eval" / "gold_mappings.json"
+
+
+def timed_encode(encoder, texts, repeats=3):
+    encoder.encode(texts[:2])  # warm-up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embs = encoder.encode(texts)
+        best = min(best, time.perf_counter() - start)
+    return embs, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare top-k section mappings of two encoder backends")
+    parser.add_argument("--reference", default="torch")
+    parser.add_argument("--candidate", default="onnx-int8")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="Minimum top-1 agreement")
+    parser.add_argument("--output", help="Write the report JSON here as well")
+    args = parser.parse_args()
+
+    # rag builds its section documents with the reference encoder
+    os.environ["DPDP_ENCODER_BACKEND"] = args.reference
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import rag
+    from encoder import load_encoder
+    from ranking import top_k_columns
+
+    with open(GOLD_PATH, encoding="utf-8") as f:
+        items = json.load(f)["items"]
+    findings = [i["finding"] for i in items]
+
+    reference = rag.encoder
+    candidate = load_encoder(args.candidate)
+
+    ref_sections, ref_section_s = timed_encode(reference, rag.documents)
+    cand_sections, cand_section_s = timed_encode(candidate, rag.documents)
+    ref_queries, ref_query_s = timed_encode(reference, findings)
+    cand_queries, cand_query_s = timed_encode(candidate, findings)
+
+    ref_top, _ = top_k_columns(ref_queries @ ref_sections.T, args.top_k)
+    cand_top, _ = top_k_columns(cand_queries @ cand_sections.T, args.top_k)
+
+    top1_agree = float(np.mean(ref_top[:, 0] == cand_top[:, 0]))
+    overlap = float(np.mean([
+        len(set(r) & set(c)) / len(set(r) | set(c)) for r, c in zip(ref_top.tolist(), cand_top.tolist())
+    ]))
+    cosine = float(np.mean(np.sum(ref_queries * cand_queries, axis=1)))
+
+    def recall(top):
+        hits = [
+            any(rag.metadata[s]["section_number"] in item["sections"] for s in row)
+            for row, item in zip(top.tolist(), items)
+        ]
+        return round(sum(hits) / len(hits), 4)
+
+    disagreements = [
+        {
+            "finding": f,
+            "reference": rag.metadata[r]["section_number"],
+            "candidate": rag.metadata[c]["section_number"],
+        }
+        for f, r, c in zip(findings, ref_top[:, 0].tolist(), cand_top[:, 0].tolist()) if r != c
+    ]
+
+    report = {
+        "reference": reference.name,
+        "candidate": candidate.name,
+        "findings": len(findings),
+        "top_k": args.top_k,
+        "top1_agreement": round(top1_agree, 4),
+        f"top{args.top_k}_jaccard": round(overlap, 4),
+        "mean_query_cosine": round(cosine, 4),
+        f"gold_recall@{args.top_k}": {"reference": recall(ref_top), "candidate": recall(cand_top)},
+        "encode_seconds": {
+            "reference": {"sections": round(ref_section_s, 4), "findings": round(ref_query_s, 4)},
+            "candidate": {"sections": round(cand_section_s, 4), "findings": round(cand_query_s, 4)},
+        },
+        "speedup": round((ref_section_s + ref_query_s) / max(cand_section_s + cand_query_s, 1e-9), 2),
+        "disagreements": disagreements,
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+    if top1_agree < args.min_agreement:
+        print(f"FAIL: top-1 agreement {top1_agree:.2%} < {args.min_agreement:.2%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Export the sentence-embedding model to ONNX, plus an int8 dynamically
+quantized copy, for the onnx / onnx-int8 encoder backends (backend/encoder.py).
+
+Run once on a machine where the SentenceTransformer model is available; the
+output directory (model.onnx, model.int8.onnx, tokenizer.json) is all the
+server needs afterwards, with no network access.
+
+    python scripts/export_onnx.py
+    python scripts/export_onnx.py --model all-MiniLM-L6-v2 --out data/models/all-MiniLM-L6-v2-onnx
+"""
+import argparse
+from pathlib import Path
+
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_OUT = ROOT / "data" / "models" / "all-MiniLM-L6-v2-onnx"
+
+
+class TransformerOnly(torch.nn.Module):
+    """Expose just the token embeddings; pooling is done in encoder.OnnxEncoder."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX (fp32 + int8)")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--out", default=str(DEFAULT_OUT))
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+
+    print(f"Loading {args.model}...")
+    st_model = SentenceTransformer(args.model, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model[0].tokenizer
+    # Writes tokenizer.json, which encoder.OnnxEncoder loads with `tokenizers`
+    tokenizer.save_pretrained(str(out))
+
+    sample = tokenizer(["Personal data retained beyond the necessary purpose"], return_tensors="pt")
+    fp32_path = out / "model.onnx"
+    print(f"Exporting {fp32_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            TransformerOnly(transformer),
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["token_embeddings"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "token_type_ids": {0: "batch", 1: "sequence"},
+                "token_embeddings": {0: "batch", 1: "sequence"},
+            },
+            opset_version=args.opset,
+        )
+
+    int8_path = out / "model.int8.onnx"
+    print(f"Quantizing to {int8_path}...")
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+
+    for path in (fp32_path, int8_path):
+        print(f"{path.name}: {path.stat().st_size / 1e6:.1f} MB")
+    print("Done. Verify with: python scripts/check_encoder_parity.py --candidate onnx-int8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,146 @@
-from pypdf import PdfReader
+"""
+Extract normalized text from the DPDP source PDFs (the Act, the Rules,
+amendments, sectoral notifications...).
+
+Every PDF in data/raw (or the paths given on the command line) becomes one
+text file in data/processed/text/<name>.txt; the Act is also written to
+data/processed/raw_text.txt, which split_into_sections.py reads.
+
+Pages are extracted in parallel across a process pool, and each cleaned page
+is cached under data/processed/page_cache keyed by the PDF's SHA-256, the
+page number and the cleaning rules, so re-running after adding one gazette
+notification only extracts that file.
+
+    python scripts/extract_raw_txt.py
+    python scripts/extract_raw_txt.py data/raw/DPDP_Rules_2025.pdf --workers 4
+"""
+import argparse
+import hashlib
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-PDF_PATH = Path("data/raw/DPDP_Act_2023.pdf")
-OUT_PATH = Path("data/processed/raw_text.txt")
+from pypdf import PdfReader
 
-reader = PdfReader(PDF_PATH)
+ROOT = Path(__file__).resolve().parent.parent
+RAW_DIR = ROOT / "data" / "raw"
+TEXT_DIR = ROOT / "data" / "processed" / "text"
+CACHE_DIR = ROOT / "data" / "processed" / "page_cache"
+ACT_NAME = "DPDP_Act_2023"
+OUT_PATH = ROOT / "data" / "processed" / "raw_text.txt"
 
-text = ""
-for page in reader.pages:
-    t = page.extract_text()
-    if t:
-        text += t + "\n"
+# Pages handed to a worker at a time; each batch opens the PDF once
+PAGES_PER_TASK = 8
 
-# Clean headers / footers / noise / Hindi / side-noise
-text = re.sub(r"THE GAZETTE OF INDIA EXTRAORDINARY.*?\n", "", text)
-text = re.sub(r"MINISTRY OF LAW AND JUSTICE.*?\n", "", text)
-text = re.sub(r"\(Legislative Department\).*?\n", "", text)
-text = re.sub(r"New Delhi, the.*?\n", "", text)
-text = re.sub(r"The following Act of Parliament received the assent.*?\n", "", text)
-text = re.sub(r"CG-DL-E-\d+-?\d+", "", text)
-text = re.sub(r"सी.जी.-डी.एल.-अ.-\d+-?\d+", "", text)
+# Clean headers / footers / noise / Hindi / side-noise. Every rule deletes
+# text within one line, so they run together as a single alternation per page.
+PAGE_NOISE = re.compile("|".join([
+    r"THE GAZETTE OF INDIA EXTRAORDINARY.*?\n",
+    r"MINISTRY OF LAW AND JUSTICE.*?\n",
+    r"MINISTRY OF ELECTRONICS AND INFORMATION TECHNOLOGY.*?\n",
+    r"\(Legislative Department\).*?\n",
+    r"New Delhi, the.*?\n",
+    r"The following Act of Parliament received the assent.*?\n",
+    r"CG-DL-E-\d+-?\d+",
+    r"सी.जी.-डी.एल.-अ.-\d+-?\d+",
+    # Hindi text block artifacts
+    r"[\u0900-\u097F]+",
+    # Running header of odd pages
+    r"SEC\.\s*1\]",
+]))
 
-# Remove Hindi text block artifacts
-text = re.sub(r"[\u0900-\u097F]+", "", text)
+# These span page boundaries, so they run once on the joined document
+# Page numbers in the footer appear as a number on a line by itself
+PAGE_NUMBER = re.compile(r"\n\s*\d+\s*\n")
+IMPRINT = re.compile(r"UPLOADED BY THE MANAGER.*", flags=re.DOTALL)
+# Normalize section starts: Ensure "1. (1)" or "2. In this Act" format
+SECTION_START = re.compile(r"(\n)(\d+[A-Z]?)\s+(\()")
+SPACES = re.compile(r" {2,}")
+BLANK_LINES = re.compile(r"\n{3,}")
 
-# Remove page markers like "SEC. 1]" or "2", "4", "6", "8" etc which are page numbers in the footer
-# These often appear as a number on a line by itself
-text = re.sub(r"\n\s*\d+\s*\n", "\n", text)
-text = re.sub(r"SEC\.\s*1\]", "", text)
+# Part of every page cache key: editing a rule invalidates cached pages
+RULES_VERSION = hashlib.sha256(PAGE_NOISE.pattern.encode("utf-8")).hexdigest()[:12]
 
-text = re.sub(r"UPLOADED BY THE MANAGER.*", "", text, flags=re.DOTALL)
 
-# Normalize section starts: Ensure "1. (1)" or "2. In this Act" format
-text = re.sub(r"(\n)(\d+[A-Z]?)\s+(\()", r"\1\2. \3", text)
+def clean_page(text):
+    return PAGE_NOISE.sub("", text + "\n")
+
+
+def clean_document(pages):
+    text = "".join(pages)
+    text = PAGE_NUMBER.sub("\n", text)
+    text = IMPRINT.sub("", text)
+    text = SECTION_START.sub(r"\1\2. \3", text)
+    # Remove excessive whitespace but keep structure
+    text = SPACES.sub(" ", text)
+    text = BLANK_LINES.sub("\n\n", text)
+    return text.strip()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_cache_path(pdf_hash, page):
+    return CACHE_DIR / pdf_hash[:16] / f"{page:05d}.{RULES_VERSION}.txt"
+
+
+def extract_pages(pdf_path, pdf_hash, pages):
+    """Worker: extract, clean and cache ``pages`` (0-based) of one PDF."""
+    reader = PdfReader(pdf_path)
+    for page in pages:
+        cleaned = clean_page(reader.pages[page].extract_text() or "")
+        path = page_cache_path(pdf_hash, page)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(cleaned, encoding="utf-8")
+        os.replace(tmp, path)
+    return len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract normalized text from DPDP source PDFs")
+    parser.add_argument("pdfs", nargs="*", help=f"PDF files (default: every PDF in {RAW_DIR})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    pdfs = [Path(p) for p in args.pdfs] or sorted(RAW_DIR.glob("*.pdf"))
+    if not pdfs:
+        raise SystemExit(f"No PDFs found in {RAW_DIR}")
+
+    sources = []
+    tasks = []
+    for pdf in pdfs:
+        pdf_hash = file_hash(pdf)
+        n_pages = len(PdfReader(pdf).pages)
+        missing = [p for p in range(n_pages) if not page_cache_path(pdf_hash, p).exists()]
+        for i in range(0, len(missing), PAGES_PER_TASK):
+            tasks.append((str(pdf), pdf_hash, missing[i:i + PAGES_PER_TASK]))
+        sources.append((pdf, pdf_hash, n_pages))
+        print(f"{pdf.name}: {n_pages} pages, {len(missing)} to extract")
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(tasks)))) as executor:
+            futures = [executor.submit(extract_pages, *task) for task in tasks]
+            for future in futures:
+                future.result()
+
+    TEXT_DIR.mkdir(parents=True, exist_ok=True)
+    for pdf, pdf_hash, n_pages in sources:
+        pages = [page_cache_path(pdf_hash, p).read_text(encoding="utf-8") for p in range(n_pages)]
+        text = clean_document(pages)
+        (TEXT_DIR / f"{pdf.stem}.txt").write_text(text, encoding="utf-8")
+        if pdf.stem == ACT_NAME:
+            OUT_PATH.parent.mkdir(exist_ok=True)
+            OUT_PATH.write_text(text, encoding="utf-8")
 
-# Remove excessive whitespace but keep structure
-text = re.sub(r" {2,}", " ", text)
-text = re.sub(r"\n{3,}", "\n\n", text)
+    print(f"Clean raw text extracted and normalized for {len(sources)} source(s)")
 
-OUT_PATH.parent.mkdir(exist_ok=True)
-OUT_PATH.write_text(text.strip(), encoding="utf-8")
 
-print("Clean raw text extracted and normalized")
+if __name__ == "__main__":
+    main()
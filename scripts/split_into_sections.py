@@ -1,5 +1,8 @@
+import argparse
+import bisect
 import re
 import json
+import sys
 from pathlib import Path
 
 RAW_PATH = Path("data/processed/raw_text.txt")
@@ -30,119 +33,241 @@ def get_sequence_val(key, name):
         return ord(key) - ord('A') + 1
     return 0
 
-def parse_level(text, level_patterns):
-    if not level_patterns:
-        return {"text": clean_text(text)}
-
-    best_name = None
-    best_matches = []
-    
-    for name, pattern in level_patterns:
-        # Require newline for top-level structural markers
-        if name in ["subsections", "clauses"]:
-            p = r"(?:^|\n)\s*" + pattern
-        else:
-            p = pattern
-            
-        matches = list(re.finditer(p, text, re.MULTILINE))
-        if not matches:
-            continue
-            
-        # Sequence-aware filtering
-        ordered = []
-        last_val = 0
-        for m in matches:
-            val = get_sequence_val(m.group(1), name)
-            # Allow starting at something other than 1 for first item, or specifically 1
-            if not ordered:
-                if val > 0:
-                    ordered.append(m)
+# Hierarchy levels, in tie-break order. Subsections and clauses must open a
+# line; "sub-section (2)" or "clause (a)" in running text are cross-references.
+LEVELS = ["subsections", "clauses", "subclauses", "subsubclauses"]
+LINE_START_LEVELS = {"subsections", "clauses"}
+
+# Every "(<key>)" in the text, found once, with its trailing whitespace and
+# whether it follows "sub-section " / "section " (a cross-reference)
+MARKER = re.compile(
+    r"\("
+    r"(?P<subsection_ref>(?<=sub-section\s\()|(?<=sub-sections\s\())?"
+    r"(?P<clause_ref>(?<=section\s\()|(?<=clause\s\())?"
+    r"\s*(?P<key>\d+|[A-Za-z]+)\s*\)(?P<ws>\s*)"
+)
+
+class Marker:
+    __slots__ = ("start", "close", "ws_end", "ws_start", "key", "levels")
+
+    def __init__(self, text, m):
+        self.start = m.start()
+        self.close = m.start("ws")
+        # Markers need whitespace after ")"; subsections and clauses also a
+        # line start somewhere in the whitespace before "("
+        self.ws_end = m.end()
+        ws_start = self.start
+        while ws_start > 0 and text[ws_start - 1].isspace():
+            ws_start -= 1
+        self.ws_start = ws_start
+        self.key = key = m.group("key")
+
+        levels = set()
+        if key.isdigit():
+            if m.group("subsection_ref") is None:
+                levels.add("subsections")
+        elif key.islower():
+            if len(key) <= 2 and m.group("clause_ref") is None:
+                levels.add("clauses")
+            if not key.strip("ivx"):
+                levels.add("subclauses")
+        elif key.isupper() and len(key) == 1:
+            levels.add("subsubclauses")
+        self.levels = levels
+
+class StructureParser:
+    """
+    Single-pass hierarchical parser for one section body.
+
+    The text is tokenized once into "(...)" markers; each level of the
+    hierarchy then only walks the markers inside its slice, instead of
+    re-running every level's regex over every body at every depth.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.markers = [Marker(text, m) for m in MARKER.finditer(text)]
+        self.starts = [m.start for m in self.markers]
+
+    def _matches(self, name, s, e, lo, hi):
+        """Markers of level ``name`` in text[s:e], as (start, marker, end) in scan order."""
+        text = self.text
+        line_start = name in LINE_START_LEVELS
+        pos = s
+        found = []
+        for m in self.markers[lo:hi]:
+            if name not in m.levels or m.close > e or m.start < pos:
+                continue
+            end = min(m.ws_end, e)
+            if end <= m.close:
+                continue
+            if line_start:
+                # The marker must be the first thing on its line: some
+                # line start (or the slice start) in the whitespace before it
+                a = max(m.ws_start, pos)
+                if a == s or text[a - 1] == "\n":
+                    start = a
+                else:
+                    start = text.find("\n", a, m.start)
+                    if start < 0:
+                        continue
+            else:
+                start = m.start
+            found.append((start, m, end))
+            pos = end
+        return found
+
+    def parse(self, s=0, e=None):
+        e = len(self.text) if e is None else e
+        # Markers whose "(" lies inside the slice
+        lo = bisect.bisect_left(self.starts, s)
+        hi = bisect.bisect_left(self.starts, e)
+        if lo == hi:
+            return {"text": clean_text(self.text[s:e])}
+
+        best_name = None
+        best_matches = []
+        for name in LEVELS:
+            # Sequence-aware filtering
+            ordered = []
+            last_val = 0
+            for match in self._matches(name, s, e, lo, hi):
+                val = get_sequence_val(match[1].key, name)
+                # Allow starting at something other than 1 for first item, or specifically 1
+                if not ordered:
+                    if val > 0:
+                        ordered.append(match)
+                        last_val = val
+                elif val == last_val + 1:
+                    ordered.append(match)
                     last_val = val
-            elif val == last_val + 1:
-                ordered.append(m)
-                last_val = val
-        
-        if ordered:
-            # TIE-BREAK: 
-            # 1. Earliest start wins.
-            # 2. If same start, the one with MORE matches in sequence wins.
-            if not best_matches or ordered[0].start() < best_matches[0].start():
-                best_name = name
-                best_matches = ordered
-            elif ordered[0].start() == best_matches[0].start() and len(ordered) > len(best_matches):
-                best_name = name
-                best_matches = ordered
-
-    if not best_name:
-        return {"text": clean_text(text)}
-
-    results = {}
-    intro = text[:best_matches[0].start()].strip()
-    if intro:
-        results["intro"] = clean_text(intro)
-    
-    items = {}
-    # We pass the same level_patterns to children but they must be in sequence there too
-    for i, m in enumerate(best_matches):
-        key = m.group(1).strip()
-        start = m.end()
-        end = best_matches[i+1].start() if i+1 < len(best_matches) else len(text)
-        body = text[start:end]
-        items[key] = parse_level(body, level_patterns)
-    
-    results[best_name] = items
-    return results
+
+            if ordered:
+                # TIE-BREAK:
+                # 1. Earliest start wins.
+                # 2. If same start, the one with MORE matches in sequence wins.
+                if not best_matches or ordered[0][0] < best_matches[0][0]:
+                    best_name = name
+                    best_matches = ordered
+                elif ordered[0][0] == best_matches[0][0] and len(ordered) > len(best_matches):
+                    best_name = name
+                    best_matches = ordered
+
+        if not best_name:
+            return {"text": clean_text(self.text[s:e])}
+
+        results = {}
+        intro = self.text[s:best_matches[0][0]].strip()
+        if intro:
+            results["intro"] = clean_text(intro)
+
+        items = {}
+        # Children use the same levels but must be in sequence there too
+        for i, (_, m, body_start) in enumerate(best_matches):
+            body_end = best_matches[i + 1][0] if i + 1 < len(best_matches) else e
+            items[m.key.strip()] = self.parse(body_start, body_end)
+
+        results[best_name] = items
+        return results
+
+# Increased specificity for stopping markers to avoid greedy consumption
+STOP = r"(?=\n\s*\(\d+\)|\n\s*\(\w\)\s|\n\s*Illustration|\n\s*Explanation|\n\s*Provided that|\Z)"
+SPECIAL_BLOCKS = [
+    ("illustrations", re.compile(r"\n\s*Illustration[s]?\.(.*?)" + STOP, re.DOTALL | re.IGNORECASE)),
+    ("explanations", re.compile(r"\n\s*Explanation\.\s*—(.*?)" + STOP, re.DOTALL | re.IGNORECASE)),
+    ("provisos", re.compile(r"\n\s*Provided that\s+(.*?)" + STOP, re.DOTALL | re.IGNORECASE)),
+]
 
 def extract_special_blocks(text):
     special = {}
-    # Increased specificity for stopping markers to avoid greedy consumption
-    stop_regex = r"(?=\n\s*\(\d+\)|\n\s*\(\w\)\s|\n\s*Illustration|\n\s*Explanation|\n\s*Provided that|\Z)"
-    
-    # Extract Illustrations
-    ills = list(re.finditer(r"\n\s*Illustration[s]?\.(.*?)" + stop_regex, text, re.DOTALL | re.IGNORECASE))
-    if ills:
-        special["illustrations"] = [clean_text(i.group(1)) for i in ills]
-        for i in ills:
-            text = text.replace(i.group(0), " ")
-
-    # Extract Explanations
-    exps = list(re.finditer(r"\n\s*Explanation\.\s*—(.*?)" + stop_regex, text, re.DOTALL | re.IGNORECASE))
-    if exps:
-        special["explanations"] = [clean_text(e.group(1)) for e in exps]
-        for e in exps:
-            text = text.replace(e.group(0), " ")
-
-    # Extract Provisos
-    provs = list(re.finditer(r"\n\s*Provided that\s+(.*?)" + stop_regex, text, re.DOTALL | re.IGNORECASE))
-    if provs:
-        special["provisos"] = [clean_text(p.group(1)) for p in provs]
-        for p in provs:
-            text = text.replace(p.group(0), " ")
-            
+    for name, pattern in SPECIAL_BLOCKS:
+        matches = list(pattern.finditer(text))
+        if not matches:
+            continue
+        special[name] = [clean_text(m.group(1)) for m in matches]
+        blocks = [m.group(0) for m in matches]
+        if any(text.count(b) != 1 for b in blocks):
+            # A block's text also occurs elsewhere: replace every copy, as before
+            for b in blocks:
+                text = text.replace(b, " ")
+            continue
+        # Cut every block out in one join instead of a text.replace per block
+        pieces = []
+        last = 0
+        for m in matches:
+            pieces.append(text[last:m.start()])
+            last = m.end()
+        pieces.append(text[last:])
+        text = " ".join(pieces)
     return special, text
 
 def parse_hierarchical(text):
-    # Refined patterns
-    base_levels = [
-        ("subsections", r"(?<!sub-section\s)(?<!sub-sections\s)\(\s*(\d+)\s*\)\s+"),
-        # (a), (b)... (za), (zb)
-        ("clauses", r"(?<!section\s)(?<!clause\s)\(\s*([a-z]{1,2})\s*\)\s+"),
-        ("subclauses", r"\(\s*([ivx]+)\s*\)\s+"),
-        ("subsubclauses", r"\(\s*([A-Z])\s*\)\s+")
-    ]
-    
     special, remaining_text = extract_special_blocks(text)
-    structure = parse_level(remaining_text, base_levels)
+    structure = StructureParser(remaining_text).parse()
     if special:
         structure.update(special)
     return structure
 
-def main():
-    if not RAW_PATH.exists():
-        print("Error: raw_text.txt not found")
-        return
+TITLE_CANDIDATES = [
+    "Short title and commencement", "Definitions", "Application of Act",
+    "Grounds for processing personal data", "Notice", "Consent", "Certain legitimate uses",
+    "General obligations of Data Fiduciary", "Processing of personal data of children",
+    "Additional obligations of Significant Data Fiduciary", "Right to access information about personal data",
+    "Right to correction and erasure of personal data", "Right of grievance redressal", "Right to nominate",
+    "Duties of Data Principal", "Processing of personal data outside India", "Exemptions",
+    "Establishment of Board", "Composition and qualifications for appointment of Chairperson and Members",
+    "Salary, allowances payable to and term of office", "Disqualifications for appointment and continuation as Chairperson and Members of Board",
+    "Resignation by Members and filling of vacancy", "Proceedings of Board", "Officers and employees of Board",
+    "Members and officers to be public servants", "Powers of Chairperson", "Powers and functions of Board",
+    "Procedure to be followed by Board", "Appeal to Appellate Tribunal", "Orders passed by Appellate Tribunal to be executable as decree",
+    "Alternate dispute resolution", "Voluntary undertaking", "Penalties", "Crediting sums realized by way of penalties to Consolidated Fund of India",
+    "Protection of action taken in good faith", "Power to call for information", "Power of Central Government to issue directions",
+    "Consistency with other laws", "Bar of jurisdiction", "Power to make rules", "Laying of rules and certain notifications",
+    "Power to amend Schedule", "Power to remove difficulties", "Amendments to certain Acts",
+    "Powers of Central Government to issue directions", "Action taken in good faith",
+    "Establishing the Board", "Composition and Information about Chairperson", "Appointment of Members",
+    "Removal of Members", "Right to Nomination"
+]
+
+WORD = re.compile(r"\w+")
+
+class TitleMatcher:
+    """
+    Finds the highest-priority title candidate in a section body in one scan.
+
+    Candidates are indexed by their first word, so each word of the body is
+    one dict lookup; only candidates starting with that word are verified
+    (with the same word-bounded, case-insensitive pattern as before).
+    """
+
+    def __init__(self, candidates):
+        self.candidates = list(dict.fromkeys(candidates))
+        self.finders = [re.compile(rf"{re.escape(c)}\b", re.IGNORECASE) for c in self.candidates]
+        # Look for candidate as a standalone line or followed by dot/newline
+        self.removers = [re.compile(rf"{re.escape(c)}(\.|\s*)", re.IGNORECASE) for c in self.candidates]
+        self.by_first_word = {}
+        for idx, c in enumerate(self.candidates):
+            self.by_first_word.setdefault(WORD.match(c).group().lower(), []).append(idx)
+        self.all_indexes = list(range(len(self.candidates)))
 
-    text = RAW_PATH.read_text(encoding="utf-8")
+    def match(self, body):
+        """Return (title, body without the title), or (None, body)."""
+        best = None
+        for w in WORD.finditer(body):
+            word = w.group()
+            # Non-ASCII words may still match case-insensitively; try them all
+            indexes = self.by_first_word.get(word.lower(), ()) if word.isascii() else self.all_indexes
+            for idx in indexes:
+                if (best is None or idx < best) and self.finders[idx].match(body, w.start()):
+                    best = idx
+            if best == 0:
+                break
+        if best is None:
+            return None, body
+        return self.candidates[best], self.removers[best].sub(" ", body)
+
+def parse_act(text, act_name="Digital Personal Data Protection Act, 2023"):
+    titles = TitleMatcher(TITLE_CANDIDATES)
 
     # 1. Identify Chapters
     chapter_pattern = r"(?:CHAPTER\s+([IVXLC]+))\n(.*?)\n"
@@ -169,39 +294,8 @@ def main():
             sec_body = ch_text[sec_start:sec_end]
 
             # 3. Title Matching - search near markers
-            sec_title = "Unknown"
-            title_candidates = [
-                "Short title and commencement", "Definitions", "Application of Act",
-                "Grounds for processing personal data", "Notice", "Consent", "Certain legitimate uses",
-                "General obligations of Data Fiduciary", "Processing of personal data of children",
-                "Additional obligations of Significant Data Fiduciary", "Right to access information about personal data",
-                "Right to correction and erasure of personal data", "Right of grievance redressal", "Right to nominate",
-                "Duties of Data Principal", "Processing of personal data outside India", "Exemptions",
-                "Establishment of Board", "Composition and qualifications for appointment of Chairperson and Members",
-                "Salary, allowances payable to and term of office", "Disqualifications for appointment and continuation as Chairperson and Members of Board",
-                "Resignation by Members and filling of vacancy", "Proceedings of Board", "Officers and employees of Board",
-                "Members and officers to be public servants", "Powers of Chairperson", "Powers and functions of Board",
-                "Procedure to be followed by Board", "Appeal to Appellate Tribunal", "Orders passed by Appellate Tribunal to be executable as decree",
-                "Alternate dispute resolution", "Voluntary undertaking", "Penalties", "Crediting sums realized by way of penalties to Consolidated Fund of India",
-                "Protection of action taken in good faith", "Power to call for information", "Power of Central Government to issue directions",
-                "Consistency with other laws", "Bar of jurisdiction", "Power to make rules", "Laying of rules and certain notifications",
-                "Power to amend Schedule", "Power to remove difficulties", "Amendments to certain Acts",
-                "Powers of Central Government to issue directions", "Action taken in good faith", "Power to call for information",
-                "Power to amend Schedule", "Power to remove difficulties", "Amendments to certain Acts",
-                "Powers of Central Government to issue directions", "Establishing the Board",
-                "Composition and Information about Chairperson", "Appointment of Members",
-                "Removal of Members", "Right to Nomination"
-            ]
-            
-            for cand in title_candidates:
-                # Look for candidate as a standalone line or followed by dot/newline
-                # Use \b for word boundary and allow some flexibility for punctuation
-                if re.search(rf"\b{re.escape(cand)}\b", sec_body, re.IGNORECASE):
-                    sec_title = cand
-                    sec_body = re.sub(rf"{re.escape(cand)}(\.|\s*)", " ", sec_body, flags=re.IGNORECASE)
-                    break
-            
-            if sec_title == "Unknown":
+            sec_title, sec_body = titles.match(sec_body)
+            if sec_title is None:
                 # Fallback: Try to find a line that looks like a title (short, no punctuation at end)
                 # Or just use "Section " + number
                 sec_title = f"Section {sec_num}"
@@ -225,16 +319,65 @@ def main():
     schedule_match = re.search(r"THE\s+SCHEDULE\s*(.*)", text, re.DOTALL | re.IGNORECASE)
     schedule_text = schedule_match.group(1).strip() if schedule_match else "None"
 
-    final_output = {
-        "act_name": "Digital Personal Data Protection Act, 2023",
+    return {
+        "act_name": act_name,
         "chapters": chapters,
         "schedule": schedule_text
     }
 
-    with open(OUT_JSON, "w", encoding="utf-8") as f:
+def first_difference(a, b, path="$"):
+    """Path of the first place two parsed structures differ, or None."""
+    if type(a) is not type(b):
+        return f"{path}: {type(a).__name__} != {type(b).__name__}"
+    if isinstance(a, dict):
+        if list(a) != list(b):
+            return f"{path}: keys {list(a)} != {list(b)}"
+        for k in a:
+            diff = first_difference(a[k], b[k], f"{path}.{k}")
+            if diff:
+                return diff
+        return None
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return f"{path}: {len(a)} items != {len(b)}"
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff = first_difference(x, y, f"{path}[{i}]")
+            if diff:
+                return diff
+        return None
+    return None if a == b else f"{path}: {a!r} != {b!r}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Split normalized Act text into hierarchical sections.json")
+    parser.add_argument("--input", default=str(RAW_PATH))
+    parser.add_argument("--output", default=str(OUT_JSON))
+    parser.add_argument("--act-name", default="Digital Personal Data Protection Act, 2023")
+    parser.add_argument("--check", action="store_true",
+                        help="Differential test: parse and compare with the existing output instead of writing it")
+    args = parser.parse_args()
+
+    raw_path = Path(args.input)
+    out_path = Path(args.output)
+    if not raw_path.exists():
+        print(f"Error: {raw_path} not found")
+        return
+
+    final_output = parse_act(raw_path.read_text(encoding="utf-8"), args.act_name)
+
+    if args.check:
+        with open(out_path, encoding="utf-8") as f:
+            expected = json.load(f)
+        diff = first_difference(final_output, expected)
+        if diff:
+            print(f"MISMATCH against {out_path} at {diff}")
+            sys.exit(1)
+        print(f"OK: parse matches {out_path}")
+        return
+
+    with open(out_path, "w", encoding="utf-8") as f:
         json.dump(final_output, f, indent=2, ensure_ascii=False)
 
-    print(f"Successfully created {OUT_JSON} (Hierarchical V2)")
+    print(f"Successfully created {out_path} (Hierarchical V2)")
 
 if __name__ == "__main__":
     main()
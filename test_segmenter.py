@@ -0,0 +1,30 @@
+import os
+import sys
+
+# Add backend to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "backend")))
+
+from segmenter import dedupe
+
+
+def test_findings_differing_only_by_control_id_stay_separate():
+    findings = [
+        "Scanner finding CWE-311 on host db01: sensitive data transmitted without encryption",
+        "Scanner finding CWE-79 on host db01: sensitive data transmitted without encryption",
+        "OWASP:A02:2021 issue reported on the customer portal login page",
+        "OWASP:A03:2021 issue reported on the customer portal login page",
+        "Control ISO 27001 A.8.24 not implemented for the payments database",
+        "Control ISO 27001 A.8.12 not implemented for the payments database",
+    ]
+    unique, occurrences = dedupe(findings)
+    assert occurrences == [0, 1, 2, 3, 4, 5]
+    assert unique == findings
+
+
+def test_same_control_id_still_merges():
+    findings = [
+        "Scanner finding CWE-311 on host db01: sensitive data transmitted without encryption",
+        "Scanner finding CWE-311 on host db02: sensitive data transmitted without encryption",
+    ]
+    unique, occurrences = dedupe(findings)
+    assert occurrences == [0, 0]